@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# benchmarks/memory.py - Measures memory used by decoded packets
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Reports the number of bytes retained per decoded frame, for a history of
+decoded packets kept in memory.
+
+Run from the root of the repository with::
+
+    python3 -m benchmarks.memory
+"""
+
+from __future__ import absolute_import
+
+from argparse import ArgumentParser
+import gc
+import tracemalloc
+from typing import Dict
+
+from cbus.protocol.packet import decode_packet
+
+# Sample frames, as they would be received from the PCI.
+FRAMES = {
+    'lighting_on': b'05013800790841\r\n',
+    'lighting_ramp': b'0501380002087F39\r\n',
+    'multiple_sals': b'05013800010879027903C2\r\n',
+    'extended_cal': (b'86999900F9003800A8AA0200000000000000000000000000000000'
+                     b'000000C3\r\n'),
+}  # type: Dict[str, bytes]
+
+
+def measure(frame: bytes, count: int) -> float:
+    """
+    Decodes ``frame`` ``count`` times, keeping every result, and returns the
+    number of bytes allocated per decoded packet.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        history = [decode_packet(frame)[0] for _ in range(count)]
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # The list holding the history is not part of the packet.
+    current -= len(history) * 8
+    del history
+    return current / count
+
+
+def main():
+    parser = ArgumentParser(
+        'Measures the memory retained by decoded packets.')
+    parser.add_argument(
+        '-n', '--count', type=int, default=100000,
+        help='Number of copies of each frame to decode [default: %(default)s]')
+    option = parser.parse_args()
+
+    for name, frame in FRAMES.items():
+        p, _ = decode_packet(frame)
+        assert p is not None and not hasattr(p, 'exception'), name
+        print(f'{name:16} {measure(frame, option.count):8.1f} bytes/frame')
+
+
+if __name__ == '__main__':
+    main()
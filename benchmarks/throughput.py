@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# benchmarks/throughput.py - Measures encoder and decoder throughput
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the throughput of the packet codecs, the protocol buffer, CBZ
+parsing and cmqttd's message handling, in items per second.
+
+Results are compared with a JSON baseline (``benchmarks/baseline.json``),
+so regressions show up as a negative change. Run from the root of the
+repository with::
+
+    python3 -m benchmarks.throughput
+
+After an intentional change in performance, record a new baseline with::
+
+    python3 -m benchmarks.throughput --save benchmarks/baseline.json
+"""
+
+from __future__ import absolute_import
+
+from argparse import ArgumentParser
+import json
+import os.path
+import platform
+import sys
+import timeit
+from typing import Callable, Dict, Optional, Text, Tuple
+
+from cbus.common import Application
+from cbus.protocol.application.lighting import (
+    LightingOffSAL, LightingOnSAL, LightingRampSAL)
+from cbus.protocol.base_packet import BasePacket
+from cbus.protocol.cbus_protocol import CBusProtocol
+from cbus.protocol.packet import decode_packet
+from cbus.protocol.pm_packet import PointToMultipointPacket
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCHMARKS_DIR, os.pardir, 'tests', 'data')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+# Sample frames, as they would be received from the PCI, unless noted.
+FRAMES = {
+    'pm_lighting': b'05013800790841\r\n',
+    'pm_multiple_sals': b'05013800010879027903C2\r\n',
+    'pp_reply': b'8604990082300328\r\n',
+    'pp_extended_cal': (b'86999900F9003800A8AA0200000000000000000000000000'
+                        b'000000000000C3\r\n'),
+    'confirmation': b'g.',
+}  # type: Dict[Text, bytes]
+
+# Device management frames are only sent to the PCI.
+DM_FRAME = b'A3210038g\r'
+
+# A benchmark returns a function to time, and the number of items (frames,
+# files or messages) it handles per call.
+Benchmark = Callable[[], Tuple[Callable[[], object], int]]
+BENCHMARKS = {}  # type: Dict[Text, Benchmark]
+
+
+def benchmark(name: Text):
+    def register(f: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = f
+        return f
+    return register
+
+
+def _decode(frame: bytes, **kwargs) -> Benchmark:
+    def setup():
+        p, _ = decode_packet(frame, **kwargs)
+        assert p is not None and not hasattr(p, 'exception'), frame
+        return lambda: decode_packet(frame, **kwargs), 1
+    return setup
+
+
+for _name, _frame in FRAMES.items():
+    benchmark(f'decode_{_name}')(_decode(_frame))
+benchmark('decode_dm')(
+    _decode(DM_FRAME, checksum=False, strict=False, from_pci=False))
+
+
+@benchmark('encode_pm_lighting')
+def encode_pm_lighting():
+    p = PointToMultipointPacket(sals=[
+        LightingOnSAL(1), LightingOffSAL(2), LightingRampSAL(3, 4, 128)])
+    return p.encode_packet, 1
+
+
+class _CountingProtocol(CBusProtocol):
+    def __init__(self):
+        super().__init__(emulate_pci=False)
+        self.count = 0
+
+    def handle_cbus_packet(self, p: BasePacket) -> None:
+        self.count += 1
+
+
+@benchmark('data_received')
+def data_received():
+    # A chunk of frames, as they would arrive from a busy network. This must
+    # fit in the protocol's buffer.
+    frames = [FRAMES['pm_lighting'], FRAMES['pm_multiple_sals'],
+              FRAMES['pp_extended_cal'], FRAMES['confirmation']] * 2
+    chunk = b''.join(frames)
+    protocol = _CountingProtocol()
+    protocol.data_received(chunk)
+    assert protocol.count == len(frames)
+    return lambda: protocol.data_received(chunk), len(frames)
+
+
+@benchmark('cbz_parse')
+def cbz_parse():
+    from cbus.toolkit.cbz import CBZ, CBZException
+
+    def loads(path: Text) -> bool:
+        try:
+            with open(path, 'rb') as fh:
+                CBZ(fh)
+        except CBZException:
+            return False
+        return True
+
+    # Some test files are meant to be rejected.
+    paths = [os.path.join(DATA_DIR, f)
+             for f in sorted(os.listdir(DATA_DIR)) if f.endswith('.cbz')]
+    paths = [path for path in paths if loads(path)]
+
+    def parse():
+        for path in paths:
+            with open(path, 'rb') as fh:
+                CBZ(fh)
+
+    return parse, len(paths)
+
+
+class _StubHandler:
+    network = None
+    applications = [int(Application.LIGHTING)]
+
+    def lighting_group_on(self, group_addr, application):
+        pass
+
+    def lighting_group_off(self, group_addr, application):
+        pass
+
+    def lighting_group_ramp(self, group_addr, duration, level, application):
+        pass
+
+
+@benchmark('cmqttd_on_message')
+def cmqttd_on_message():
+    from paho.mqtt.client import Client, MQTTMessage, MQTTMessageInfo
+    from cbus.daemon import cmqttd
+
+    class StubClient(Client):
+        """Accepts every message, without a broker."""
+        def publish(self, topic, payload=None, qos=0, retain=False,
+                    properties=None):
+            return MQTTMessageInfo(0)
+
+    class BenchmarkClient(cmqttd.MqttClient, StubClient):
+        pass
+
+    client = BenchmarkClient()
+    handlers = [_StubHandler()]
+
+    # Two rounds of messages, where every light changes state between
+    # rounds, so that publishing is never skipped as a duplicate.
+    rounds = ([], [])
+    for ga in range(64):
+        kind = ga % 4
+        for i, messages in enumerate(rounds):
+            if kind < 2:
+                on = (kind + i) % 2 == 0
+                payload = {'state': 'ON' if on else 'OFF'}
+            else:
+                payload = {'state': 'ON', 'brightness': ga * 2 + i}
+                if kind == 3:
+                    payload['transition'] = 4
+            msg = MQTTMessage(topic=cmqttd.set_topic(ga).encode())
+            msg.payload = json.dumps(payload).encode()
+            messages.append(msg)
+
+    count = [0]
+
+    def on_message():
+        messages = rounds[count[0] % 2]
+        count[0] += 1
+        for msg in messages:
+            client.on_message(client, handlers, msg)
+
+    return on_message, len(rounds[0])
+
+
+def measure(f: Callable[[], object], items: int, repeat: int) -> float:
+    """Returns the best rate of ``f``, in items per second."""
+    timer = timeit.Timer(f)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return number * items / best
+
+
+def load_baseline(path: Text) -> Optional[Dict[Text, float]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)['results']
+
+
+def main():
+    parser = ArgumentParser(
+        description='Measures encoder and decoder throughput.')
+    parser.add_argument(
+        '-k', '--filter', default='',
+        help='Only run benchmarks with names containing this string')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='Number of times to repeat each benchmark [default: '
+             '%(default)s]')
+    parser.add_argument(
+        '-b', '--baseline', default=DEFAULT_BASELINE, metavar='FILE',
+        help='JSON baseline to compare results with [default: %(default)s]')
+    parser.add_argument(
+        '-s', '--save', metavar='FILE',
+        help='Save results as a JSON baseline')
+    option = parser.parse_args()
+
+    baseline = load_baseline(option.baseline) or {}
+    results = {}  # type: Dict[Text, float]
+    for name, setup in BENCHMARKS.items():
+        if option.filter not in name:
+            continue
+        rate = results[name] = measure(*setup(), option.repeat)
+        line = f'{name:24} {rate:12,.0f} /s'
+        if name in baseline:
+            change = (rate / baseline[name] - 1) * 100
+            line += f' {change:+7.1f}%'
+        print(line)
+
+    if option.save:
+        with open(option.save, 'w') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': sys.platform,
+                'results': {k: round(v, 1) for k, v in results.items()},
+            }, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+
+
+if __name__ == '__main__':
+    main()
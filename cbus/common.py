@@ -356,11 +356,7 @@ def cbus_checksum(i: bytes) -> int:
 
     :returns: The checksum value of the given input
     """
-    c = 0
-    for x in i:
-        c += x
-
-    c = ((c & 0xff) ^ 0xff) + 1
+    c = ((sum(i) & 0xff) ^ 0xff) + 1
 
     return c & 0xff
 
@@ -388,9 +384,9 @@ def validate_cbus_checksum(i: bytes) -> bool:
 
     :returns: True if the checksum is correct, False otherwise.
     """
-    packet_checksum = i[-1]
-    actual_checksum = get_real_cbus_checksum(i)
-    return packet_checksum == actual_checksum
+    # The checksum is the two's complement of the sum of all other bytes, so
+    # a message with a correct checksum sums to 0 (mod 256).
+    return len(i) > 0 and sum(i) & 0xff == 0
 
 
 def get_real_cbus_checksum(i: bytes) -> int:
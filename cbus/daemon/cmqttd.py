@@ -15,11 +15,15 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this library.  If not, see <http://www.gnu.org/licenses/>.
 
-from asyncio import get_event_loop, run
+from asyncio import Future, TimerHandle, create_task, get_event_loop, run
 from argparse import ArgumentParser, FileType
+from collections import OrderedDict
+from functools import partial
 import json
 import logging
-from typing import Any, BinaryIO, Dict, Optional, Text, TextIO
+from typing import (
+    Any, BinaryIO, Dict, Iterable, List, Optional, Text, TextIO, Tuple,
+    Union)
 
 import paho.mqtt.client as mqtt
 
@@ -30,9 +34,12 @@ except ImportError:
         raise ImportError('Serial device support requires pyserial-asyncio')
 
 from cbus.common import MIN_GROUP_ADDR, MAX_GROUP_ADDR, check_ga, Application
-from cbus.paho_asyncio import AsyncioHelper
+from cbus.paho_asyncio import AsyncioHelper, AsyncioPublisher
+from cbus.protocol.packet import PacketCache
 from cbus.protocol.pciprotocol import PCIProtocol
 from cbus.toolkit.cbz import CBZ
+from cbus.toolkit.label_cache import (
+    LABEL_PATHS, NetworkLabels, load_project_labels, read_project_labels)
 
 
 logger = logging.getLogger(__name__)
@@ -44,13 +51,90 @@ _TOPIC_CONF_SUFFIX = '/config'
 _TOPIC_STATE_SUFFIX = '/state'
 _META_TOPIC = 'homeassistant/binary_sensor/cbus_cmqttd'
 
+# MQTT wildcards must match an entire topic level, so this also matches lights
+# belonging to other integrations. on_message ignores those.
+_SET_SUBSCRIPTION = 'homeassistant/light/+' + _TOPIC_SET_SUFFIX
+
 
 def ga_range():
     return range(MIN_GROUP_ADDR, MAX_GROUP_ADDR + 1)
 
 
+def _topic_table(prefix: Text, suffix: Text) -> Tuple[Text, ...]:
+    return tuple(prefix + str(ga) + suffix for ga in ga_range())
+
+
+def _light_id_parts(network: Optional[int], application: int) -> List[Text]:
+    """
+    Gets the parts identifying a lighting application on a network, for use
+    in topics, unique IDs and names.
+
+    The main lighting application on the default network has no parts, so
+    that topics are unchanged when only that is used.
+    """
+    parts = []
+    if network is not None:
+        parts.append(str(network))
+    if application != Application.LIGHTING:
+        parts.append(f'app{application:02x}')
+    return parts
+
+
+class _Topics:
+    """
+    Topics for each group address of a lighting application on a network,
+    indexed by group address.
+    """
+
+    def __init__(self, network: Optional[int], application: int):
+        self.network = network
+        self.application = application
+        ident = ''.join(
+            p + '_' for p in _light_id_parts(network, application))
+        light = _LIGHT_TOPIC_PREFIX + ident
+        binsensor = _BINSENSOR_TOPIC_PREFIX + ident
+
+        self.light = _topic_table(light, '')
+        self.set = _topic_table(light, _TOPIC_SET_SUFFIX)
+        self.state = _topic_table(light, _TOPIC_STATE_SUFFIX)
+        self.conf = _topic_table(light, _TOPIC_CONF_SUFFIX)
+        self.bin_state = _topic_table(binsensor, _TOPIC_STATE_SUFFIX)
+        self.bin_conf = _topic_table(binsensor, _TOPIC_CONF_SUFFIX)
+
+        # Light topic -> group address
+        self.group_addresses = {
+            topic: ga
+            for topics in (self.light, self.set, self.state, self.conf)
+            for ga, topic in zip(ga_range(), topics)
+        }  # type: Dict[Text, int]
+
+        # Set topic -> group address
+        self.set_group_addresses = {
+            topic: ga for ga, topic in zip(ga_range(), self.set)
+        }  # type: Dict[Text, int]
+
+
+_TOPICS = {}  # type: Dict[Tuple[Optional[int], int], _Topics]
+
+
+def _get_topics(network: Optional[int] = None,
+                application: int = Application.LIGHTING) -> _Topics:
+    key = (network, int(application))
+    topics = _TOPICS.get(key)
+    if topics is None:
+        topics = _TOPICS[key] = _Topics(*key)
+    return topics
+
+
 def get_topic_group_address(topic: Text) -> int:
-    """Gets the group address for the given topic."""
+    """
+    Gets the group address for the given topic, on the main lighting
+    application of the default network.
+    """
+    ga = _get_topics().group_addresses.get(topic)
+    if ga is not None:
+        return ga
+
     if not topic.startswith(_LIGHT_TOPIC_PREFIX):
         raise ValueError(
             f'Invalid topic {topic}, must start with {_LIGHT_TOPIC_PREFIX}')
@@ -59,29 +143,44 @@ def get_topic_group_address(topic: Text) -> int:
     return ga
 
 
-def set_topic(group_addr: int) -> Text:
+def set_topic(group_addr: int, network: Optional[int] = None,
+              application: int = Application.LIGHTING) -> Text:
     """Gets the Set topic for a group address."""
-    return _LIGHT_TOPIC_PREFIX + str(group_addr) + _TOPIC_SET_SUFFIX
+    check_ga(group_addr)
+    return _get_topics(network, application).set[
+        group_addr - MIN_GROUP_ADDR]
 
 
-def state_topic(group_addr: int) -> Text:
+def state_topic(group_addr: int, network: Optional[int] = None,
+                application: int = Application.LIGHTING) -> Text:
     """Gets the State topic for a group address."""
-    return _LIGHT_TOPIC_PREFIX + str(group_addr) + _TOPIC_STATE_SUFFIX
+    check_ga(group_addr)
+    return _get_topics(network, application).state[
+        group_addr - MIN_GROUP_ADDR]
 
 
-def conf_topic(group_addr: int) -> Text:
+def conf_topic(group_addr: int, network: Optional[int] = None,
+               application: int = Application.LIGHTING) -> Text:
     """Gets the Config topic for a group address."""
-    return _LIGHT_TOPIC_PREFIX + str(group_addr) + _TOPIC_CONF_SUFFIX
+    check_ga(group_addr)
+    return _get_topics(network, application).conf[
+        group_addr - MIN_GROUP_ADDR]
 
 
-def bin_sensor_state_topic(group_addr: int) -> Text:
+def bin_sensor_state_topic(group_addr: int, network: Optional[int] = None,
+                           application: int = Application.LIGHTING) -> Text:
     """Gets the Binary Sensor State topic for a group address."""
-    return _BINSENSOR_TOPIC_PREFIX + str(group_addr) + _TOPIC_STATE_SUFFIX
+    check_ga(group_addr)
+    return _get_topics(network, application).bin_state[
+        group_addr - MIN_GROUP_ADDR]
 
 
-def bin_sensor_conf_topic(group_addr: int) -> Text:
+def bin_sensor_conf_topic(group_addr: int, network: Optional[int] = None,
+                          application: int = Application.LIGHTING) -> Text:
     """Gets the Binary Sensor Config topic for a group address."""
-    return _BINSENSOR_TOPIC_PREFIX + str(group_addr) + _TOPIC_CONF_SUFFIX
+    check_ga(group_addr)
+    return _get_topics(network, application).bin_conf[
+        group_addr - MIN_GROUP_ADDR]
 
 
 class CBusHandler(PCIProtocol):
@@ -90,54 +189,190 @@ class CBusHandler(PCIProtocol):
     """
     mqtt_api = None
 
-    def __init__(self, labels: Optional[Dict[int, Text]], *args, **kwargs):
+    def __init__(self, labels: Optional[Dict[int, Dict[int, Text]]], *args,
+                 network: Optional[int] = None, **kwargs):
+        """
+        :param labels: Names of group addresses, for each lighting
+            application to expose on MQTT. If None or empty, only the main
+            lighting application (0x38) is exposed, without labels.
+        :param network: Network number to use in MQTT topics for this PCI,
+            or None to use topics without a network number.
+
+        Other arguments are passed to ``PCIProtocol``.
+        """
         super().__init__(*args, **kwargs)
-        self.labels = (
-            labels if labels is not None else {})  # type: Dict[int, Text]
-
-
-    def on_lighting_group_ramp(self, source_addr, group_addr, duration, level):
-        if not self.mqtt_api:
+        self.labels = labels or {
+            Application.LIGHTING: {}}  # type: Dict[int, Dict[int, Text]]
+        self.network = network
+
+    @property
+    def applications(self) -> Iterable[int]:
+        """Lighting applications which are exposed on MQTT."""
+        return self.labels.keys()
+
+    def on_lighting_group_ramp(self, source_addr, group_addr, duration, level,
+                               application):
+        if not self.mqtt_api or application not in self.labels:
             return
         self.mqtt_api.lighting_group_ramp(
-            source_addr, group_addr, duration, level)
+            source_addr, group_addr, duration, level, network=self.network,
+            application=application)
 
-    def on_lighting_group_on(self, source_addr, group_addr):
-        if not self.mqtt_api:
+    def on_lighting_group_on(self, source_addr, group_addr, application):
+        if not self.mqtt_api or application not in self.labels:
             return
-        self.mqtt_api.lighting_group_on(source_addr, group_addr)
+        self.mqtt_api.lighting_group_on(
+            source_addr, group_addr, network=self.network,
+            application=application)
 
-    def on_lighting_group_off(self, source_addr, group_addr):
-        if not self.mqtt_api:
+    def on_lighting_group_off(self, source_addr, group_addr, application):
+        if not self.mqtt_api or application not in self.labels:
             return
-        self.mqtt_api.lighting_group_off(source_addr, group_addr)
-
-    # TODO: on_lighting_group_terminate_ramp
+        self.mqtt_api.lighting_group_off(
+            source_addr, group_addr, network=self.network,
+            application=application)
+
+    def on_lighting_group_terminate_ramp(
+            self, source_addr, group_addr, application):
+        # The group stops at the level it had ramped to, which is estimated
+        # from when the ramp started.
+        level = self.get_group_level(group_addr, application)
+        if level is not None:
+            self._publish_level(source_addr, group_addr, level, application)
+        elif self.mqtt_api and application in self.labels:
+            # The ramp started from an unknown level, so ask the units where
+            # it stopped. Their report is published when it arrives.
+            try:
+                self.request_group_levels(group_addr, application)
+            except IOError as e:
+                logger.warning(
+                    f'Could not request level of group {group_addr}: {e}')
+
+    def on_lighting_group_level_report(self, application, group_addr, level):
+        self._publish_level(None, group_addr, level, application)
+
+    def _publish_level(self, source_addr, group_addr, level, application):
+        if not self.mqtt_api or application not in self.labels:
+            return
+        if level:
+            self.mqtt_api.lighting_group_ramp(
+                source_addr, group_addr, 0, level, network=self.network,
+                application=application)
+        else:
+            self.mqtt_api.lighting_group_off(
+                source_addr, group_addr, network=self.network,
+                application=application)
 
     def on_clock_request(self, source_addr):
         self.clock_datetime()
 
+    async def refresh_all_levels(self):
+        """Requests the level of every lighting group, logging any errors."""
+        for application in list(self.applications):
+            try:
+                await self.refresh_levels(application)
+            except IOError as e:
+                logger.warning('Could not refresh group levels for '
+                               'application %x', application, exc_info=e)
+
+
+# MQTT client userdata: one or more PCIs.
+Handlers = Union[CBusHandler, Iterable[CBusHandler]]
+
+
+def _handlers(userdata: Handlers) -> Iterable[CBusHandler]:
+    if isinstance(userdata, CBusHandler):
+        return (userdata,)
+    return userdata
+
 
 class MqttClient(mqtt.Client):
+    """
+    MQTT client for cmqttd.
+
+    ``userdata`` is a ``CBusHandler``, or a list of ``CBusHandler`` for
+    each network. Each handler on the list must have a different
+    ``network``.
+    """
 
-    def on_connect(self, client, userdata: CBusHandler, flags, rc):
+    def __init__(self, *args, publish_window: float = 0.,
+                 publish_queue: int = 0,
+                 unit_names: Optional[
+                     Dict[Optional[int], Dict[int, Text]]] = None,
+                 **kwargs):
+        """
+        :param publish_window: Number of seconds to wait before publishing a
+            group's state, so that a burst of events for the same group is
+            published once. If 0, states are published immediately.
+        :param publish_queue: Maximum number of state messages waiting to be
+            sent to the broker. If non-zero, messages are published by an
+            asyncio task, so that a slow broker does not hold up C-Bus
+            events. Configuration messages are never dropped. If 0, messages
+            are passed straight to paho.
+        :param unit_names: Names of units for each network number, which are
+            published as the ``cbus_source_name`` of a state.
+
+        Other arguments are passed to ``paho.mqtt.client.Client``.
+        """
+        super().__init__(*args, **kwargs)
+        self._publish_window = publish_window
+        self.unit_names = unit_names or {}
+        self._publish_timer = None  # type: Optional[TimerHandle]
+        self._publisher = (
+            AsyncioPublisher(super().publish, publish_queue)
+            if publish_queue else None)  # type: Optional[AsyncioPublisher]
+
+        # (labels, serialised discovery payloads) from the last
+        # publish_all_lights call, by (network, application).
+        self._discovery_cache = {}  # type: Dict[Tuple, Tuple]
+
+        # Last state published for each (network, application, group), as
+        # (state, brightness).
+        self._published_states = {}  # type: Dict[Tuple, Tuple[Text, int]]
+
+        # States waiting for publish_window to elapse, by
+        # (network, application, group).
+        self._pending_states = OrderedDict(
+        )  # type: Dict[Tuple, Tuple[Optional[int], Text, int, int, bool]]
+
+    def on_connect(self, client, userdata: Handlers, flags, rc):
         logger.info('Connected to MQTT broker')
-        userdata.mqtt_api = self
-        self.subscribe([(set_topic(ga), 2) for ga in ga_range()])
-        self.publish_all_lights(userdata.labels)
+        if self._publisher is not None:
+            self._publisher.on_connect()
 
-    def on_message(self, client, userdata: CBusHandler, msg: mqtt.MQTTMessage):
-        """Handle a message from an MQTT subscription."""
-        if not (msg.topic.startswith(_LIGHT_TOPIC_PREFIX) and
-                msg.topic.endswith(_TOPIC_SET_SUFFIX)):
-            return
+        # The broker may have lost retained states, so publish everything.
+        self._published_states.clear()
+        self.subscribe(_SET_SUBSCRIPTION, 2)
+        self.publish_meta_device()
 
-        try:
-            ga = get_topic_group_address(msg.topic)
-        except ValueError:
-            # Invalid group address
-            logging.error(f'Invalid group address in topic {msg.topic}')
+        for handler in _handlers(userdata):
+            handler.mqtt_api = self
+            for application, labels in handler.labels.items():
+                self.publish_all_lights(
+                    labels, network=handler.network, application=application)
+
+            # Publish the current state of all groups.
+            create_task(handler.refresh_all_levels())
+
+    def on_disconnect(self, client, userdata: Handlers, rc):
+        logger.info('Disconnected from MQTT broker')
+        if self._publisher is not None:
+            self._publisher.on_disconnect()
+
+    def on_publish(self, client, userdata: Handlers, mid: int):
+        if self._publisher is not None:
+            self._publisher.on_publish(mid)
+
+    def on_message(self, client, userdata: Handlers, msg: mqtt.MQTTMessage):
+        """Handle a message from an MQTT subscription."""
+        handler, application, ga = self._route(userdata, msg.topic)
+        if handler is None:
+            if msg.topic.startswith(_LIGHT_TOPIC_PREFIX):
+                # Invalid group address, or unknown network or application
+                logging.error(f'Invalid group address in topic {msg.topic}')
+            # Otherwise, this is a light from another integration.
             return
+        network = handler.network
 
         # https://www.home-assistant.io/integrations/light.mqtt/#json-schema
         try:
@@ -159,24 +394,63 @@ class MqttClient(mqtt.Client):
         if light_on:
             if brightness == 255 and transition_time == 0:
                 # lighting on
-                userdata.lighting_group_on(ga)
-                self.lighting_group_on(None, ga)
+                handler.lighting_group_on(ga, application)
+                self.lighting_group_on(
+                    None, ga, network=network, application=application)
             else:
                 # ramp
-                userdata.lighting_group_ramp(ga, transition_time, brightness)
-                self.lighting_group_ramp(None, ga, transition_time, brightness)
+                handler.lighting_group_ramp(
+                    ga, transition_time, brightness, application)
+                self.lighting_group_ramp(
+                    None, ga, transition_time, brightness, network=network,
+                    application=application)
         else:
             # lighting off
-            userdata.lighting_group_off(ga)
-            self.lighting_group_off(None, ga)
-
-    def publish(self, topic: Text, payload: Dict[Text, Any]):
+            handler.lighting_group_off(ga, application)
+            self.lighting_group_off(
+                None, ga, network=network, application=application)
+
+    @staticmethod
+    def _route(userdata: Handlers, topic: Text
+               ) -> Tuple[Optional[CBusHandler], int, int]:
+        """
+        Finds the PCI, lighting application and group address for a Set
+        topic.
+
+        :returns: Tuple of (handler, application, group address). handler is
+            None if the topic is not for any known group address.
+        """
+        for handler in _handlers(userdata):
+            for application in handler.applications:
+                ga = _get_topics(
+                    handler.network, application).set_group_addresses.get(
+                    topic)
+                if ga is not None:
+                    return handler, application, ga
+        return None, 0, 0
+
+    def publish(self, topic: Text, payload: Dict[Text, Any],
+                droppable: bool = True):
         """Publishes a payload as JSON."""
-        payload = json.dumps(payload)
+        return self._publish_retained(topic, json.dumps(payload), droppable)
+
+    def _publish_retained(self, topic: Text, payload: Text,
+                          droppable: bool = True):
+        """
+        Publishes a retained message with QoS 1.
+
+        :param droppable: If False, the message is never dropped from a full
+            ``publish_queue``. Use this for configuration topics.
+        :returns: Future which resolves when the broker acknowledges the
+            message if ``publish_queue`` is set, otherwise
+            ``paho.mqtt.client.MQTTMessageInfo``.
+        """
+        if self._publisher is not None:
+            return self._publisher.publish(topic, payload, 1, True, droppable)
         return super().publish(topic, payload, 1, True)
 
-    def publish_all_lights(self, labels: Dict[int, Text]):
-        """Publishes a configuration topic for all lights."""
+    def publish_meta_device(self):
+        """Publishes a configuration topic for the cmqttd meta-device."""
         # Meta-device which holds all the C-Bus group addresses
         self.publish(_META_TOPIC + _TOPIC_CONF_SUFFIX, {
             '~': _META_TOPIC,
@@ -190,78 +464,199 @@ class MqttClient(mqtt.Client):
                 'manufacturer': 'micolous',
                 'model': 'libcbus',
             },
-        })
-
+        }, droppable=False)
+
+    def publish_all_lights(self, labels: Dict[int, Text],
+                           network: Optional[int] = None,
+                           application: int = Application.LIGHTING):
+        """
+        Publishes a configuration topic for all lights of a lighting
+        application on a network.
+        """
+        for topic, payload in self._get_discovery_payloads(
+                labels, network, application):
+            self._publish_retained(topic, payload, droppable=False)
+
+    def _get_discovery_payloads(
+            self, labels: Dict[int, Text], network: Optional[int] = None,
+            application: int = Application.LIGHTING
+    ) -> List[Tuple[Text, Text]]:
+        """
+        Gets the serialised configuration topics for all lights of a lighting
+        application on a network.
+
+        These are cached for the last set of labels used on each network and
+        application.
+        """
+        key = (network, int(application))
+        cache = self._discovery_cache.get(key)
+        if cache is not None and cache[0] == labels:
+            return cache[1]
+
+        topics = _get_topics(network, application)
+        parts = _light_id_parts(network, application)
+        payloads = []
         for ga in ga_range():
-            name = labels.get(ga,  f'C-Bus Light {ga:03d}')
-            self.publish(conf_topic(ga), {
+            i = ga - MIN_GROUP_ADDR
+            uid = '_'.join(parts + [str(ga)])
+            default_name = 'C-Bus Light ' + '/'.join(parts + [f'{ga:03d}'])
+            name = labels.get(ga, default_name)
+            payloads.append((topics.conf[i], {
                 'name': name,
-                'unique_id': f'cbus_light_{ga}',
-                'cmd_t': set_topic(ga),
-                'stat_t': state_topic(ga),
+                'unique_id': f'cbus_light_{uid}',
+                'cmd_t': topics.set[i],
+                'stat_t': topics.state[i],
                 'schema': 'json',
                 'brightness': True,
                 'device': {
-                    'identifiers': [f'cbus_light_{ga}'],
-                    'connections': [['cbus_group_address', str(ga)]],
+                    'identifiers': [f'cbus_light_{uid}'],
+                    'connections': [['cbus_group_address', uid]],
                     'sw_version': 'cmqttd https://github.com/micolous/cbus',
-                    'name': f'C-Bus Light {ga:03d}',
+                    'name': default_name,
                     'manufacturer': 'Clipsal',
                     'model': 'C-Bus Lighting Application',
                     'via_device': 'cmqttd',
                 },
-            })
+            }))
 
-            self.publish(bin_sensor_conf_topic(ga), {
+            payloads.append((topics.bin_conf[i], {
                 'name': f'{name} (as binary sensor)',
-                'unique_id': f'cbus_bin_sensor_{ga}',
-                'stat_t': bin_sensor_state_topic(ga),
+                'unique_id': f'cbus_bin_sensor_{uid}',
+                'stat_t': topics.bin_state[i],
                 'device': {
-                    'identifiers': [f'cbus_bin_sensor_{ga}'],
-                    'connections': [['cbus_group_address', str(ga)]],
+                    'identifiers': [f'cbus_bin_sensor_{uid}'],
+                    'connections': [['cbus_group_address', uid]],
                     'sw_version': 'cmqttd https://github.com/micolous/cbus',
-                    'name': f'C-Bus Light {ga:03d}',
+                    'name': default_name,
                     'manufacturer': 'Clipsal',
                     'model': 'C-Bus Lighting Application',
                     'via_device': 'cmqttd',
                 },
-            })
+            }))
+
+        serialised = [(topic, json.dumps(payload))
+                      for topic, payload in payloads]
+        self._discovery_cache[key] = (dict(labels), serialised)
+        return serialised
 
-    def publish_binary_sensor(self, group_addr: int, state: bool):
+    def publish_binary_sensor(self, group_addr: int, state: bool,
+                              network: Optional[int] = None,
+                              application: int = Application.LIGHTING):
         payload = 'ON' if state else 'OFF'
-        return super().publish(
-            bin_sensor_state_topic(group_addr), payload, 1, True)
+        return self._publish_retained(
+            bin_sensor_state_topic(group_addr, network, application), payload)
+
+    def _publish_light(self, source_addr: Optional[int], group_addr: int,
+                       state: Text, brightness: int, transition: int,
+                       binary_state: bool, network: Optional[int],
+                       application: int):
+        """
+        Publishes the state of a light, after ``publish_window``.
+
+        Only the last state of a group within the window is published.
+        """
+        if not self._publish_window:
+            self._publish_light_now(
+                (network, int(application), group_addr), source_addr, state,
+                brightness, transition, binary_state)
+            return
+
+        if self._publish_timer is None:
+            self._publish_timer = get_event_loop().call_later(
+                self._publish_window, self._publish_pending_lights)
+
+        # Move the group to the end, so states are published in order.
+        key = (network, int(application), group_addr)
+        self._pending_states.pop(key, None)
+        self._pending_states[key] = (
+            source_addr, state, brightness, transition, binary_state)
+
+    def _publish_pending_lights(self):
+        self._publish_timer = None
+        pending = self._pending_states
+        self._pending_states = OrderedDict()
+        for key, args in pending.items():
+            self._publish_light_now(key, *args)
+
+    def _publish_light_now(self, key: Tuple[Optional[int], int, int],
+                           source_addr: Optional[int], state: Text,
+                           brightness: int, transition: int,
+                           binary_state: bool):
+        """
+        Publishes the state of a light, unless it is unchanged since it was
+        last published.
+
+        :param key: Tuple of (network, application, group address).
+        """
+        network, application, group_addr = key
+        published = (state, brightness)
+        if self._published_states.get(key) == published:
+            return
+        self._published_states[key] = published
+
+        results = (
+            self.publish(state_topic(group_addr, network, application), {
+                'state': state,
+                'brightness': brightness,
+                'transition': transition,
+                'cbus_source_addr': source_addr,
+                'cbus_source_name': self.source_name(network, source_addr),
+            }),
+            self.publish_binary_sensor(
+                group_addr, binary_state, network, application))
+
+        # If the state couldn't be published, publish it again next time.
+        for result in results:
+            if isinstance(result, Future):
+                result.add_done_callback(
+                    partial(self._forget_state, key, published))
+            elif (isinstance(result, mqtt.MQTTMessageInfo) and
+                  result.rc not in (mqtt.MQTT_ERR_SUCCESS,
+                                    mqtt.MQTT_ERR_NO_CONN)):
+                self._forget_state(key, published)
+
+    def source_name(self, network: Optional[int],
+                    source_addr: Optional[int]) -> Optional[Text]:
+        """Returns the name of the unit which sent an event, if known."""
+        if source_addr is None:
+            return None
+        return self.unit_names.get(network, {}).get(source_addr)
+
+    def _forget_state(self, key: Tuple[Optional[int], int, int],
+                      published: Tuple[Text, int],
+                      future: Optional[Future] = None):
+        """
+        Forgets that a state was published, if ``future`` failed or was
+        cancelled.
+        """
+        if (future is not None and not future.cancelled() and
+                future.exception() is None):
+            return
+        if self._published_states.get(key) == published:
+            del self._published_states[key]
 
-    def lighting_group_on(self, source_addr: Optional[int], group_addr: int):
+    def lighting_group_on(self, source_addr: Optional[int], group_addr: int,
+                          network: Optional[int] = None,
+                          application: int = Application.LIGHTING):
         """Relays a lighting-on event from CBus to MQTT."""
-        self.publish(state_topic(group_addr), {
-            'state': 'ON',
-            'brightness': 255,
-            'transition': 0,
-            'cbus_source_addr': source_addr,
-        })
-        self.publish_binary_sensor(group_addr, True)
-
-    def lighting_group_off(self, source_addr: Optional[int], group_addr: int):
+        self._publish_light(
+            source_addr, group_addr, 'ON', 255, 0, True, network, application)
+
+    def lighting_group_off(self, source_addr: Optional[int], group_addr: int,
+                           network: Optional[int] = None,
+                           application: int = Application.LIGHTING):
         """Relays a lighting-off event from CBus to MQTT."""
-        self.publish(state_topic(group_addr), {
-            'state': 'OFF',
-            'brightness': 0,
-            'transition': 0,
-            'cbus_source_addr': source_addr,
-        })
-        self.publish_binary_sensor(group_addr, False)
+        self._publish_light(
+            source_addr, group_addr, 'OFF', 0, 0, False, network, application)
 
     def lighting_group_ramp(self, source_addr: Optional[int], group_addr: int,
-                            duration: int, level: int):
+                            duration: int, level: int,
+                            network: Optional[int] = None,
+                            application: int = Application.LIGHTING):
         """Relays a lighting-ramp event from CBus to MQTT."""
-        self.publish(state_topic(group_addr), {
-            'state': 'ON',
-            'brightness': level,
-            'transition': duration,
-            'cbus_source_addr': source_addr,
-        })
-        self.publish_binary_sensor(group_addr, level > 0)
+        self._publish_light(
+            source_addr, group_addr, 'ON', level, duration, level > 0,
+            network, application)
 
 
 def read_auth(client: mqtt.Client, auth_file: TextIO):
@@ -271,40 +666,61 @@ def read_auth(client: mqtt.Client, auth_file: TextIO):
     client.username_pw_set(username, password)
 
 
-def read_cbz_labels(cbz_file: BinaryIO) -> Dict[int, Text]:
-    """Reads group address names from a given Toolkit CBZ file."""
-    labels = {}  # type: Dict[int, Text]
-    cbz = CBZ(cbz_file)
+def parse_connection(value: Text) -> Tuple[Text, Optional[int]]:
+    """
+    Parses a PCI connection argument in the form ``ADDRESS[@NETWORK]``.
+
+    :returns: Tuple of (address, network number or None)
+    :raises ValueError: If the network number is not valid.
+    """
+    address, sep, network = value.rpartition('@')
+    if not sep:
+        return value, None
+    network = int(network)
+    if not 0 <= network <= 255:
+        raise ValueError(f'Invalid network number: {network}')
+    return address, network
+
 
-    # TODO: support multiple networks/applications
+def _single_network_labels(
+        networks: Dict[int, NetworkLabels]) -> Dict[int, Dict[int, Text]]:
     # Look for 1 direct network
-    networks = [n for n in cbz.installation.project.network
-                if n.interface.interface_type != 'bridge']
     if len(networks) != 1:
         logger.warning('Expected exactly 1 non-bridge network in project file, '
                        'got %d instead! Labels will be unavailable.',
                        len(networks))
-        return labels
+        return {}
+
+    return next(iter(networks.values())).labels
+
+
+def _unit_names(labels: NetworkLabels) -> Dict[int, Text]:
+    return {unit: u['name'] for unit, u in labels.units.items()
+            if u.get('name')}
+
 
-    # Look for
-    applications = [a for a in networks[0].applications
-                    if a.address == Application.LIGHTING]
-    if len(applications) != 1:
-        logger.warning('Could not find lighting application %x in project '
-                       'file. Labels will be unavailable.',
-                       Application.LIGHTING)
-        return labels
+def read_cbz_labels(cbz_file: BinaryIO) -> Dict[int, Dict[int, Text]]:
+    """
+    Reads group address names from a given Toolkit CBZ file, which must
+    contain exactly one non-bridge network.
 
-    for group in applications[0].groups:
-        name = group.tag_name.strip()
+    :returns: Dict of lighting application to group address names.
+    """
+    return _single_network_labels(
+        read_project_labels(CBZ(cbz_file, include=LABEL_PATHS)))
 
-        # Ignore default names
-        if not name or name in ('<Unused>', f'Group {group.address}'):
-            continue
 
-        labels[group.address] = name
+def read_cbz_network_labels(
+        cbz_file: BinaryIO) -> Dict[int, Dict[int, Dict[int, Text]]]:
+    """
+    Reads group address names for each non-bridge network in a given Toolkit
+    CBZ file.
 
-    return labels
+    :returns: Dict of network number to lighting application to group address
+        names.
+    """
+    networks = read_project_labels(CBZ(cbz_file, include=LABEL_PATHS))
+    return {network: n.labels for network, n in networks.items()}
 
 
 async def _main():
@@ -373,22 +789,49 @@ async def _main():
              'supply the public key (-k). If this file is encrypted, Python '
              'will prompt for the password at the command-line.')
 
+    group.add_argument(
+        '--publish-window', metavar='MS',
+        dest='publish_window', type=int, default=50,
+        help='Wait up to n milliseconds before publishing the state of a '
+             'group, so that bursts of events for the same group are '
+             'published once (or 0 to disable). [default: %(default)s ms]')
+
+    group.add_argument(
+        '--publish-queue', metavar='N',
+        dest='publish_queue', type=int, default=1000,
+        help='Maximum number of messages waiting to be sent to the broker. '
+             'When full, the oldest state message is dropped; '
+             'configuration messages are never dropped. Only the latest '
+             'message for each topic is kept. [default: %(default)s]')
+
     group = parser.add_argument_group(
-        'C-Bus PCI options', 'You must specify exactly one of these options:')
-    group = group.add_mutually_exclusive_group(required=True)
+        'C-Bus PCI options',
+        'You must specify at least one of these options. To connect to '
+        'multiple networks, repeat these options, and add the network '
+        'number to each of them with @NETWORK.')
 
     group.add_argument(
         '-s', '--serial',
-        dest='serial', default=None, metavar='DEVICE',
+        dest='serial', action='append', default=[],
+        metavar='DEVICE[@NETWORK]',
         help='Device node that the PCI is connected to. USB PCIs act as a '
              'cp210x USB-serial adapter. (example: -s /dev/ttyUSB0)')
 
     group.add_argument(
         '-t', '--tcp',
-        dest='tcp', default=None, metavar='ADDR:PORT',
+        dest='tcp', action='append', default=[],
+        metavar='ADDR:PORT[@NETWORK]',
         help='IP address and TCP port where the C-Bus CNI or PCI is located '
              '(eg: -t 192.0.2.1:10001)')
 
+    group = parser.add_argument_group('C-Bus command options')
+    group.add_argument(
+        '--coalesce-window', metavar='MS',
+        dest='coalesce_window', type=int, default=20,
+        help='Wait up to n milliseconds for other lighting commands, and send '
+             'them together in a single packet (or 0 to disable). '
+             '[default: %(default)s ms]')
+
     group = parser.add_argument_group('Time settings')
     group.add_argument(
         '-T', '--timesync', metavar='SECONDS',
@@ -409,45 +852,110 @@ async def _main():
     group = parser.add_argument_group('Label options')
 
     group.add_argument(
-        '-P', '--project-file',
-        type=FileType('rb'),
+        '-P', '--project-file', metavar='FILE',
         help='Path to a C-Bus Toolkit project backup file (CBZ or XML) '
              'containing labels for group addresses to use. If not supplied, '
              'generated names like "C-Bus Light 001" will be used instead.'
     )
 
+    group.add_argument(
+        '--label-cache', metavar='FILE',
+        help='Cache labels read from the project file in FILE, so they can '
+             'be loaded quickly when the project file has not changed. '
+             '[default: project file name + ".labels.json"]')
+
+    group.add_argument(
+        '--no-label-cache',
+        dest='label_cache_enabled', action='store_false',
+        help='Always read labels from the project file, and do not write a '
+             'cache.')
+
     option = parser.parse_args()
 
     if bool(option.broker_client_cert) != bool(option.broker_client_key):
         return parser.error(
             'To use client certificates, both -k and -K must be specified.')
 
+    connections = []
+    try:
+        for kind in ('serial', 'tcp'):
+            for value in getattr(option, kind):
+                connections.append((kind,) + parse_connection(value))
+    except ValueError as e:
+        return parser.error(str(e))
+
+    if not connections:
+        return parser.error('At least one of -s or -t must be specified.')
+    networks = [network for _, _, network in connections]
+    if len(connections) > 1 and None in networks:
+        return parser.error(
+            'When connecting to multiple networks, each connection must '
+            'specify a network number with @NETWORK.')
+    if len(set(networks)) != len(networks):
+        return parser.error('Each network number must only be used once.')
+
     global_logger = logging.getLogger('cbus')
     global_logger.setLevel(option.verbosity)
     logging.basicConfig(level=option.verbosity, filename=option.log)
 
     loop = get_event_loop()
     connection_lost_future = loop.create_future()
-    labels = (read_cbz_labels(option.project_file)
-              if option.project_file else None)
-
-    def factory():
-        return CBusHandler(
-            timesync_frequency=option.timesync,
-            handle_clock_requests=not option.no_clock,
-            connection_lost_future=connection_lost_future,
-            labels=labels,
-        )
-
-    if option.serial:
-        _, protocol = await create_serial_connection(
-            loop, factory, option.serial, baudrate=9600)
-    elif option.tcp:
-        addr = option.tcp.split(':', 2)
-        _, protocol = await loop.create_connection(
-            factory, addr[0], int(addr[1]))
-
-    mqtt_client = MqttClient(userdata=protocol)
+    if not option.project_file:
+        network_labels = {}
+        unit_names = {}
+    else:
+        try:
+            project_labels = load_project_labels(
+                option.project_file, option.label_cache,
+                option.label_cache_enabled)
+        except OSError as e:
+            return parser.error(f'Cannot read project file: {e}')
+
+        if networks == [None]:
+            network_labels = {None: _single_network_labels(project_labels)}
+            unit_names = {}
+            if len(project_labels) == 1:
+                unit_names[None] = _unit_names(
+                    next(iter(project_labels.values())))
+        else:
+            network_labels = {network: n.labels
+                              for network, n in project_labels.items()}
+            unit_names = {network: _unit_names(n)
+                          for network, n in project_labels.items()}
+
+    # Decoded packets are shared between all PCIs.
+    packet_cache = PacketCache()
+    handlers = []
+
+    for kind, address, network in connections:
+        labels = network_labels.get(network)
+        if option.project_file and labels is None:
+            logger.warning('Network %d is not in the project file. Labels '
+                           'will be unavailable.', network)
+
+        def factory(labels=labels, network=network):
+            return CBusHandler(
+                timesync_frequency=option.timesync,
+                handle_clock_requests=not option.no_clock,
+                connection_lost_future=connection_lost_future,
+                labels=labels,
+                network=network,
+                packet_cache=packet_cache,
+                coalesce_window=option.coalesce_window / 1000.,
+            )
+
+        if kind == 'serial':
+            _, protocol = await create_serial_connection(
+                loop, factory, address, baudrate=9600)
+        else:
+            addr = address.split(':', 2)
+            _, protocol = await loop.create_connection(
+                factory, addr[0], int(addr[1]))
+        handlers.append(protocol)
+
+    mqtt_client = MqttClient(
+        userdata=handlers, publish_window=option.publish_window / 1000.,
+        publish_queue=option.publish_queue, unit_names=unit_names)
     if option.broker_auth:
         read_auth(mqtt_client, option.broker_auth)
     if option.broker_disable_tls:
@@ -466,7 +974,10 @@ async def _main():
     aioh = AsyncioHelper(loop, mqtt_client)
     mqtt_client.connect(option.broker_address, port, option.broker_keepalive)
 
+    # Losing any PCI stops every network, so that a service manager can
+    # restart cmqttd with all of them.
     await connection_lost_future
+    logger.error('Lost connection to a PCI, exiting')
 
 
 def main():
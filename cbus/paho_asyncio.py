@@ -1,5 +1,7 @@
 # https://github.com/eclipse/paho.mqtt.python/blob/master/examples/loop_asyncio.py
 import asyncio
+from collections import OrderedDict
+
 import paho.mqtt.client as mqtt
 
 
@@ -33,3 +35,157 @@ class AsyncioHelper:
                 await asyncio.sleep(1)
             except asyncio.CancelledError:
                 break
+
+
+class AsyncioPublisher:
+    """
+    Publishes MQTT messages from a bounded queue in an asyncio task, so that
+    callers never block on the broker.
+
+    Only the latest payload for each topic is kept while it waits in the
+    queue. When the queue is full, the oldest droppable message is dropped.
+
+    Messages which are not droppable (such as configuration) are kept in a
+    separate queue which is never dropped and doesn't count towards
+    ``maxsize``. They are sent before droppable messages.
+
+    The MQTT client must call ``on_connect``, ``on_disconnect`` and
+    ``on_publish`` from its own callbacks of the same name.
+    """
+
+    def __init__(self, publish, maxsize: int = 1000,
+                 max_in_flight: int = 20):
+        """
+        :param publish: Function to publish messages with, with the same
+            signature as ``paho.mqtt.client.Client.publish``.
+        :param maxsize: Maximum number of droppable topics waiting to be
+            published.
+        :param max_in_flight: Maximum number of QoS 1 or 2 messages waiting
+            for acknowledgement from the broker.
+        """
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+
+        self._publish = publish
+        self.maxsize = maxsize
+        self.max_in_flight = max_in_flight
+        self.dropped = 0
+
+        # topic -> [payload, qos, retain, future], in the order to publish.
+        self._reliable = OrderedDict()
+        self._droppable = OrderedDict()
+        # mid -> future, for messages waiting for acknowledgement.
+        self._in_flight = {}
+        self._queued = asyncio.Event()
+        self._connected = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._reliable) + len(self._droppable)
+
+    def publish(self, topic, payload, qos=1, retain=True, droppable=True):
+        """
+        Queues a message to be published.
+
+        If there is already a message queued for ``topic``, it is replaced,
+        and the same future is returned.
+
+        :param droppable: If False, this message is never dropped when the
+            queue is full.
+        :returns: Future which resolves when the message has been sent (QoS 0)
+            or acknowledged by the broker (QoS 1 or 2). This is cancelled if
+            the message is dropped from the queue.
+        :rtype: asyncio.Future
+        """
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+        pending = (self._reliable.get(topic) or
+                   self._droppable.get(topic))
+        if pending is not None and pending[3].done():
+            # The caller cancelled it, so queue the message again.
+            self._reliable.pop(topic, None)
+            self._droppable.pop(topic, None)
+        elif pending is not None:
+            pending[:3] = payload, qos, retain
+            if not droppable and topic in self._droppable:
+                # Now that it must not be dropped, move it.
+                self._reliable[topic] = self._droppable.pop(topic)
+            return pending[3]
+
+        queue = self._droppable if droppable else self._reliable
+        if droppable and len(queue) >= self.maxsize:
+            self._drop()
+
+        future = asyncio.get_event_loop().create_future()
+        queue[topic] = [payload, qos, retain, future]
+        self._queued.set()
+        return future
+
+    def _drop(self):
+        _, pending = self._droppable.popitem(last=False)
+        pending[3].cancel()
+        self.dropped += 1
+
+    def close(self):
+        """Stops publishing, cancelling all pending messages."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for queue in (self._reliable, self._droppable):
+            for pending in queue.values():
+                pending[3].cancel()
+            queue.clear()
+        for future in self._in_flight.values():
+            future.cancel()
+        self._in_flight.clear()
+
+    def on_connect(self):
+        self._connected.set()
+
+    def on_disconnect(self):
+        self._connected.clear()
+
+    def on_publish(self, mid):
+        future = self._in_flight.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+        if len(self._in_flight) < self.max_in_flight:
+            self._ready.set()
+
+    async def _run(self):
+        while True:
+            await self._connected.wait()
+            await self._ready.wait()
+            if not self:
+                self._queued.clear()
+                await self._queued.wait()
+                continue
+
+            queue = self._reliable or self._droppable
+            topic, (payload, qos, retain, future) = queue.popitem(last=False)
+            if future.done():
+                continue
+
+            info = self._publish(topic, payload, qos, retain)
+            if qos == 0:
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    future.set_result(None)
+                else:
+                    future.set_exception(IOError(
+                        f'Error publishing {topic}: '
+                        f'{mqtt.error_string(info.rc)}'))
+            elif info.rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                # paho retries messages which could not be sent when it
+                # reconnects.
+                self._in_flight[info.mid] = future
+                if len(self._in_flight) >= self.max_in_flight:
+                    self._ready.clear()
+            else:
+                future.set_exception(IOError(
+                    f'Error publishing {topic}: '
+                    f'{mqtt.error_string(info.rc)}'))
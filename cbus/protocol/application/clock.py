@@ -44,6 +44,7 @@ class ClockSAL(SAL, abc.ABC):
     """
     Base type for clock and timekeeping application SALs.
     """
+    __slots__ = ()
 
     @property
     def application(self) -> Application:
@@ -102,6 +103,7 @@ class ClockUpdateSAL(ClockSAL):
     Informs the network of the current time.
 
     """
+    __slots__ = ('val',)
 
     @property
     def is_date(self):
@@ -208,6 +210,7 @@ class ClockRequestSAL(ClockSAL):
     Requests network time.
 
     """
+    __slots__ = ()
 
     def __init__(self):
         """
@@ -251,7 +254,7 @@ class ClockApplication(BaseApplication):
         return {Application.CLOCK}
 
     @staticmethod
-    def decode_sals(data: bytes) -> Sequence[SAL]:
+    def decode_sals(data: bytes, application: int) -> Sequence[SAL]:
         """
         Decodes a clock and timekeeping application packet and returns its
         SAL(s).
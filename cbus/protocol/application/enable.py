@@ -37,6 +37,7 @@ class EnableSAL(SAL):
     """
     Base type for enable control application SALs.
     """
+    __slots__ = ()
 
     @property
     def application(self) -> Application:
@@ -96,6 +97,7 @@ class EnableSetNetworkVariableSAL(EnableSAL):
     Sets a network variable.
 
     """
+    __slots__ = ('variable', 'value')
 
     def __init__(self, variable, value):
         """
@@ -150,7 +152,7 @@ class EnableApplication(BaseApplication):
         return {Application.ENABLE}
 
     @classmethod
-    def decode_sals(cls, data: bytes) -> List[EnableSAL]:
+    def decode_sals(cls, data: bytes, application: int) -> List[EnableSAL]:
         """
         Decodes a enable broadcast application packet and returns its SAL(s).
         """
@@ -48,28 +48,42 @@ class LightingSAL(SAL, abc.ABC):
     """
     Base type for lighting application SALs.
     """
+    __slots__ = ('group_address', '_application')
 
-    def __init__(self, group_address: int):
+    def __init__(self, group_address: int,
+                 application: Union[int, Application] = Application.LIGHTING):
         """
         This should not be called directly by your code!
 
         Use one of the subclasses of cbus.protocol.lighting.LightingSAL
         instead.
+
+        :param application: Lighting application ID (0x30 - 0x5f) that the
+                            group address is part of.
+        :raises ValueError: If the application is not a lighting application.
         """
         check_ga(group_address)
+        if application not in _SUPPORTED_APPLICATIONS:
+            raise ValueError(
+                f'application must be a lighting application 0x30 - 0x5f '
+                f'(got {application})')
         self.group_address = group_address
+        self._application = Application(application)
 
     @property
     def application(self) -> Union[int, Application]:
-        # TODO: Support other application IDs
-        return Application.LIGHTING
+        return self._application
 
     @staticmethod
-    def decode_sals(data: bytes) -> List[LightingSAL]:
+    def decode_sals(
+            data: bytes,
+            application: Union[int, Application] = Application.LIGHTING
+    ) -> List[LightingSAL]:
         """
         Decodes a lighting application packet and returns it's SAL(s).
 
         :param data: SAL data to be parsed.
+        :param application: Application ID the packet was sent to.
 
         :returns: The SAL messages contained within the given data.
         :rtype: list of cbus.protocol.application.lighting.LightingSAL
@@ -98,7 +112,7 @@ class LightingSAL(SAL, abc.ABC):
                 break
 
             sal, data = _SAL_HANDLERS[command_code].decode(
-                data, command_code, group_address)
+                data, command_code, group_address, application)
 
             if sal:
                 output.append(sal)
@@ -114,8 +128,9 @@ class LightingSAL(SAL, abc.ABC):
 
     @staticmethod
     @abc.abstractmethod
-    def decode(data: bytes, command_code: int,
-               group_address: int) -> Tuple[Optional[LightingSAL], bytes]:
+    def decode(data: bytes, command_code: int, group_address: int,
+               application: Union[int, Application]
+               ) -> Tuple[Optional[LightingSAL], bytes]:
         raise NotImplementedError('decode')
 
 
@@ -127,8 +142,10 @@ class LightingRampSAL(LightingSAL):
     over a given duration.
 
     """
+    __slots__ = ('duration', 'level')
 
-    def __init__(self, group_address: int, duration: int, level: int):
+    def __init__(self, group_address: int, duration: int, level: int,
+                 application: Union[int, Application] = Application.LIGHTING):
         """
         Creates a new SAL Lighting Ramp message.
 
@@ -141,15 +158,20 @@ class LightingRampSAL(LightingSAL):
         :param level: The level to ramp to, with 0 indicating off, and 255
                       indicating full brightness.
         :type level: int
+
+        :param application: The lighting application ID that the group
+                            address is part of.
+        :type application: int
         """
-        super().__init__(group_address=group_address)
+        super().__init__(group_address=group_address, application=application)
 
         self.duration = duration
         self.level = level
 
     @staticmethod
-    def decode(data: bytes, command_code: int,
-               group_address: int) -> Tuple[Optional[LightingSAL], bytes]:
+    def decode(data: bytes, command_code: int, group_address: int,
+               application: Union[int, Application]
+               ) -> Tuple[Optional[LightingSAL], bytes]:
         """
         Do not call this method directly -- use LightingSAL.decode
         """
@@ -165,7 +187,8 @@ class LightingRampSAL(LightingSAL):
         data = data[1:]
 
         return LightingRampSAL(
-            group_address=group_address, duration=duration, level=level), data
+            group_address=group_address, duration=duration, level=level,
+            application=application), data
 
     def encode(self) -> bytes:
         if self.level < 0 or self.level > 255:
@@ -189,14 +212,16 @@ class LightingOnSAL(LightingSAL):
 
     Instructs a given group address to turn it's load on.
     """
+    __slots__ = ()
 
     @staticmethod
-    def decode(data: bytes, command_code: int,
-               group_address: int) -> Tuple[LightingOnSAL, bytes]:
+    def decode(data: bytes, command_code: int, group_address: int,
+               application: Union[int, Application]
+               ) -> Tuple[LightingOnSAL, bytes]:
         """
         Do not call this method directly -- use LightingSAL.decode
         """
-        return LightingOnSAL(group_address), data
+        return LightingOnSAL(group_address, application), data
 
     def encode(self):
         return super().encode() + bytes([LightCommand.ON, self.group_address])
@@ -211,14 +236,16 @@ class LightingOffSAL(LightingSAL):
 
     Instructs a given group address to turn it's load off.
     """
+    __slots__ = ()
 
     @staticmethod
-    def decode(data: bytes, command_code: int,
-               group_address: int) -> Tuple[LightingOffSAL, bytes]:
+    def decode(data: bytes, command_code: int, group_address: int,
+               application: Union[int, Application]
+               ) -> Tuple[LightingOffSAL, bytes]:
         """
         Do not call this method directly -- use LightingSAL.decode
         """
-        return LightingOffSAL(group_address), data
+        return LightingOffSAL(group_address, application), data
 
     def encode(self):
         return super().encode() + bytes([LightCommand.OFF, self.group_address])
@@ -234,14 +261,16 @@ class LightingTerminateRampSAL(LightingSAL):
     Instructs the given group address to discontinue any ramp operations in
     progress, and use the brightness that they are currently at.
     """
+    __slots__ = ()
 
     @staticmethod
-    def decode(data: bytes, command_code: int,
-               group_address: int) -> Tuple[LightingTerminateRampSAL, bytes]:
+    def decode(data: bytes, command_code: int, group_address: int,
+               application: Union[int, Application]
+               ) -> Tuple[LightingTerminateRampSAL, bytes]:
         """
         Do not call this method directly -- use LightingSAL.decode
         """
-        return LightingTerminateRampSAL(group_address), data
+        return LightingTerminateRampSAL(group_address, application), data
 
     def encode(self):
         return super().encode() + bytes([
@@ -276,8 +305,8 @@ class LightingApplication(BaseApplication):
     """
 
     @staticmethod
-    def decode_sals(data: bytes) -> List[SAL]:
-        return LightingSAL.decode_sals(data)
+    def decode_sals(data: bytes, application: int) -> List[SAL]:
+        return LightingSAL.decode_sals(data, application)
 
     @staticmethod
     def supported_applications() -> FrozenSet[int]:
@@ -21,15 +21,17 @@ import abc
 from typing import FrozenSet, Sequence, Union
 
 from cbus.common import Application
+from cbus.protocol.freezable import Freezable
 
 __all__ = ['SAL', 'BaseApplication']
 
 
-class SAL(abc.ABC):
+class SAL(Freezable, abc.ABC):
     """
     Describes an decoder/encoder
 
     """
+    __slots__ = ()
     @abc.abstractmethod
     def encode(self) -> bytes:
         return bytes()
@@ -57,9 +59,12 @@ class BaseApplication(abc.ABC):
 
     @staticmethod
     @abc.abstractmethod
-    def decode_sals(data: bytes) -> Sequence[SAL]:
+    def decode_sals(data: bytes, application: int) -> Sequence[SAL]:
         """
         Decodes a SAL message
 
+        :param data: SAL data to be parsed.
+        :param application: Application ID the SAL message was sent to. This
+                            is one of the ``supported_applications``.
         """
         raise NotImplementedError('decode_sals')
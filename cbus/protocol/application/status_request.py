@@ -36,12 +36,13 @@ class StatusRequestApplication(BaseApplication):
         return _SUPPORTED_APPLICATIONS
 
     @staticmethod
-    def decode_sals(data: bytes) -> Sequence[SAL]:
+    def decode_sals(data: bytes, application: int) -> Sequence[SAL]:
         return StatusRequestSAL.decode_sals(data)
 
 
 @dataclass
 class StatusRequestSAL(SAL):
+    __slots__ = ('level_request', 'group_address', 'child_application')
     level_request: bool
     group_address: int
     child_application: int
@@ -38,6 +38,7 @@ class TemperatureSAL(SAL, abc.ABC):
     """
     Base type for temperature broadcast application SALs.
     """
+    __slots__ = ('group_address',)
 
     def __init__(self, group_address: int):
         """
@@ -115,6 +116,7 @@ class TemperatureBroadcastSAL(TemperatureSAL):
     Informs the network of the current temperature being sensed at a location.
 
     """
+    __slots__ = ('temperature',)
 
     def __init__(self, group_address: int, temperature: float):
         """
@@ -169,7 +171,8 @@ class TemperatureApplication(BaseApplication):
         return {Application.TEMPERATURE}
 
     @staticmethod
-    def decode_sals(data: bytes) -> Sequence[TemperatureSAL]:
+    def decode_sals(
+            data: bytes, application: int) -> Sequence[TemperatureSAL]:
         """
         Decodes a temperature broadcast application packet and returns it's
         SAL(s).
@@ -21,6 +21,7 @@ from dataclasses import dataclass
 from typing import Optional
 
 from cbus.common import DestinationAddressType, PriorityClass
+from cbus.protocol.freezable import Freezable
 
 __all__ = [
     'BasePacket',
@@ -30,7 +31,10 @@ __all__ = [
 ]
 
 
-class BasePacket(abc.ABC):
+class BasePacket(Freezable, abc.ABC):
+    __slots__ = ('checksum', 'destination_address_type', 'rc', 'dp',
+                 'priority_class', 'confirmation', 'source_address')
+
     def __init__(
             self,
             checksum: bool = True,
@@ -69,6 +73,8 @@ class BasePacket(abc.ABC):
 
 
 class _SpecialPacket(BasePacket, abc.ABC):
+    __slots__ = ()
+
     def __init__(self):
         super(_SpecialPacket, self).__init__(
             checksum=False)
@@ -89,6 +95,7 @@ class SpecialClientPacket(_SpecialPacket, abc.ABC):
 
     These have non-standard methods for serialisation.
     """
+    __slots__ = ()
 
     def __repr__(self):
         return f'{self.__class__.__name__}()'
@@ -101,7 +108,7 @@ class SpecialServerPacket(_SpecialPacket, abc.ABC):
 
     These have non-standard serialisation methods.
     """
-    pass
+    __slots__ = ()
 
 
 @dataclass(init=True)
@@ -28,24 +28,32 @@ class BufferedProtocol(asyncio.Protocol, abc.ABC):
     """
     A generic buffered Protocol for asyncio.
 
+    Received data is appended to a single receive buffer, and a read cursor
+    tracks how much of it has been consumed.  Consuming data only advances the
+    cursor; the buffer is only compacted when new data would not fit after the
+    unconsumed tail, or emptied once everything has been consumed.
+
     """
     def __init__(self, size_limit=1024):
         self._buf = bytearray()
+        self._buf_pos = 0
         self._buf_lock = threading.Lock()
         self._size_limit = size_limit
 
     @abc.abstractmethod
-    def handle_data(self, buf: bytes) -> int:
+    def handle_data(self, buf: bytes, offset: int) -> int:
         """
         Called when there is data to process.
 
-        ``buf`` contains the entire buffer.
+        ``buf`` contains the entire receive buffer, and unconsumed data starts
+        at ``offset``. The buffer is shared with the protocol, so it must not
+        be modified, and references to it must not be kept after returning.
 
         Return values are interpreted as follows:
 
         ``r > 0``
-            ``r`` bytes were consumed from the buffer. This method will be
-            called again, immediately.
+            ``r`` bytes were consumed from the buffer, starting at ``offset``.
+            This method will be called again, immediately.
         ``r == 0``
             There is no complete message to interpret in the buffer, and this
             should not be called again until more data is in the buffer.
@@ -55,8 +63,15 @@ class BufferedProtocol(asyncio.Protocol, abc.ABC):
         Return values less than ``-1`` are invalid, and will cause
         ``_process_buffer`` to raise an exception.
 
+        Implementations which handle several messages per call may instead
+        call ``_consume_to`` as each message is consumed, and then return 0.
+        This way, messages which were already handled are not handled again
+        if a later one raises an exception.
+
         :param buf: Receive buffer
         :type buf: bytes
+        :param offset: Position in ``buf`` of the first unconsumed byte.
+        :type offset: int
         """
         raise NotImplementedError('frame_received')
 
@@ -74,29 +89,46 @@ class BufferedProtocol(asyncio.Protocol, abc.ABC):
 
         # Add the data to the buffer
         with self._buf_lock:
-            if len(self._buf) + data_size > self._size_limit:
-                self._buf = bytearray()
+            buf = self._buf
+            if len(buf) - self._buf_pos + data_size > self._size_limit:
+                self._clear_buffer()
                 raise ValueError(
                     'Received data would make the buffer exceed the maximum '
                     'limit, buffer dropped!')
 
-            self._buf.extend(data)
+            if len(buf) + data_size > self._size_limit:
+                # Wrap around: drop the consumed data at the start of the
+                # buffer to make room for the new data.
+                del buf[:self._buf_pos]
+                self._buf_pos = 0
+
+            buf.extend(data)
 
         # Handle any messages that may be in the buffer.
         self._process_buffer()
 
+    def _consume_to(self, pos: int) -> None:
+        """
+        Marks everything in the buffer before ``pos`` as consumed.
+
+        This may only be called from ``handle_data``.
+        """
+        self._buf_pos = pos
+
+    def _clear_buffer(self) -> None:
+        # Must be called with _buf_lock held.
+        self._buf.clear()
+        self._buf_pos = 0
+
     def _process_buffer(self):
         with self._buf_lock:
-            while True:
-                if len(self._buf) == 0:
-                    break
-
-                # TODO: replace with non-copy architecture
-                r = self.handle_data(bytes(self._buf))
+            buf = self._buf
+            while self._buf_pos < len(buf):
+                r = self.handle_data(buf, self._buf_pos)
 
                 if r < 0:
                     # < 0, clear buffer
-                    self._buf = bytearray()
+                    self._clear_buffer()
 
                     if r != -1:
                         # Only "correct" way to clear buffer is with -1.
@@ -105,6 +137,10 @@ class BufferedProtocol(asyncio.Protocol, abc.ABC):
                             'Invalid return from frame_received: {}'.format(r))
 
                 if r > 0:
-                    self._buf = self._buf[r:]
+                    self._buf_pos += r
                 else:
                     break
+
+            if self._buf_pos >= len(buf):
+                # Everything was consumed, start again from the beginning.
+                self._clear_buffer()
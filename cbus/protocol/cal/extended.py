@@ -22,6 +22,7 @@ from dataclasses import dataclass
 from typing import Union
 
 from cbus.common import CAL, ExtendedCALType, Application
+from cbus.protocol.freezable import Freezable
 from cbus.protocol.cal.report import (
     StatusReport, BinaryStatusReport, LevelStatusReport)
 
@@ -31,15 +32,21 @@ __all__ = [
 
 
 @dataclass
-class ExtendedCAL:
+class ExtendedCAL(Freezable):
     """
 
     """
+    __slots__ = ('externally_initated', 'child_application', 'block_start',
+                 'report')
     externally_initated: bool
     child_application: Union[Application, int]
     block_start: int
     report: StatusReport
 
+    def freeze(self) -> None:
+        self.report.freeze()
+        super().freeze()
+
     @property
     def coding_byte(self) -> int:
         return ((0x40 if self.externally_initated else 0) |
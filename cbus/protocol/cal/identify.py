@@ -22,6 +22,7 @@ from dataclasses import dataclass
 from typing import Tuple, Union
 
 from cbus.common import CAL, IdentifyAttribute
+from cbus.protocol.freezable import Freezable
 
 __all__ = [
     'IdentifyCAL',
@@ -29,13 +30,14 @@ __all__ = [
 
 
 @dataclass
-class IdentifyCAL:
+class IdentifyCAL(Freezable):
     """
     Identify CAL request.
 
     Ref: Serial Interface Guide, s7.1
 
     """
+    __slots__ = ('attribute',)
     attribute: Union[IdentifyAttribute, int]
 
     @classmethod
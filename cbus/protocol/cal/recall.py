@@ -22,6 +22,7 @@ from dataclasses import dataclass
 from typing import Tuple
 
 from cbus.common import CAL
+from cbus.protocol.freezable import Freezable
 
 __all__ = [
     'RecallCAL',
@@ -29,13 +30,14 @@ __all__ = [
 
 
 @dataclass
-class RecallCAL:
+class RecallCAL(Freezable):
     """
     Recall CAL request.
 
     Ref: Serial Interface Guide, s7.1
 
     """
+    __slots__ = ('param', 'count')
     param: int
     count: int
 
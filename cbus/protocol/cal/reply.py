@@ -21,6 +21,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 
 from cbus.common import CAL
+from cbus.protocol.freezable import Freezable
 
 __all__ = [
     'ReplyCAL',
@@ -28,7 +29,7 @@ __all__ = [
 
 
 @dataclass
-class ReplyCAL:
+class ReplyCAL(Freezable):
     """
     Reply CAL (Device and Network Management Command).
 
@@ -40,6 +41,7 @@ class ReplyCAL:
 
     ``parameter`` is the attribute requested for ``IDENTIFY`` responses.
     """
+    __slots__ = ('parameter', 'data')
 
     parameter: int
     data: bytes
@@ -19,32 +19,71 @@ from __future__ import absolute_import
 from __future__ import annotations
 
 import abc
+from array import array
 from dataclasses import dataclass
+from itertools import chain
+import sys
 from typing import Iterator, Optional, Sequence
 
 from cbus.common import ExtendedCALType, GroupState
+from cbus.protocol.freezable import Freezable
 
 __all__ = [
     'StatusReport',
     'BinaryStatusReport',
     'LevelStatusReport',
+    'MISSING_LEVEL',
     'manchester_decode',
+    'manchester_decode_levels',
     'manchester_encode',
 ]
 
 _MANCHESTER_NIBBLES = (0b1010, 0b1001, 0b0110, 0b0101)  # 0xa, 0x9, 0x6, 0x5
 
+# Level -> 2 byte encoding.
+_MANCHESTER_ENCODE = tuple(
+    bytes((_MANCHESTER_NIBBLES[v & 0x3] |
+           _MANCHESTER_NIBBLES[v >> 2 & 0x3] << 4,
+           _MANCHESTER_NIBBLES[v >> 4 & 0x3] |
+           _MANCHESTER_NIBBLES[v >> 6 & 0x3] << 4))
+    for v in range(256))
+
+# 2 byte encoding (as a little-endian uint16) -> level, or MISSING_LEVEL if
+# the encoding is invalid.
+MISSING_LEVEL = -1
+_MANCHESTER_DECODE = array('h', [MISSING_LEVEL]) * 0x10000
+for _level, _encoded in enumerate(_MANCHESTER_ENCODE):
+    _MANCHESTER_DECODE[_encoded[0] | _encoded[1] << 8] = _level
+del _level, _encoded
+
+# Binary status byte -> 4 group states.
+_BINARY_DECODE = tuple(
+    (GroupState(c & 0x3), GroupState(c >> 2 & 0x3),
+     GroupState(c >> 4 & 0x3), GroupState(c >> 6 & 0x3))
+    for c in range(256))
+
 
 def manchester_decode(b: bytes) -> Optional[int]:
-    try:
-        n0 = _MANCHESTER_NIBBLES.index(b[0] & 0xf)
-        n1 = _MANCHESTER_NIBBLES.index(b[0] >> 4)
-        n2 = _MANCHESTER_NIBBLES.index(b[1] & 0xf)
-        n3 = _MANCHESTER_NIBBLES.index(b[1] >> 4)
-    except ValueError:
-        return None
+    level = _MANCHESTER_DECODE[b[0] | b[1] << 8]
+    return None if level == MISSING_LEVEL else level
+
 
-    return n0 | n1 << 2 | n2 << 4 | n3 << 6
+def manchester_decode_levels(data: bytes) -> array:
+    """
+    Decodes all of the levels in a level status report payload.
+
+    :returns: array('h') of levels, with ``MISSING_LEVEL`` for groups which
+              are missing or could not be decoded.
+    :raises ValueError: if data is not a multiple of 2 bytes.
+    """
+    if len(data) % 2 != 0:
+        raise ValueError(
+            'Expected a multiple of 2 bytes in LevelStatusReport')
+
+    words = array('H', data)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return array('h', map(_MANCHESTER_DECODE.__getitem__, words))
 
 
 def manchester_encode(value: Optional[int],
@@ -57,15 +96,12 @@ def manchester_encode(value: Optional[int],
     if value is None:
         return buf
 
-    value = int(value) & 0xff
-    buf[off] = (_MANCHESTER_NIBBLES[value & 0x3] |
-                _MANCHESTER_NIBBLES[value >> 2 & 0x3] << 4)
-    buf[off + 1] = (_MANCHESTER_NIBBLES[value >> 4 & 0x3] |
-                    _MANCHESTER_NIBBLES[value >> 6 & 0x3] << 4)
+    buf[off:off + 2] = _MANCHESTER_ENCODE[int(value) & 0xff]
     return buf
 
 
-class StatusReport(abc.ABC):
+class StatusReport(Freezable, abc.ABC):
+    __slots__ = ()
     @classmethod
     @abc.abstractmethod
     def decode(cls, data: bytes) -> StatusReport:
@@ -83,6 +119,7 @@ class StatusReport(abc.ABC):
 
 @dataclass
 class BinaryStatusReport(StatusReport, Sequence[GroupState]):
+    __slots__ = ('_group_states',)
     _group_states: Sequence[GroupState]
 
     def __getitem__(self, i: int) -> GroupState:
@@ -96,15 +133,8 @@ class BinaryStatusReport(StatusReport, Sequence[GroupState]):
 
     @classmethod
     def decode(cls, data: bytes) -> BinaryStatusReport:
-        states = []
-        for c in data:
-            states += [
-                GroupState(c & 0x3),
-                GroupState((c >> 2) & 0x03),
-                GroupState((c >> 4) & 0x03),
-                GroupState((c >> 6) & 0x03)]
-
-        return BinaryStatusReport(states)
+        return BinaryStatusReport(
+            list(chain.from_iterable(map(_BINARY_DECODE.__getitem__, data))))
 
     @property
     def block_type(self) -> ExtendedCALType:
@@ -175,6 +205,7 @@ class LevelStatusReport(StatusReport, Sequence[Optional[int]]):
     the signal level stays low (ie: 00).
 
     """
+    __slots__ = ('_group_states',)
     _group_states: Sequence[Optional[int]]
 
     def __getitem__(self, i: int) -> Optional[int]:
@@ -188,25 +219,15 @@ class LevelStatusReport(StatusReport, Sequence[Optional[int]]):
 
     @classmethod
     def decode(cls, data: bytes) -> LevelStatusReport:
-        states = []
-        if len(data) % 2 != 0:
-            raise ValueError(
-                'Expected a multiple of 2 bytes in LevelStatusReport')
-
-        for o in range(0, len(data), 2):
-            states.append(manchester_decode(data[o:o+2]))
-
-        return LevelStatusReport(states)
+        return LevelStatusReport([
+            None if level == MISSING_LEVEL else level
+            for level in manchester_decode_levels(data)])
 
     @property
     def block_type(self) -> ExtendedCALType:
         return ExtendedCALType.LEVEL
 
     def encode(self) -> bytes:
-        group_states = list(self._group_states)
-
-        o = bytearray(len(group_states) * 2)
-        for i, state in enumerate(group_states):
-            manchester_encode(state, o, i * 2)
-
-        return bytes(o)
+        return b''.join(
+            b'\0\0' if level is None else _MANCHESTER_ENCODE[int(level) & 0xff]
+            for level in self._group_states)
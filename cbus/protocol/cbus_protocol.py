@@ -18,15 +18,22 @@
 
 import abc
 import logging
+from typing import Any, Callable, Dict, Optional, Tuple, Type, Union
 
-from cbus.common import MAX_BUFFER_SIZE
+from cbus.common import Application, MAX_BUFFER_SIZE
+from cbus.protocol.application.sal import SAL
 from cbus.protocol.buffered_protocol import BufferedProtocol
-from cbus.protocol.packet import decode_packet
+from cbus.protocol.packet import PacketCache, decode_packet
 from cbus.protocol.base_packet import BasePacket
+from cbus.protocol.pm_packet import PointToMultipointPacket
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['CBusProtocol']
+__all__ = ['CBusProtocol', 'PacketHandler', 'SALHandler']
+
+PacketHandler = Callable[[BasePacket], Any]
+SALHandler = Callable[[PointToMultipointPacket, SAL], Any]
+_SALKey = Tuple[Optional[Union[int, Application]], type]
 
 
 class CBusProtocol(BufferedProtocol, abc.ABC):
@@ -35,7 +42,8 @@ class CBusProtocol(BufferedProtocol, abc.ABC):
 
     """
 
-    def __init__(self, emulate_pci: bool = True):
+    def __init__(self, emulate_pci: bool = True,
+                 packet_cache: Optional[PacketCache] = None):
         """
         :param emulate_pci: If True, this protocol handler will implement
             some of the low-level primitives to emulate a PCI; all
@@ -46,37 +54,61 @@ class CBusProtocol(BufferedProtocol, abc.ABC):
             If False, this protocol handler will act as if it is
             communicating _with_ a PCI; incoming data will be parsed as if it
             were sent by a PCI. Checksums are required by default.
+        :param packet_cache: If set, decoded packets are cached here, and
+            ``handle_cbus_packet`` will receive frozen (immutable) packets
+            which may be shared between calls.
         """
         super(CBusProtocol, self).__init__(size_limit=MAX_BUFFER_SIZE)
         self.emulate_pci = bool(emulate_pci)  # type: bool
         self.checksum = not self.emulate_pci  # type: bool
+        self.packet_cache = packet_cache  # type: Optional[PacketCache]
+
+        # Registered handlers, and handlers resolved for concrete types.
+        self._packet_handlers = {}  # type: Dict[type, PacketHandler]
+        self._packet_dispatch = {}  # type: Dict[type, Optional[PacketHandler]]
+        self._sal_handlers = {}  # type: Dict[_SALKey, SALHandler]
+        self._sal_dispatch = {}  # type: Dict[_SALKey, Optional[SALHandler]]
 
-    def handle_data(self, buf: bytes) -> int:
+    def handle_data(self, buf: bytes, offset: int) -> int:
         """
-        Decodes a single CBus event and calls an event handler appropriate to
-        the event.
+        Decodes all complete CBus events in the buffer, and calls an event
+        handler appropriate to each event.
 
         Do not override this.
 
         :param buf: CBus event data
         :type buf: bytes
+        :param offset: Position in ``buf`` to start decoding from.
+        :type offset: int
 
-        :returns: Number of bytes consumed from the buffer
+        :returns: 0. The read cursor is advanced past each frame before it
+            is handled, so that a handler raising an exception does not cause
+            earlier frames to be handled again.
         """
-        logger.debug("Incoming data: %r", buf)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Incoming data: %r", bytes(buf[offset:]))
+
+        pos = offset
+        while True:
+            p, remainder = decode_packet(
+                buf, checksum=self.checksum, from_pci=not self.emulate_pci,
+                offset=pos, cache=self.packet_cache)
 
-        p, remainder = decode_packet(
-            buf, checksum=self.checksum, from_pci=not self.emulate_pci)
+            if remainder <= 0:
+                break
 
-        if self.emulate_pci and remainder > 0:
-            # Local echo
-            self.echo(buf[:remainder])
+            if self.emulate_pci:
+                # Local echo
+                self.echo(bytes(buf[pos:pos + remainder]))
 
-        if p is not None:
-            logger.debug("Got packet: %s", p)
-            self.handle_cbus_packet(p)
+            pos += remainder
+            self._consume_to(pos)
 
-        return remainder
+            if p is not None:
+                logger.debug("Got packet: %s", p)
+                self.handle_cbus_packet(p)
+
+        return 0
 
     @abc.abstractmethod
     def handle_cbus_packet(self, p: BasePacket) -> None:
@@ -88,6 +120,104 @@ class CBusProtocol(BufferedProtocol, abc.ABC):
         """
         pass
 
+    def register_packet_handler(
+            self, packet_type: Type[BasePacket],
+            handler: PacketHandler) -> None:
+        """
+        Registers a handler for a type of packet, used by ``dispatch_packet``.
+
+        The handler is also used for subclasses of ``packet_type``, unless
+        they have their own handler registered.
+
+        :param packet_type: Type of packet to handle.
+        :param handler: Callable that takes the packet as its only argument.
+        """
+        self._packet_handlers[packet_type] = handler
+        self._packet_dispatch.clear()
+
+    def register_sal_handler(
+            self, sal_type: Type[SAL], handler: SALHandler,
+            application: Optional[Union[int, Application]] = None) -> None:
+        """
+        Registers a handler for a type of SAL, used by ``dispatch_sals``.
+
+        The handler is also used for subclasses of ``sal_type``, unless they
+        have their own handler registered.
+
+        :param sal_type: Type of SAL to handle.
+        :param handler: Callable that takes the ``PointToMultipointPacket``
+            and the SAL as arguments.
+        :param application: If set, only use this handler for SALs sent to
+            this application. Handlers registered for a specific application
+            take precedence over those which are not.
+        """
+        self._sal_handlers[(application, sal_type)] = handler
+        self._sal_dispatch.clear()
+
+    def dispatch_packet(self, p: BasePacket) -> Any:
+        """
+        Calls the handler registered for the type of ``p``.
+
+        :returns: The return value of the handler, or ``None`` if there was
+            no handler for this type of packet.
+        """
+        t = type(p)
+        try:
+            handler = self._packet_dispatch[t]
+        except KeyError:
+            handler = None
+            for base in t.__mro__:
+                handler = self._packet_handlers.get(base)
+                if handler is not None:
+                    break
+            self._packet_dispatch[t] = handler
+
+        if handler is None:
+            logger.debug('unhandled packet type: %r', p)
+            return None
+        return handler(p)
+
+    def _resolve_sal_handler(self, key: _SALKey) -> Optional[SALHandler]:
+        application, t = key
+        handlers = self._sal_handlers
+        handler = None
+        # Application-specific handlers take precedence over generic ones,
+        # even if the generic handler is for a more specific type.
+        for app in (application, None):
+            for base in t.__mro__:
+                handler = handlers.get((app, base))
+                if handler is not None:
+                    break
+            if handler is not None:
+                break
+        self._sal_dispatch[key] = handler
+        return handler
+
+    def dispatch_sals(self, p: PointToMultipointPacket) -> bool:
+        """
+        Calls the handler registered for each SAL in ``p``.
+
+        A handler may return False to indicate that it did not handle the
+        SAL.
+
+        :returns: True if every SAL was handled.
+        """
+        dispatch = self._sal_dispatch
+        handled = True
+        for s in p:
+            key = (s.application, type(s))
+            try:
+                handler = dispatch[key]
+            except KeyError:
+                handler = self._resolve_sal_handler(key)
+
+            if handler is None:
+                logger.debug('unhandled SAL type: %r', s)
+                handled = False
+            elif handler(p, s) is False:
+                handled = False
+        return handled
+
     def echo(self, data: bytes) -> None:
         """
         Called when data needs to be echoed to the underlying transport.
@@ -27,6 +27,7 @@ class ConfirmationPacket(SpecialServerPacket):
     """
     Confirmation special packet.  Serial interface guide s4.3.3.3 p32
     """
+    __slots__ = ('_code', '_success')
 
     def __init__(self, code: bytes, success: bool):
         super(ConfirmationPacket, self).__init__()
@@ -24,6 +24,8 @@ from cbus.protocol.base_packet import BasePacket
 
 
 class DeviceManagementPacket(BasePacket):
+    __slots__ = ('parameter', 'value')
+
     def __init__(
             self, checksum: bool = True,
             priority_class: PriorityClass = PriorityClass.CLASS_2,
@@ -22,6 +22,7 @@ __all__ = ['PCIErrorPacket']
 
 
 class PCIErrorPacket(SpecialServerPacket):
+    __slots__ = ()
 
     def __init__(self):
         super(PCIErrorPacket, self).__init__()
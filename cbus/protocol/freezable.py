@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# cbus/protocol/freezable.py - Mixin for objects which can be made immutable
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import dataclasses
+from dataclasses import FrozenInstanceError
+from typing import Dict
+
+__all__ = ['Freezable', 'FrozenInstanceError']
+
+_FROZEN_CLASSES = {}  # type: Dict[type, type]
+
+
+def _frozen_setattr(self, name, value):
+    raise FrozenInstanceError(f'cannot assign to field {name!r}')
+
+
+def _frozen_delattr(self, name):
+    raise FrozenInstanceError(f'cannot delete field {name!r}')
+
+
+def _frozen_class(cls: type) -> type:
+    """
+    Gets a subclass of ``cls`` which does not allow assigning attributes.
+    """
+    frozen_cls = _FROZEN_CLASSES.get(cls)
+    if frozen_cls is not None:
+        return frozen_cls
+
+    namespace = {
+        '__slots__': (),
+        '__module__': cls.__module__,
+        '__qualname__': cls.__qualname__,
+        '__setattr__': _frozen_setattr,
+        '__delattr__': _frozen_delattr,
+        '_frozen': True,
+    }
+
+    if dataclasses.is_dataclass(cls) and cls.__eq__ is not object.__eq__:
+        # Dataclasses only compare equal to instances of exactly the same
+        # class, so allow frozen and non-frozen instances to be compared.
+        compare_fields = [f.name for f in dataclasses.fields(cls) if f.compare]
+
+        def __eq__(self, other):
+            if not isinstance(other, cls):
+                return NotImplemented
+            return all(getattr(self, f) == getattr(other, f)
+                       for f in compare_fields)
+
+        namespace['__eq__'] = __eq__
+        namespace['__hash__'] = cls.__hash__
+
+    frozen_cls = type(cls)(cls.__name__, (cls,), namespace)
+    _FROZEN_CLASSES[cls] = frozen_cls
+    return frozen_cls
+
+
+class Freezable:
+    """
+    Mixin for objects which can be made immutable after they are constructed.
+
+    Once ``freeze()`` has been called, assigning or deleting attributes raises
+    ``dataclasses.FrozenInstanceError``.
+
+    This works by changing the class of the object to a subclass which
+    blocks attribute assignment, so objects which are never frozen have no
+    extra overhead.
+
+    Subclasses which contain mutable collections or other ``Freezable``
+    objects should override ``freeze()`` to convert or freeze them, and then
+    call ``super().freeze()``.
+    """
+    __slots__ = ()
+    _frozen = False
+
+    @property
+    def frozen(self) -> bool:
+        """True if this object has been made immutable."""
+        return self._frozen
+
+    def freeze(self) -> None:
+        """Makes this object (and anything it contains) immutable."""
+        cls = self.__class__
+        if not cls._frozen:
+            object.__setattr__(self, '__class__', _frozen_class(cls))
@@ -17,10 +17,12 @@
 # along with this library.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import absolute_import
+from __future__ import annotations
 
-from base64 import b16decode
+from binascii import a2b_hex
 from six import byte2int, indexbytes, int2byte
-from typing import Tuple, Union
+from collections import OrderedDict
+from typing import Generator, List, Optional, Tuple, Union
 import warnings
 
 from cbus.protocol.reset_packet import ResetPacket
@@ -39,12 +41,88 @@ from cbus.common import (
     HEX_CHARS, CONFIRMATION_CODES, END_COMMAND,
     END_RESPONSE, get_real_cbus_checksum, validate_cbus_checksum)
 
+__all__ = [
+    'PacketCache',
+    'decode_all',
+    'decode_packet',
+    'decode_packets',
+]
+
+
+class PacketCache:
+    """
+    A bounded, least-recently-used cache of decoded packets.
+
+    C-Bus traffic is very repetitive, so this is keyed on the raw bytes of
+    each frame (and the decoding options), and skips decoding frames which
+    have been seen recently.
+
+    Packets stored in the cache are frozen, as they are shared between every
+    caller that decodes the same frame.
+
+    Special packets which are not framed (eg: confirmations) are never
+    cached, as they are cheaper to decode than to look up.
+
+    Warnings (eg: for checksum errors in non-strict mode) are only emitted
+    the first time a frame is decoded.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """
+        :param maxsize: Maximum number of packets to keep in the cache.
+        """
+        if maxsize <= 0:
+            raise ValueError(f'maxsize must be positive (got {maxsize})')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def __len__(self) -> int:
+        """Returns the number of packets in the cache."""
+        return len(self._cache)
+
+    def clear(self) -> None:
+        """Removes all packets from the cache, and resets the counters."""
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def decode_frame(
+            self,
+            data: bytes,
+            checksum: bool,
+            strict: bool,
+            from_pci: bool) -> Union[BasePacket, AnyCAL]:
+        """
+        Decodes a single frame (without its terminator), using a cached
+        result if available.
+
+        See ``decode_packet`` for a description of the parameters.
+        """
+        key = (data, checksum, strict, from_pci)
+        cache = self._cache
+        p = cache.get(key)
+        if p is not None:
+            self.hits += 1
+            cache.move_to_end(key)
+            return p
+
+        self.misses += 1
+        p = _decode_frame(data, checksum, strict, from_pci)
+        p.freeze()
+        cache[key] = p
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return p
+
 
 def decode_packet(
         data: bytes,
         checksum: bool = True,
         strict: bool = True,
-        from_pci: bool = True) \
+        from_pci: bool = True,
+        offset: int = 0,
+        cache: Optional[PacketCache] = None) \
         -> Tuple[Union[BasePacket, AnyCAL, None], int]:
     """
     Decodes a single C-Bus Serial Interface packet.
@@ -53,8 +131,8 @@ def decode_packet(
 
     0. The packet that was parsed, or None if there was no packet that could
        be parsed.
-    1. The buffer position that we parsed up to. This may be non-zero even if
-       the packet was None (eg: Cancel request).
+    1. The number of bytes from ``offset`` that we parsed up to. This may be
+       non-zero even if the packet was None (eg: Cancel request).
 
     Note: this decoder does not support unaddressed packets (such as Standard
     Format Status Replies).
@@ -74,58 +152,61 @@ def decode_packet(
         messages that software expecting to communicate with a PCI sends. This
         could be used to build a fake PCI, or analyse the behaviour of other
         C-Bus software.
+    :param offset: Position in ``data`` to start parsing from. This allows
+        decoding from a larger receive buffer without copying it.
+    :param cache: If set, looks up frames in this ``PacketCache`` before
+        decoding them, and stores newly decoded frames in it. Packets
+        returned from a cache are frozen, and may be shared with other
+        callers.
     """
-    confirmation = None
     consumed = 0
-    # Serial Interface User Guide s4.2.7
-    device_managment_cal = False
 
-    if data == b'':
+    if offset >= len(data):
         return None, 0
 
     # There are some special transport-layer flags that need to be handled
     # before parsing the rest of the message.
     if from_pci:
-        if data.startswith(b'+'):  # +
+        if data.startswith(b'+', offset):  # +
             return PowerOnPacket(), consumed + 1
-        elif data.startswith(b'!'):  # !
+        elif data.startswith(b'!', offset):  # !
             # buffer is full / invalid checksum, some requests may be dropped.
             # serial interface guide s4.3.3 p28
             return PCIErrorPacket(), consumed + 1
 
-        if len(data) < MIN_MESSAGE_SIZE:
+        if len(data) - offset < MIN_MESSAGE_SIZE:
             # Not enough data in the buffer to process yet.
             return None, 0
 
-        if data[0] in CONFIRMATION_CODES:
-            success = indexbytes(data, 1) == 0x2e  # .
-            code = data[:1]
+        if data[offset] in CONFIRMATION_CODES:
+            success = data[offset + 1] == 0x2e  # .
+            code = bytes(data[offset:offset + 1])
             return ConfirmationPacket(code, success), consumed + 2
 
-        end = data.find(END_RESPONSE)
+        end = data.find(END_RESPONSE, offset)
     else:
-        if data.startswith(b'~'):
+        if data.startswith(b'~', offset):
             # Reset
             # Serial Interface Guide, s4.2.3
             return ResetPacket(), consumed + 1
-        elif data.startswith(b'null'):
+        elif data.startswith(b'null', offset):
             # Toolkit is buggy, just ignore it.
             return None, consumed + 4
-        elif (data.startswith(b'|' + END_COMMAND)
-              or data.startswith(b'||' + END_COMMAND)):
+        elif (data.startswith(b'|' + END_COMMAND, offset)
+              or data.startswith(b'||' + END_COMMAND, offset)):
             # SMART + CONNECT shortcut
-            consumed += data.find(END_COMMAND) + 1
+            consumed += data.find(END_COMMAND, offset) - offset + 1
             return SmartConnectShortcutPacket(), consumed
         else:
             # Check if we need to discard a message
             # Serial interface guide, s4.2.4
-            nlp = data.find(END_COMMAND)
-            qp = data.find(b'?')
+            nlp = data.find(END_COMMAND, offset)
+            qp = data.find(b'?', offset)
             if -1 < qp < nlp:
                 # Discard data before the "?", and continue
-                return None, consumed + qp + 1
+                return None, consumed + qp - offset + 1
 
-        end = data.find(END_COMMAND)
+        end = data.find(END_COMMAND, offset)
 
     # Look for ending character(s). If there is none, break out now.
     if end == -1:
@@ -133,17 +214,39 @@ def decode_packet(
 
     # Make it so the end of the buffer is where the end of the command is, and
     # consume the command up to and including the ending byte(s).
-    data = data[:end]
+    #
+    # This is the only place the frame is copied out of the buffer.
+    data = bytes(data[offset:end])
 
     if from_pci:
-        consumed += end + len(END_RESPONSE)
+        consumed += end - offset + len(END_RESPONSE)
     else:
-        consumed += end + len(END_COMMAND)
+        consumed += end - offset + len(END_COMMAND)
 
     if not data:
         # Empty command, break out!
         return None, consumed
 
+    if cache is None:
+        return _decode_frame(data, checksum, strict, from_pci), consumed
+
+    return cache.decode_frame(data, checksum, strict, from_pci), consumed
+
+
+def _decode_frame(
+        data: bytes,
+        checksum: bool,
+        strict: bool,
+        from_pci: bool) -> Union[BasePacket, AnyCAL]:
+    """
+    Decodes a single frame, without its terminator.
+
+    See ``decode_packet`` for a description of the parameters.
+    """
+    confirmation = None
+    # Serial Interface User Guide s4.2.7
+    device_managment_cal = False
+
     if not from_pci:
         if data.startswith(b'@'):
             # Once-off BASIC mode command, Serial Interface Guide, s4.2.7
@@ -164,7 +267,7 @@ def decode_packet(
                     return InvalidPacket(
                         payload=data,
                         exception=ValueError(
-                            'Confirmation code is not in range g..z')), consumed
+                            'Confirmation code is not in range g..z'))
                 else:
                     warnings.warn(
                         'Confirmation code is not in range g..z')
@@ -172,13 +275,16 @@ def decode_packet(
             # strip confirmation byte
             data = data[:-1]
 
-    for c in data:
-        if c not in HEX_CHARS:
-            return InvalidPacket(payload=data, exception=ValueError(
-                f'Non-base16 input: {c:x} in {data}')), consumed
+    # Strip every valid base16 character in one pass; anything left over is
+    # invalid input.
+    invalid = data.translate(None, HEX_CHARS)
+    if invalid:
+        return InvalidPacket(payload=data, exception=ValueError(
+            f'Non-base16 input: {invalid[0]:x} in {data}'))
 
-    # base16 decode
-    data = b16decode(data)
+    # base16 decode. The input is already validated, so this doesn't need to
+    # do it again.
+    data = a2b_hex(data)
 
     # get the checksum, if it's there.
     if checksum:
@@ -188,7 +294,7 @@ def decode_packet(
             if strict:
                 return InvalidPacket(payload=data, exception=ValueError(
                     f'C-Bus checksum incorrect (expected 0x{real_checksum:x}) '
-                    f'and strict mode is enabled: {data}')), consumed
+                    f'and strict mode is enabled: {data}'))
             else:
                 warnings.warn(
                     f'C-Bus checksum incorrect (expected 0x{real_checksum:x}) '
@@ -224,8 +330,8 @@ def decode_packet(
             p = DeviceManagementPacket.decode_packet(
                 data=data, checksum=checksum, priority_class=priority_class)
         elif device_managment_cal:
-            cal, cal_len = PointToPointPacket.decode_cal(data)
-            return cal, consumed + cal_len
+            cal, _ = PointToPointPacket.decode_cal(data)
+            return cal
 
         elif address_type == DestinationAddressType.POINT_TO_POINT:
             # decode as point-to-point packet
@@ -254,4 +360,65 @@ def decode_packet(
     except Exception as e:
         p = InvalidPacket(payload=data, exception=e)
 
-    return p, consumed
+    return p
+
+
+def decode_packets(
+        data: bytes,
+        checksum: bool = True,
+        strict: bool = True,
+        from_pci: bool = True,
+        offset: int = 0,
+        cache: Optional[PacketCache] = None) \
+        -> Generator[Union[BasePacket, AnyCAL], None, int]:
+    """
+    Decodes all complete C-Bus Serial Interface packets in a buffer.
+
+    This walks the buffer once, starting at ``offset``, and yields each
+    packet as it is decoded. Incomplete data at the end of the buffer is left
+    alone. Positions where no packet could be parsed (eg: Cancel requests)
+    are skipped over without yielding anything.
+
+    When the generator is exhausted, its return value is the position in
+    ``data`` of the first byte which was not consumed. Use ``decode_all`` if
+    you need this.
+
+    See ``decode_packet`` for a description of the parameters.
+    """
+    while True:
+        p, consumed = decode_packet(
+            data, checksum, strict, from_pci, offset, cache)
+        if consumed <= 0:
+            return offset
+
+        offset += consumed
+        if p is not None:
+            yield p
+
+
+def decode_all(
+        data: bytes,
+        checksum: bool = True,
+        strict: bool = True,
+        from_pci: bool = True,
+        offset: int = 0,
+        cache: Optional[PacketCache] = None) \
+        -> Tuple[List[Union[BasePacket, AnyCAL]], int]:
+    """
+    Decodes all complete C-Bus Serial Interface packets in a buffer.
+
+    The return value is a tuple:
+
+    0. A list of the packets that were parsed.
+    1. The position in ``data`` of the first byte that was not consumed. Any
+       data from this position onwards is an incomplete packet.
+
+    See ``decode_packet`` for a description of the parameters.
+    """
+    packets = []
+    decoder = decode_packets(data, checksum, strict, from_pci, offset, cache)
+    while True:
+        try:
+            packets.append(next(decoder))
+        except StopIteration as e:
+            return packets, e.value
@@ -18,12 +18,18 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-from asyncio import (CancelledError, Future, Lock, create_task,
-                     get_running_loop, run, sleep)
+from asyncio import (CancelledError, Future, Lock, TimeoutError,
+                     TimerHandle, create_task, gather, get_event_loop,
+                     get_running_loop, run, shield, sleep, wait_for)
+from array import array
 from asyncio.transports import WriteTransport
+from collections import OrderedDict, deque
 from datetime import datetime
+from functools import partial
 import logging
-from typing import Iterable, Optional, Text, Union
+from time import monotonic
+from typing import (
+    Deque, Dict, Iterable, List, Optional, Set, Text, Tuple, Union)
 
 from six import int2byte
 
@@ -34,21 +40,27 @@ except ImportError:
         raise ImportError('Serial device support requires pyserial-asyncio')
 
 from cbus.common import (
-    Application, CONFIRMATION_CODES, END_COMMAND, add_cbus_checksum)
+    Application, CONFIRMATION_CODES, END_COMMAND, GroupState,
+    IdentifyAttribute, add_cbus_checksum, check_ga)
 from cbus.protocol.application.clock import (
-    ClockSAL, ClockRequestSAL, ClockUpdateSAL, clock_update_sal)
+    ClockRequestSAL, ClockUpdateSAL, clock_update_sal)
+from cbus.protocol.application.enable import EnableSetNetworkVariableSAL
 from cbus.protocol.application.lighting import (
-    LightingSAL, LightingOnSAL, LightingOffSAL, LightingRampSAL,
-    LightingTerminateRampSAL)
+    LightingOnSAL, LightingOffSAL, LightingRampSAL, LightingTerminateRampSAL)
 from cbus.protocol.application.status_request import StatusRequestSAL
-from cbus.protocol.base_packet import (
-    BasePacket, SpecialServerPacket, SpecialClientPacket)
+from cbus.protocol.application.sal import SAL
+from cbus.protocol.application.temperature import TemperatureBroadcastSAL
+from cbus.protocol.base_packet import BasePacket, SpecialClientPacket
+from cbus.protocol.cal.extended import ExtendedCAL
 from cbus.protocol.cal.identify import IdentifyCAL
+from cbus.protocol.cal.reply import ReplyCAL
+from cbus.protocol.cal.report import BinaryStatusReport, LevelStatusReport
 from cbus.protocol.cbus_protocol import CBusProtocol
 from cbus.protocol.confirm_packet import ConfirmationPacket
 from cbus.protocol.dm_packet import DeviceManagementPacket
+from cbus.protocol.packet import PacketCache
 from cbus.protocol.error_packet import PCIErrorPacket
-# from cbus.protocol.po_packet import PowerOnPacket
+from cbus.protocol.po_packet import PowerOnPacket
 from cbus.protocol.pm_packet import PointToMultipointPacket
 from cbus.protocol.pp_packet import PointToPointPacket
 from cbus.protocol.reset_packet import ResetPacket
@@ -58,6 +70,89 @@ logger = logging.getLogger(__name__)
 __all__ = ['PCIProtocol']
 
 
+# Weight given to new confirmation latency samples.
+_LATENCY_ALPHA = 0.125
+
+# Limits for the extra delay between commands after the PCI rejects data.
+_MIN_BACKOFF = 0.02
+_MAX_BACKOFF = 1.0
+
+# Don't bother scheduling a timer to pace commands for less than this.
+_MIN_SEND_DELAY = 0.001
+
+# Maximum number of bytes of SALs to put in a single packet when coalescing
+# commands. This is the size of 9 lighting on/off SALs.
+_MAX_COALESCED_SAL_LENGTH = 18
+
+
+class _PendingCommand:
+    """A command waiting to be sent to, or confirmed by, the PCI."""
+    __slots__ = ('data', 'future', 'timer', 'sent_at', 'retries')
+
+    def __init__(self, data: bytes, future: Future):
+        self.data = data
+        self.future = future
+        self.timer = None  # type: Optional[TimerHandle]
+        self.sent_at = 0.
+        self.retries = 0
+
+
+class _Ramp:
+    """
+    A lighting ramp in progress on a group.
+
+    ``origin`` is None if the level of the group was unknown when the ramp
+    started.
+    """
+    __slots__ = ('start', 'origin', 'target', 'duration')
+
+    def __init__(self, start: float, origin: Optional[int], target: int,
+                 duration: float):
+        self.start = start
+        self.origin = origin
+        self.target = target
+        self.duration = duration
+
+    def finished(self, now: float) -> bool:
+        return now - self.start >= self.duration
+
+    def level_at(self, now: float) -> Optional[int]:
+        """
+        Estimates the level of the group at ``now``, presuming it changes
+        linearly over the ramp. The ramp must not have finished.
+
+        :returns: The estimated level, or None if the origin is unknown.
+        """
+        if self.origin is None:
+            return None
+        elapsed = now - self.start
+        if elapsed <= 0:
+            return self.origin
+        return round(self.origin + (self.target - self.origin) *
+                     elapsed / self.duration)
+
+
+def _copy_combined_result(target: Future, source: Future) -> None:
+    """
+    Copies the result of ``gather()``ing packet Futures into ``target``.
+    """
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(all(source.result()))
+
+
+def _log_command_failure(future: Future) -> None:
+    # This also stops asyncio complaining about exceptions that were never
+    # retrieved, for callers which don't care about the result.
+    if not future.cancelled() and future.exception() is not None:
+        logger.debug(f'send: command failed: {future.exception()!r}')
+
+
 class PCIProtocol(CBusProtocol):
     """
     Implements an asyncio Protocol for communicating with a C-Bus PCI/CNI over
@@ -69,16 +164,75 @@ class PCIProtocol(CBusProtocol):
             self,
             timesync_frequency: int = 10,
             handle_clock_requests: bool = True,
-            connection_lost_future: Optional[Future] = None):
-        super(PCIProtocol, self).__init__(emulate_pci=False)
+            connection_lost_future: Optional[Future] = None,
+            packet_cache: Optional[PacketCache] = None,
+            max_in_flight: int = 5,
+            confirmation_timeout: float = 2.0,
+            max_retries: int = 2,
+            coalesce_window: float = 0.):
+        """
+        :param timesync_frequency: Send the time to the network every n
+            seconds, or 0 to disable.
+        :param handle_clock_requests: Respond to time requests from the
+            network.
+        :param connection_lost_future: Future to set when the connection to
+            the PCI is lost. This may be shared between several protocols, in
+            which case it is set when the first connection is lost.
+        :param packet_cache: Cache of decoded packets, see ``CBusProtocol``.
+        :param max_in_flight: Maximum number of commands sent to the PCI which
+            have not yet been confirmed. At most 20.
+        :param confirmation_timeout: Number of seconds to wait for the PCI to
+            confirm a command.
+        :param max_retries: Number of times to retransmit a command which the
+            PCI didn't confirm or couldn't accept.
+        :param coalesce_window: Number of seconds to wait for other lighting
+            commands to merge into the same packet, or 0 to send every command
+            in its own packet.
+        """
+        super(PCIProtocol, self).__init__(
+            emulate_pci=False, packet_cache=packet_cache)
+
+        if not 1 <= max_in_flight <= len(CONFIRMATION_CODES):
+            raise ValueError(
+                f'max_in_flight must be in range 1 - '
+                f'{len(CONFIRMATION_CODES)}')
 
         self._transport = None  # type: Optional[WriteTransport]
-        self._next_confirmation_index = 0
+        self._max_in_flight = max_in_flight
+        self._confirmation_timeout = confirmation_timeout
+        self._max_retries = max_retries
+
+        # Outbound flow control: the in-flight window is adjusted AIMD-style,
+        # and commands are paced by the measured confirmation latency.
+        self._window = float(max_in_flight)
+        self._latency = 0.
+        self._backoff = 0.
+        self._last_write = 0.
+        self._flush_timer = None  # type: Optional[TimerHandle]
+
+        # Lighting SALs waiting to be merged into packets, per application.
+        self._coalesce_window = coalesce_window
+        self._coalesce_timer = None  # type: Optional[TimerHandle]
+        self._coalesce_batches = OrderedDict(
+        )  # type: Dict[int, List[Tuple[List[SAL], Future]]]
+
+        # Last known level of each group, per application. -1 is unknown.
+        # For groups which are ramping, this is the target level.
+        self._group_levels = {}  # type: Dict[int, array]
+        # Ramps in progress, by (application, group).
+        self._ramps = {}  # type: Dict[Tuple[int, int], _Ramp]
+        # Futures waiting for REPLY CALs, by (unit address, parameter).
+        self._reply_waiters = {}  # type: Dict[Tuple[int, int], Future]
+        self._free_confirmation_codes = deque(
+            int2byte(c) for c in CONFIRMATION_CODES)  # type: Deque[bytes]
+        self._in_flight = OrderedDict()  # type: Dict[bytes, _PendingCommand]
+        self._send_queue = deque()  # type: Deque[_PendingCommand]
         self._recv_buffer = bytearray()
         self._recv_buffer_lock = Lock()
         self._timesync_frequency = timesync_frequency
         self._connection_lost_future = connection_lost_future
         self._handle_clock_requests = bool(handle_clock_requests)
+        self._register_handlers()
 
     def connection_made(self, transport: WriteTransport) -> None:
         """
@@ -92,50 +246,193 @@ class PCIProtocol(CBusProtocol):
         if self._timesync_frequency:
             create_task(self.timesync())
 
+    @property
+    def connected(self) -> bool:
+        """True if there is an open connection to the PCI."""
+        transport = self._transport
+        return transport is not None and not transport.is_closing()
+
     def connection_lost(self, exc: Optional[Exception]) -> None:
         self._transport = None
-        self._connection_lost_future.set_result(True)
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._coalesce_timer is not None:
+            self._coalesce_timer.cancel()
+            self._coalesce_timer = None
+        self._fail_all_commands(IOError('connection lost'))
+        waiters = list(self._reply_waiters.values())
+        self._reply_waiters.clear()
+        for future in waiters:
+            if not future.done():
+                future.set_exception(IOError('connection lost'))
+        future = self._connection_lost_future
+        if future is not None and not future.done():
+            future.set_result(True)
 
     def handle_cbus_packet(self, p: BasePacket) -> None:
         """
         Dispatches all packet types into a high level event handler.
+
+        Additional packet and SAL types can be handled with
+        ``register_packet_handler`` and ``register_sal_handler``.
         """
+        self.dispatch_packet(p)
+
+    # packet and SAL handlers, these dispatch to the event handlers below.
+    def _register_handlers(self) -> None:
+        rp = self.register_packet_handler
+        rp(PCIErrorPacket, self._handle_pci_error)
+        rp(PowerOnPacket, self._handle_power_on)
+        rp(ConfirmationPacket, self._handle_confirmation)
+        rp(PointToMultipointPacket, self.dispatch_sals)
+        rp(PointToPointPacket, self._handle_point_to_point)
+        rp(ExtendedCAL, self._handle_extended_cal)
+
+        rs = self.register_sal_handler
+        rs(LightingRampSAL, self._handle_lighting_ramp)
+        rs(LightingOnSAL, self._handle_lighting_on)
+        rs(LightingOffSAL, self._handle_lighting_off)
+        rs(LightingTerminateRampSAL, self._handle_lighting_terminate_ramp)
+        rs(ClockRequestSAL, self._handle_clock_request)
+        rs(ClockUpdateSAL, self._handle_clock_update)
+        rs(TemperatureBroadcastSAL, self._handle_temperature_broadcast)
+        rs(EnableSetNetworkVariableSAL,
+           self._handle_enable_set_network_variable)
+
+    def _handle_pci_error(self, p: PCIErrorPacket) -> None:
+        # The PCI doesn't say which command it rejected, but it processes
+        # them in order, so it is most likely the oldest unconfirmed one.
+        if self._in_flight:
+            code = next(iter(self._in_flight))
+            self._command_failed(code, IOError('PCI cannot accept data'))
+        else:
+            self._congestion()
+        self.on_pci_cannot_accept_data()
+
+    def _handle_power_on(self, p: PowerOnPacket) -> None:
+        self.on_pci_power_up()
+
+    def _handle_confirmation(self, p: ConfirmationPacket) -> None:
+        if not self._command_confirmed(p.code, p.success):
+            logger.debug(f'recv: unexpected confirmation code {p.code!r}')
+        self.on_confirmation(p.code, p.success)
+
+    def _handle_point_to_point(self, p: PointToPointPacket) -> None:
+        for cal in p:
+            if isinstance(cal, ExtendedCAL):
+                self._handle_extended_cal(cal)
+            elif isinstance(cal, ReplyCAL):
+                self._handle_reply(p.source_address, cal)
+
+    def _handle_reply(self, source_addr: int, cal: ReplyCAL) -> None:
+        future = self._reply_waiters.pop((source_addr, cal.parameter), None)
+        if future is not None and not future.done():
+            future.set_result(cal.data)
+        self.on_reply(source_addr, cal.parameter, cal.data)
+
+    def _handle_extended_cal(self, cal: ExtendedCAL) -> None:
+        application = int(cal.child_application)
+        report = cal.report
+        levels = self._get_group_levels(application)
+
+        for group_addr, state in enumerate(report, cal.block_start):
+            if group_addr > 0xff:
+                break
 
-        if isinstance(p, SpecialServerPacket):
-            if isinstance(p, PCIErrorPacket):
-                self.on_pci_cannot_accept_data()
-            elif isinstance(p, ConfirmationPacket):
-                self.on_confirmation(p.code, p.success)
-            else:
-                logger.debug(f'hcp: unhandled SpecialServerPacket: {p!r}')
-        elif isinstance(p, PointToMultipointPacket):
-            for s in p:
-                if isinstance(s, LightingSAL):
-                    # lighting application
-                    if isinstance(s, LightingRampSAL):
-                        self.on_lighting_group_ramp(p.source_address,
-                                                    s.group_address,
-                                                    s.duration, s.level)
-                    elif isinstance(s, LightingOnSAL):
-                        self.on_lighting_group_on(p.source_address,
-                                                  s.group_address)
-                    elif isinstance(s, LightingOffSAL):
-                        self.on_lighting_group_off(p.source_address,
-                                                   s.group_address)
-                    elif isinstance(s, LightingTerminateRampSAL):
-                        self.on_lighting_group_terminate_ramp(
-                            p.source_address, s.group_address)
-                    else:
-                        logger.debug(f'hcp: unhandled lighting SAL type: {s!r}')
-                elif isinstance(s, ClockSAL):
-                    if isinstance(s, ClockRequestSAL):
-                        self.on_clock_request(p.source_address)
-                    elif isinstance(s, ClockUpdateSAL):
-                        self.on_clock_update(p.source_address, s.val)
+            if isinstance(report, LevelStatusReport):
+                level = state
+            elif isinstance(report, BinaryStatusReport):
+                if state == GroupState.ON:
+                    # Binary reports don't tell us the level, so keep the
+                    # level we had if it was on.
+                    level = levels[group_addr]
+                    if level <= 0:
+                        level = 255
+                elif state == GroupState.OFF:
+                    level = 0
                 else:
-                    logger.debug(f'hcp: unhandled SAL type: {s!r}')
-        else:
-            logger.debug(f'hcp: unhandled other packet: {p!r}')
+                    level = None
+            else:
+                break
+
+            # The unit's report replaces any ramp we were estimating.
+            self._ramps.pop((application, group_addr), None)
+            levels[group_addr] = -1 if level is None else level
+            if level is not None:
+                self.on_lighting_group_level_report(
+                    application, group_addr, level)
+
+    def _get_group_levels(self, application: int) -> array:
+        levels = self._group_levels.get(application)
+        if levels is None:
+            levels = self._group_levels[application] = array('h', [-1]) * 256
+        return levels
+
+    def _set_group_level(self, application: int, group_addr: int,
+                         level: int) -> None:
+        self._ramps.pop((application, group_addr), None)
+        self._get_group_levels(application)[group_addr] = level
+
+    def _handle_lighting_ramp(
+            self, p: PointToMultipointPacket, s: LightingRampSAL) -> None:
+        application = int(s.application)
+        origin = self.get_group_level(s.group_address, application)
+        self._set_group_level(application, s.group_address, s.level)
+        if s.duration > 0 and origin != s.level:
+            # If the origin is unknown, so is the level until the ramp ends.
+            self._ramps[application, s.group_address] = _Ramp(
+                monotonic(), origin, s.level, s.duration)
+
+        self.on_lighting_group_ramp(
+            p.source_address, s.group_address, s.duration, s.level,
+            s.application)
+
+    def _handle_lighting_on(
+            self, p: PointToMultipointPacket, s: LightingOnSAL) -> None:
+        self._set_group_level(int(s.application), s.group_address, 255)
+        self.on_lighting_group_on(
+            p.source_address, s.group_address, s.application)
+
+    def _handle_lighting_off(
+            self, p: PointToMultipointPacket, s: LightingOffSAL) -> None:
+        self._set_group_level(int(s.application), s.group_address, 0)
+        self.on_lighting_group_off(
+            p.source_address, s.group_address, s.application)
+
+    def _handle_lighting_terminate_ramp(
+            self, p: PointToMultipointPacket,
+            s: LightingTerminateRampSAL) -> None:
+        # The group stays at whatever level it had ramped to. If the ramp
+        # started from an unknown level, that level is unknown too.
+        application = int(s.application)
+        level = self.get_group_level(s.group_address, application)
+        self._ramps.pop((application, s.group_address), None)
+        self._get_group_levels(application)[s.group_address] = (
+            -1 if level is None else level)
+
+        self.on_lighting_group_terminate_ramp(
+            p.source_address, s.group_address, s.application)
+
+    def _handle_clock_request(
+            self, p: PointToMultipointPacket, s: ClockRequestSAL) -> None:
+        self.on_clock_request(p.source_address)
+
+    def _handle_clock_update(
+            self, p: PointToMultipointPacket, s: ClockUpdateSAL) -> None:
+        self.on_clock_update(p.source_address, s.val)
+
+    def _handle_temperature_broadcast(
+            self, p: PointToMultipointPacket,
+            s: TemperatureBroadcastSAL) -> None:
+        self.on_temperature_broadcast(
+            p.source_address, s.group_address, s.temperature)
+
+    def _handle_enable_set_network_variable(
+            self, p: PointToMultipointPacket,
+            s: EnableSetNetworkVariableSAL) -> None:
+        self.on_enable_set_network_variable(
+            p.source_address, s.variable, s.value)
 
     # event handlers
     def on_confirmation(self, code: bytes, success: bool):
@@ -166,8 +463,9 @@ class PCIProtocol(CBusProtocol):
         """
         logger.debug(f'recv: mmi: application {application}, data {data!r}')
 
-    def on_lighting_group_ramp(self, source_addr: int, group_addr: int,
-                               duration: int, level: int):
+    def on_lighting_group_ramp(
+            self, source_addr: int, group_addr: int, duration: int,
+            level: int, application: int = Application.LIGHTING):
         """
         Event called when a lighting application ramp (fade) request is
         received.
@@ -184,12 +482,16 @@ class PCIProtocol(CBusProtocol):
 
         :param level: Target brightness of the ramp (0 - 255).
         :type level: int
+
+        :param application: Lighting application that the group is part of.
+        :type application: int
         """
         logger.debug(
-            f'recv: light ramp: from {source_addr} to {group_addr}, duration '
-            f'{duration} seconds to level {level} ')
+            f'recv: light ramp: from {source_addr} to {application:x}/'
+            f'{group_addr}, duration {duration} seconds to level {level} ')
 
-    def on_lighting_group_on(self, source_addr: int, group_addr: int):
+    def on_lighting_group_on(self, source_addr: int, group_addr: int,
+                             application: int = Application.LIGHTING):
         """
         Event called when a lighting application "on" request is received.
 
@@ -199,10 +501,15 @@ class PCIProtocol(CBusProtocol):
 
         :param group_addr: Group address being turned on.
         :type group_addr: int
+
+        :param application: Lighting application that the group is part of.
+        :type application: int
         """
-        logger.debug(f'recv: light on: from {source_addr} to {group_addr}')
+        logger.debug(f'recv: light on: from {source_addr} to '
+                     f'{application:x}/{group_addr}')
 
-    def on_lighting_group_off(self, source_addr: int, group_addr: int):
+    def on_lighting_group_off(self, source_addr: int, group_addr: int,
+                              application: int = Application.LIGHTING):
         """
         Event called when a lighting application "off" request is received.
 
@@ -212,11 +519,16 @@ class PCIProtocol(CBusProtocol):
 
         :param group_addr: Group address being turned off.
         :type group_addr: int
+
+        :param application: Lighting application that the group is part of.
+        :type application: int
         """
-        logger.debug(f'recv: light off: from {source_addr} to {group_addr}')
+        logger.debug(f'recv: light off: from {source_addr} to '
+                     f'{application:x}/{group_addr}')
 
     def on_lighting_group_terminate_ramp(
-            self, source_addr: int, group_addr: int):
+            self, source_addr: int, group_addr: int,
+            application: int = Application.LIGHTING):
         """
         Event called when a lighting application "terminate ramp" request is
         received.
@@ -227,9 +539,37 @@ class PCIProtocol(CBusProtocol):
 
         :param group_addr: Group address stopping ramping.
         :type group_addr: int
+
+        :param application: Lighting application that the group is part of.
+        :type application: int
+
+        ``get_group_level`` returns the estimated level that the group stopped
+        at, if the level before the ramp started was known.
+        """
+        logger.debug(
+            f'recv: terminate ramp: from {source_addr} to '
+            f'{application:x}/{group_addr}')
+
+    def on_lighting_group_level_report(
+            self, application: int, group_addr: int, level: int):
+        """
+        Event called when a unit reports the level of a group, in response to
+        a status request (such as from ``refresh_levels``).
+
+        :param application: Application that the group is part of.
+        :type application: int
+
+        :param group_addr: Group address that was reported.
+        :type group_addr: int
+
+        :param level: Brightness of the group (0 - 255). For binary status
+                      reports, this is 0 for off, and 255 (or the last known
+                      level) for on.
+        :type level: int
         """
         logger.debug(
-            f'recv: terminate ramp: from {source_addr} to {group_addr}')
+            f'recv: level report: application {application:x}, group '
+            f'{group_addr} at level {level}')
 
     def on_lighting_label_text(self, source_addr: int, group_addr: int,
                                flavour: int, language_code: int, label: Text):
@@ -275,6 +615,9 @@ class PCIProtocol(CBusProtocol):
         While the PCI can operate at 9600 baud, this only applies to data it
         sends, not to data it recieves.
 
+        PCIProtocol automatically slows down sending commands and retransmits
+        the rejected command before this event is fired.
+
         """
         logger.debug('recv: PCI cannot accept data')
 
@@ -310,28 +653,86 @@ class PCIProtocol(CBusProtocol):
         """
         logger.debug(f'recv: clock update from {source_addr} of {val!r}')
 
-    # other things.
+    def on_temperature_broadcast(
+            self, source_addr: int, group_addr: int, temperature: float):
+        """
+        Event called when a unit broadcasts the temperature it is sensing.
+
+        :param source_addr: Source address of the unit that generated this
+                            event.
+        :type source_addr: int
+
+        :param group_addr: Group address of the temperature sensor.
+        :type group_addr: int
+
+        :param temperature: Temperature, in degrees Celsius.
+        :type temperature: float
+        """
+        logger.debug(
+            f'recv: temperature broadcast from {source_addr} for '
+            f'{group_addr} of {temperature}')
+
+    def on_enable_set_network_variable(
+            self, source_addr: int, variable: int, value: int):
+        """
+        Event called when a unit sets an enable control network variable.
+
+        :param source_addr: Source address of the unit that generated this
+                            event.
+        :type source_addr: int
+
+        :param variable: The variable ID being changed.
+        :type variable: int
 
-    def _get_confirmation_code(self):
+        :param value: The value of the network variable.
+        :type value: int
         """
-        Creates a confirmation code, and increments forward the next in the
-        list.
+        logger.debug(
+            f'recv: enable set network variable from {source_addr}: '
+            f'{variable} = {value}')
 
+    def on_reply(self, source_addr: int, parameter: int, data: bytes):
         """
-        o = CONFIRMATION_CODES[self._next_confirmation_index]
+        Event called when a unit sends a REPLY CAL, in response to a RECALL,
+        GETSTATUS or IDENTIFY command.
+
+        :param source_addr: Source address of the unit that replied.
+        :type source_addr: int
 
-        self._next_confirmation_index += 1
-        self._next_confirmation_index %= len(CONFIRMATION_CODES)
+        :param parameter: The parameter or attribute requested.
+        :type parameter: int
 
-        return int2byte(o)
+        :param data: The reply data.
+        :type data: bytes
+        """
+        logger.debug(
+            f'recv: reply from {source_addr}: {parameter:#04x} = {data!r}')
+
+    # other things.
 
     def _send(self,
               cmd: Union[BasePacket],
               confirmation: bool = True,
-              basic_mode: bool = False):
+              basic_mode: bool = False) -> Optional[Future]:
         """
         Sends a packet of CBus data.
 
+        Commands which request a confirmation are queued, and only
+        ``max_in_flight`` of them are sent to the PCI without having been
+        confirmed. A confirmation code is never reused while it is still
+        outstanding.
+
+        If the PCI reports that it cannot accept data, or a command is not
+        confirmed in time, fewer commands are sent at once, the delay between
+        commands is increased, and the command is retransmitted (up to
+        ``max_retries`` times).
+
+        :returns: If ``confirmation`` is set, a Future which resolves to True
+            when the PCI confirms the command was sent, or False if the PCI
+            reports that it failed. After all retries, it fails with
+            ``asyncio.TimeoutError`` if no confirmation arrived in time, or
+            ``IOError`` if the PCI couldn't accept the command. It also fails
+            with ``IOError`` if the connection is lost. Otherwise, None.
         """
         transport = self._transport
         if transport is None:
@@ -354,19 +755,228 @@ class PCIProtocol(CBusProtocol):
         if checksum:
             cmd = add_cbus_checksum(cmd)
 
-        if confirmation:
-            conf_code = self._get_confirmation_code()
-            cmd += conf_code
+        if not confirmation:
+            cmd += END_COMMAND
+            logger.debug(f'send: {cmd!r}')
+            transport.write(cmd)
+            return None
+
+        command = _PendingCommand(cmd, get_event_loop().create_future())
+        command.future.add_done_callback(_log_command_failure)
+        self._send_queue.append(command)
+        self._flush_send_queue()
+        return command.future
+
+    def _flush_send_queue(self) -> None:
+        """
+        Sends queued commands to the PCI, while there is room in the in-flight
+        window.
+        """
+        if self._flush_timer is not None:
+            # Waiting to send the next command.
+            return
+
+        transport = self._transport
+        queue = self._send_queue
+        in_flight = self._in_flight
+        loop = get_event_loop()
+        while (transport is not None and queue and
+               len(in_flight) < int(self._window)):
+            command = queue[0]
+            if command.future.done():
+                # Cancelled before it was sent.
+                queue.popleft()
+                continue
+
+            now = loop.time()
+            delay = self._last_write + self._send_interval() - now
+            if delay > _MIN_SEND_DELAY:
+                self._flush_timer = loop.call_later(
+                    delay, self._flush_timer_expired)
+                return
+
+            queue.popleft()
+            code = self._free_confirmation_codes.popleft()
+            command.timer = loop.call_later(
+                self._confirmation_timeout, self._confirmation_timed_out, code)
+            command.sent_at = self._last_write = now
+            in_flight[code] = command
+
+            cmd = command.data + code + END_COMMAND
+            logger.debug(f'send: {cmd!r}')
+            transport.write(cmd)
+
+    def _flush_timer_expired(self) -> None:
+        self._flush_timer = None
+        self._flush_send_queue()
+
+    def _send_interval(self) -> float:
+        """
+        Gets the minimum time between sending commands, which spreads the
+        window over the confirmation latency.
+        """
+        return max(self._latency / self._window, self._backoff)
+
+    def _congestion(self) -> None:
+        """
+        Slows down sending commands, after the PCI rejected data or didn't
+        confirm a command.
+        """
+        self._window = max(1., self._window / 2)
+        self._backoff = min(max(self._backoff * 2, _MIN_BACKOFF), _MAX_BACKOFF)
+        logger.debug(f'send: backing off, window = {self._window:.1f}, '
+                     f'interval = {self._send_interval():.3f}s')
+
+    def _pop_command(self, code: bytes) -> Optional[_PendingCommand]:
+        """
+        Removes an in-flight command, and frees its confirmation code.
+        """
+        command = self._in_flight.pop(code, None)
+        if command is not None:
+            self._free_confirmation_codes.append(code)
+            if command.timer is not None:
+                command.timer.cancel()
+        return command
+
+    def _command_confirmed(self, code: bytes, success: bool) -> bool:
+        """
+        Resolves the Future for a command which the PCI confirmed.
+
+        :returns: False if there was no command in-flight with that code.
+        """
+        command = self._pop_command(code)
+        if command is None:
+            return False
+
+        # Only measure commands which were sent once, as we can't tell which
+        # attempt a confirmation of a retransmitted command is for.
+        if command.retries == 0:
+            sample = get_event_loop().time() - command.sent_at
+            self._latency += _LATENCY_ALPHA * (sample - self._latency)
+
+        self._window = min(
+            float(self._max_in_flight), self._window + 1. / self._window)
+        self._backoff /= 2
+        if self._backoff < _MIN_SEND_DELAY:
+            self._backoff = 0.
+
+        if not command.future.done():
+            command.future.set_result(success)
+        self._flush_send_queue()
+        return True
+
+    def _command_failed(self, code: bytes, exc: Exception) -> None:
+        """
+        Retransmits an in-flight command, or fails its Future if it has run
+        out of retries.
+        """
+        command = self._pop_command(code)
+        if command is None:
+            return
 
-            # TODO: implement proper handling of confirmation codes.
+        self._congestion()
+        if command.future.done():
+            pass
+        elif command.retries < self._max_retries:
+            command.retries += 1
+            logger.debug(f'send: retransmitting {command.data!r} '
+                         f'(attempt {command.retries + 1}) after {exc!r}')
+            self._send_queue.appendleft(command)
         else:
-            conf_code = None
+            command.future.set_exception(exc)
+        self._flush_send_queue()
+
+    def _confirmation_timed_out(self, code: bytes) -> None:
+        self._command_failed(code, TimeoutError(
+            f'No confirmation from PCI for {code!r}'))
+
+    def _fail_all_commands(self, exc: Exception) -> None:
+        """Fails all in-flight and queued commands."""
+        commands = [self._pop_command(code) for code in list(self._in_flight)]
+        commands.extend(self._send_queue)
+        self._send_queue.clear()
+        for command in commands:
+            if not command.future.done():
+                command.future.set_exception(exc)
+
+        batches = list(self._coalesce_batches.values())
+        self._coalesce_batches.clear()
+        for batch in batches:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+
+    def _send_sals(self, sals: List[SAL]) -> Future:
+        """
+        Sends SALs in a PointToMultipointPacket.
 
-        cmd += END_COMMAND
-        logger.debug(f'send: {cmd!r}')
+        If ``coalesce_window`` is set, the SALs are held for that long, and
+        merged with other SALs for the same application into as few packets as
+        possible.
+
+        :returns: Future which resolves when the PCI confirms the command. If
+            the SALs were split over several packets, this resolves to True
+            only if all of them were sent successfully.
+        """
+        if not self._coalesce_window:
+            return self._send(PointToMultipointPacket(sals=sals))
+
+        if self._transport is None:
+            raise IOError('transport not connected')
+
+        loop = get_event_loop()
+        future = loop.create_future()
+        future.add_done_callback(_log_command_failure)
+        application = int(sals[0].application)
+        self._coalesce_batches.setdefault(application, []).append(
+            (sals, future))
+
+        if self._coalesce_timer is None:
+            self._coalesce_timer = loop.call_later(
+                self._coalesce_window, self._flush_coalesced)
+        return future
 
-        transport.write(cmd)
-        return conf_code
+    def _flush_coalesced(self) -> None:
+        """
+        Sends all SALs waiting to be coalesced, packing them into as few
+        packets as possible.
+        """
+        self._coalesce_timer = None
+        batches = list(self._coalesce_batches.values())
+        self._coalesce_batches.clear()
+
+        for batch in batches:
+            # Pack the SALs in order, and track which packets each caller's
+            # SALs ended up in.
+            packets = []  # type: List[List[SAL]]
+            packet_length = _MAX_COALESCED_SAL_LENGTH
+            callers = []  # type: List[Tuple[Future, Set[int]]]
+            for sals, future in batch:
+                packet_ids = set()  # type: Set[int]
+                for sal in sals:
+                    sal_length = len(sal.encode())
+                    if packet_length + sal_length > _MAX_COALESCED_SAL_LENGTH:
+                        packets.append([])
+                        packet_length = 0
+                    packets[-1].append(sal)
+                    packet_length += sal_length
+                    packet_ids.add(len(packets) - 1)
+                callers.append((future, packet_ids))
+
+            try:
+                packet_futures = [
+                    self._send(PointToMultipointPacket(sals=sals))
+                    for sals in packets]
+            except IOError as e:
+                for future, _ in callers:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for future, packet_ids in callers:
+                gather(*(packet_futures[i] for i in sorted(packet_ids))
+                       ).add_done_callback(
+                    partial(_copy_combined_result, future))
 
     def pci_reset(self):
         """
@@ -383,12 +993,16 @@ class PCIProtocol(CBusProtocol):
         for _ in range(3):
             self._send(ResetPacket())
 
+        # The PCI is still in basic mode, and may not confirm these, so they
+        # are sent without confirmation codes. This keeps them out of the
+        # in-flight window, so they can't hold up the commands which follow.
+
         # serial user interface guide sect 10.2
         # Set application address 1 to 38 (lighting)
         # self._send('A3210038', encode=False, checksum=False)
         self._send(DeviceManagementPacket(
             checksum=False, parameter=0x21, value=0x38),
-            basic_mode=True)
+            basic_mode=True, confirmation=False)
 
         # Interface options #3
         # = 0x0E / 0000 1110
@@ -398,7 +1012,7 @@ class PCIProtocol(CBusProtocol):
         # self._send('A342000E', encode=False, checksum=False)
         self._send(DeviceManagementPacket(
             checksum=False, parameter=0x42, value=0x0E),
-            basic_mode=True)
+            basic_mode=True, confirmation=False)
 
         # Interface options #1
         # = 0x59 / 0101 1001
@@ -410,7 +1024,7 @@ class PCIProtocol(CBusProtocol):
         # self._send('A3300059', encode=False, checksum=False)
         self._send(DeviceManagementPacket(
             checksum=False, parameter=0x30, value=0x59),
-            basic_mode=True)
+            basic_mode=True, confirmation=False)
 
     def identify(self, unit_address, attribute):
         """
@@ -423,22 +1037,74 @@ class PCIProtocol(CBusProtocol):
                           of Serial Interface Guide for acceptable codes.
         :type attribute: int
 
-        :returns: Single-byte string with code for the confirmation event.
-        :rtype: string
+        :returns: Future which resolves when the PCI confirms the command.
+        :rtype: asyncio.Future
         """
         p = PointToPointPacket(
             unit_address=unit_address, cals=[IdentifyCAL(attribute)])
         return self._send(p)
 
-    def lighting_group_on(self, group_addr: Union[int, Iterable[int]]):
+    async def identify_reply(
+            self, unit_address: int, attribute: Union[int, IdentifyAttribute],
+            timeout: float = 2.0) -> bytes:
+        """
+        Sends an IDENTIFY command to the given unit_address, and waits for
+        the unit to reply.
+
+        Requests for the same unit_address and attribute share a reply.
+
+        :param unit_address: Unit address to send the packet to
+        :param attribute: Attribute ID to retrieve information for.
+        :param timeout: Seconds to wait for a reply, after the PCI confirms
+                        the command.
+        :returns: Reply data from the unit.
+        :raises asyncio.TimeoutError: if the unit did not reply in time.
+        :raises IOError: if the command could not be sent.
+        """
+        key = (unit_address, int(attribute))
+        future = self._reply_waiters.get(key)
+        if future is None:
+            future = get_event_loop().create_future()
+            self._reply_waiters[key] = future
+            try:
+                if not await self.identify(unit_address, attribute):
+                    raise IOError(
+                        f'PCI rejected IDENTIFY for unit {unit_address}')
+            except BaseException as e:
+                if self._reply_waiters.get(key) is future:
+                    del self._reply_waiters[key]
+                # Pass the error on to other callers waiting for this reply.
+                if not future.done():
+                    future.set_exception(
+                        IOError(f'IDENTIFY for unit {unit_address} was '
+                                f'cancelled')
+                        if isinstance(e, CancelledError) else e)
+                    # Don't warn if there were no other callers.
+                    future.exception()
+                raise
+
+        try:
+            return await wait_for(shield(future), timeout)
+        except TimeoutError:
+            if self._reply_waiters.get(key) is future:
+                del self._reply_waiters[key]
+            raise
+
+    def lighting_group_on(
+            self, group_addr: Union[int, Iterable[int]],
+            application: Union[int, Application] = Application.LIGHTING):
         """
         Turns on the lights for the given group_id.
 
         :param group_addr: Group address(es) to turn the lights on for, up to 9
         :type group_addr: int, or iterable of ints of length <= 9.
 
-        :returns: Single-byte string with code for the confirmation event.
-        :rtype: string
+        :param application: Lighting application that the group addresses
+                            are part of (0x30 - 0x5f).
+        :type application: int
+
+        :returns: Future which resolves when the PCI confirms the command.
+        :rtype: asyncio.Future
 
         """
         if not isinstance(group_addr, Iterable):
@@ -452,11 +1118,12 @@ class PCIProtocol(CBusProtocol):
             raise ValueError(
                 f'group_addr iterable length is > 9 ({group_addr_count})')
 
-        p = PointToMultipointPacket(
-            sals=[LightingOnSAL(ga) for ga in group_addr])
-        return self._send(p)
+        return self._send_sals(
+            [LightingOnSAL(ga, application) for ga in group_addr])
 
-    def lighting_group_off(self, group_addr: Union[int, Iterable[int]]):
+    def lighting_group_off(
+            self, group_addr: Union[int, Iterable[int]],
+            application: Union[int, Application] = Application.LIGHTING):
         """
         Turns off the lights for the given group_id.
 
@@ -464,8 +1131,12 @@ class PCIProtocol(CBusProtocol):
                            9
         :type group_addr: int, or iterable of ints of length <= 9.
 
-        :returns: Single-byte string with code for the confirmation event.
-        :rtype: string
+        :param application: Lighting application that the group addresses
+                            are part of (0x30 - 0x5f).
+        :type application: int
+
+        :returns: Future which resolves when the PCI confirms the command.
+        :rtype: asyncio.Future
 
         """
         if not isinstance(group_addr, Iterable):
@@ -479,12 +1150,12 @@ class PCIProtocol(CBusProtocol):
             raise ValueError(
                 f'group_addr iterable length is > 9 ({group_addr_count})')
 
-        p = PointToMultipointPacket(
-            sals=[LightingOffSAL(ga) for ga in group_addr])
-        return self._send(p)
+        return self._send_sals(
+            [LightingOffSAL(ga, application) for ga in group_addr])
 
     def lighting_group_ramp(
-            self, group_addr: int, duration: int, level: int = 255):
+            self, group_addr: int, duration: int, level: int = 255,
+            application: Union[int, Application] = Application.LIGHTING):
         """
         Ramps (fades) a group address to a specified lighting level.
 
@@ -500,25 +1171,31 @@ class PCIProtocol(CBusProtocol):
         :type duration: int
         :param level: A value between 0 and 255 indicating the brightness.
         :type level: int
+        :param application: Lighting application that the group addresses
+                            are part of (0x30 - 0x5f).
+        :type application: int
 
-        :returns: Single-byte string with code for the confirmation event.
-        :rtype: string
+        :returns: Future which resolves when the PCI confirms the command.
+        :rtype: asyncio.Future
 
         """
-        p = PointToMultipointPacket(
-            sals=LightingRampSAL(group_addr, duration, level))
-        return self._send(p)
+        return self._send_sals(
+            [LightingRampSAL(group_addr, duration, level, application)])
 
     def lighting_group_terminate_ramp(
-            self, group_addr: Union[int, Iterable[int]]):
+            self, group_addr: Union[int, Iterable[int]],
+            application: Union[int, Application] = Application.LIGHTING):
         """
         Stops ramping a group address at the current point.
 
         :param group_addr: Group address to stop ramping of.
         :type group_addr: int
+        :param application: Lighting application that the group addresses
+                            are part of (0x30 - 0x5f).
+        :type application: int
 
-        :returns: Single-byte string with code for the confirmation event.
-        :rtype: string
+        :returns: Future which resolves when the PCI confirms the command.
+        :rtype: asyncio.Future
         """
 
         if not isinstance(group_addr, Iterable):
@@ -532,9 +1209,8 @@ class PCIProtocol(CBusProtocol):
             raise ValueError(
                 f'group_addr iterable length is > 9 ({group_addr_count})')
 
-        p = PointToMultipointPacket(
-            sals=[LightingTerminateRampSAL(ga) for ga in group_addr])
-        return self._send(p)
+        return self._send_sals(
+            [LightingTerminateRampSAL(ga, application) for ga in group_addr])
 
     def clock_datetime(self, when: Optional[datetime] = None):
         """
@@ -544,6 +1220,8 @@ class PCIProtocol(CBusProtocol):
                      to current local time.
         :type when: datetime.datetime
 
+        :returns: Future which resolves when the PCI confirms the command.
+        :rtype: asyncio.Future
         """
         if when is None:
             when = datetime.now()
@@ -560,14 +1238,100 @@ class PCIProtocol(CBusProtocol):
             try:
                 self.clock_datetime()
                 await sleep(frequency)
-                # self._send(PointToMultipointPacket(sals=StatusRequestSAL(
-                #     child_application=Application.LIGHTING,
-                #     level_request=True,
-                #     group_address=0,
-                # )))
             except CancelledError:
                 break
 
+    def get_group_level(
+            self, group_addr: int,
+            application: Union[int, Application] = Application.LIGHTING
+    ) -> Optional[int]:
+        """
+        Gets the last known level of a group.
+
+        Levels are learnt from lighting events on the network, and from
+        status reports (see ``refresh_levels``).
+
+        If the group is ramping, this estimates its current level from how
+        far through the ramp it is. If the group's level was unknown when the
+        ramp started, its level is unknown until the ramp finishes.
+
+        :param group_addr: Group address to get the level of.
+        :type group_addr: int
+
+        :param application: Application that the group is part of.
+        :type application: int
+
+        :returns: Brightness of the group (0 - 255), or None if unknown.
+        :rtype: int
+        """
+        check_ga(group_addr)
+        application = int(application)
+        ramp = self._ramps.get((application, group_addr))
+        if ramp is not None:
+            now = monotonic()
+            if not ramp.finished(now):
+                return ramp.level_at(now)
+            del self._ramps[application, group_addr]
+
+        levels = self._group_levels.get(application)
+        if levels is None or levels[group_addr] < 0:
+            return None
+        return levels[group_addr]
+
+    def request_group_levels(
+            self, group_addr: int,
+            application: Union[int, Application] = Application.LIGHTING
+    ) -> Future:
+        """
+        Requests the levels of the block of 32 groups containing
+        ``group_addr``.
+
+        Units reply with a level status report, which updates
+        ``get_group_level`` and fires ``on_lighting_group_level_report``.
+
+        :returns: Future which resolves when the PCI confirms the request.
+        :rtype: asyncio.Future
+        """
+        check_ga(group_addr)
+        return self._send(PointToMultipointPacket(
+            sals=StatusRequestSAL(
+                level_request=True,
+                group_address=group_addr & 0xe0,
+                child_application=int(application))))
+
+    async def refresh_levels(
+            self, application: Union[int, Application] = Application.LIGHTING,
+            interval: float = 0.1) -> None:
+        """
+        Requests the level of every group in an application.
+
+        Status requests are sent for blocks of 32 groups at a time. Units
+        reply with a level status report, which updates ``get_group_level``
+        and fires ``on_lighting_group_level_report``.
+
+        :param application: Application to request the group levels of.
+        :type application: int
+
+        :param interval: Number of seconds to wait after each request is
+                         confirmed, to give units a chance to reply.
+        :type interval: float
+        """
+        for block_start in range(0, 0x100, 0x20):
+            block = (f'Status request for application {int(application):x} '
+                     f'block {block_start:x}')
+            # Log failures, and carry on with the next block.
+            try:
+                if not await self.request_group_levels(
+                        block_start, application):
+                    logger.warning(f'{block} was rejected')
+            except TimeoutError:
+                logger.warning(f'{block} was not confirmed')
+            except IOError as e:
+                logger.warning(f'{block} failed: {e}')
+
+            if interval:
+                await sleep(interval)
+
     # def recall(self, unit_addr, param_no, count):
     #    return self._send('%s%02X%s%s%02X%02X' % (
     #        POINT_TO_46, unit_addr, ROUTING_NONE, RECALL, param_no, count
@@ -23,15 +23,11 @@ import random
 from typing import Text
 
 from cbus.common import END_RESPONSE, Application, GroupState
-from cbus.protocol.application.clock import (
-    ClockSAL, ClockUpdateSAL, ClockRequestSAL)
+from cbus.protocol.application.clock import ClockUpdateSAL, ClockRequestSAL
 from cbus.protocol.application.lighting import (
-    LightingSAL, LightingRampSAL, LightingOffSAL, LightingOnSAL,
-    LightingTerminateRampSAL)
+    LightingRampSAL, LightingOffSAL, LightingOnSAL, LightingTerminateRampSAL)
 from cbus.protocol.application.status_request import StatusRequestSAL
-from cbus.protocol.base_packet import (
-    BasePacket, InvalidPacket, SpecialClientPacket)
-from cbus.protocol.cal.recall import RecallCAL
+from cbus.protocol.base_packet import BasePacket, InvalidPacket
 from cbus.protocol.cal.report import BinaryStatusReport
 from cbus.protocol.cal.standard import StandardCAL
 from cbus.protocol.cbus_protocol import CBusProtocol
@@ -71,6 +67,7 @@ class PCIServerProtocol(CBusProtocol):
         self.application_addr1 = 0xff
         self.application_addr2 = 0xff
         self._send_queue = []
+        self._register_handlers()
 
     def connection_made(self, transport):
         """
@@ -93,125 +90,18 @@ class PCIServerProtocol(CBusProtocol):
         """
         Handles a single CBus packet.
 
+        Additional packet and SAL types can be handled with
+        ``register_packet_handler`` and ``register_sal_handler``.
+
         """
-        # check for special commands, and handle them.
         if p is None:
             logger.debug("dce: packet == None")
             return
 
-        if isinstance(p, InvalidPacket):
-            logger.warning("dce: invalid packet: {}".format(p.exception))
-            return
-
         logger.debug('dce: %r', p)
 
-        if isinstance(p, SpecialClientPacket):
-            # do special things
-            # full reset
-            if isinstance(p, ResetPacket):
-                self.on_reset()
-                return
-
-            # smart+connect shortcut
-            if isinstance(p, SmartConnectShortcutPacket):
-                self.basic_mode = False
-                self.connect = True
-                return
-
-            logger.debug('dce: unknown SpecialClientPacket: %r', p)
-        elif isinstance(p, RecallCAL):
-            logger.debug('dce: got a cal?: %r', p)
-            return
-        elif isinstance(p, PointToMultipointPacket):
-            for s in p:
-                if isinstance(s, LightingSAL):
-                    # lighting application
-                    if isinstance(s, LightingRampSAL):
-                        self.on_lighting_group_ramp(s.group_address,
-                                                    s.duration, s.level)
-                    elif isinstance(s, LightingOnSAL):
-                        self.on_lighting_group_on(s.group_address)
-                    elif isinstance(s, LightingOffSAL):
-                        self.on_lighting_group_off(s.group_address)
-                    elif isinstance(s, LightingTerminateRampSAL):
-                        self.on_lighting_group_terminate_ramp(
-                            s.group_address)
-                    else:
-                        logger.debug(
-                            'dce: unhandled lighting SAL type: %r' % s)
-                        return
-                elif isinstance(s, ClockSAL):
-                    if isinstance(s, ClockUpdateSAL):
-                        self.on_clock_update(s.val)
-                    elif isinstance(s, ClockRequestSAL):
-                        self.on_clock_request()
-                    else:
-                        logger.debug(
-                            'dce: unhandled clock SAL type: %r' % s)
-                elif isinstance(s, StatusRequestSAL):
-                    if (s.child_application == Application.MASTER_APPLICATION
-                            and not s.level_request):
-                        # s4.2.9.2 note: find presence of units
-                        self.on_master_application_status(s.group_address)
-                    else:
-                        logger.debug(
-                            'dce: unhandled status request SAL: %r', s)
-                        return
-                else:
-                    logger.debug('dce: unhandled SAL type: %r' % s)
-                    return
-        elif isinstance(p, DeviceManagementPacket):
-            # TODO: send proper confirmation, from p55 of serial interface
-            #       guide
-            if p.parameter == 0x21:
-                # application address 1
-                # TODO: implement
-                pass
-            elif p.parameter == 0x22:
-                # application address 2
-                # TODO: implement
-                pass
-            elif p.parameter == 0x3E:
-                # interface options 2
-                # TODO: implement
-                pass
-            elif p.parameter == 0x42:
-                # interface options 3
-                # TODO: implement
-                pass
-            elif p.parameter in (0x30, 0x41):
-                # interface options 1 / power up options 1
-                self.connect = self.checksum = False
-                self.monitor = self.idmon = False
-                self.basic_mode = True
-
-                if p.value & 0x01:
-                    self.connect = True
-                if p.value & 0x02:
-                    # reserved, ignored.
-                    pass
-                if p.value & 0x04:
-                    # TODO: xon/xoff handshaking.  not supported.
-                    pass
-                if p.value & 0x08:
-                    # srchk (checksum checking)
-                    self.checksum = True
-                if p.value & 0x10:
-                    # smart mode
-                    self.basic_mode = False
-                if p.value & 0x20:
-                    # monitor mode
-                    self.monitor = True
-                if p.value & 0x40:
-                    # idmon
-                    self.idmon = True
-            else:
-                logger.debug(
-                    'dce: unhandled DeviceManagementPacket (%r = %r)' %
-                    (p.parameter, p.value))
-                return
-        else:
-            logger.debug('dce: unhandled packet type: %r', p)
+        # Packet handlers return True if the packet should be confirmed.
+        if not self.dispatch_packet(p):
             return
 
         # TODO: handle parameters
@@ -219,6 +109,130 @@ class PCIServerProtocol(CBusProtocol):
         if p.confirmation:
             self.send_confirmation(p.confirmation, True)
 
+    # packet and SAL handlers, these dispatch to the event handlers below.
+    def _register_handlers(self) -> None:
+        rp = self.register_packet_handler
+        rp(InvalidPacket, self._handle_invalid)
+        rp(ResetPacket, self._handle_reset)
+        rp(SmartConnectShortcutPacket, self._handle_smart_connect_shortcut)
+        rp(PointToMultipointPacket, self.dispatch_sals)
+        rp(DeviceManagementPacket, self._handle_device_management)
+
+        rs = self.register_sal_handler
+        rs(LightingRampSAL, self._handle_lighting_ramp)
+        rs(LightingOnSAL, self._handle_lighting_on)
+        rs(LightingOffSAL, self._handle_lighting_off)
+        rs(LightingTerminateRampSAL, self._handle_lighting_terminate_ramp)
+        rs(ClockUpdateSAL, self._handle_clock_update)
+        rs(ClockRequestSAL, self._handle_clock_request)
+        rs(StatusRequestSAL, self._handle_status_request)
+
+    def _handle_invalid(self, p: InvalidPacket) -> bool:
+        logger.warning("dce: invalid packet: {}".format(p.exception))
+        return False
+
+    def _handle_reset(self, p: ResetPacket) -> bool:
+        # full reset
+        self.on_reset()
+        return False
+
+    def _handle_smart_connect_shortcut(
+            self, p: SmartConnectShortcutPacket) -> bool:
+        self.basic_mode = False
+        self.connect = True
+        return False
+
+    def _handle_device_management(self, p: DeviceManagementPacket) -> bool:
+        # TODO: send proper confirmation, from p55 of serial interface
+        #       guide
+        if p.parameter == 0x21:
+            # application address 1
+            # TODO: implement
+            pass
+        elif p.parameter == 0x22:
+            # application address 2
+            # TODO: implement
+            pass
+        elif p.parameter == 0x3E:
+            # interface options 2
+            # TODO: implement
+            pass
+        elif p.parameter == 0x42:
+            # interface options 3
+            # TODO: implement
+            pass
+        elif p.parameter in (0x30, 0x41):
+            # interface options 1 / power up options 1
+            self.connect = self.checksum = False
+            self.monitor = self.idmon = False
+            self.basic_mode = True
+
+            if p.value & 0x01:
+                self.connect = True
+            if p.value & 0x02:
+                # reserved, ignored.
+                pass
+            if p.value & 0x04:
+                # TODO: xon/xoff handshaking.  not supported.
+                pass
+            if p.value & 0x08:
+                # srchk (checksum checking)
+                self.checksum = True
+            if p.value & 0x10:
+                # smart mode
+                self.basic_mode = False
+            if p.value & 0x20:
+                # monitor mode
+                self.monitor = True
+            if p.value & 0x40:
+                # idmon
+                self.idmon = True
+        else:
+            logger.debug(
+                'dce: unhandled DeviceManagementPacket (%r = %r)' %
+                (p.parameter, p.value))
+            return False
+
+        return True
+
+    def _handle_lighting_ramp(
+            self, p: PointToMultipointPacket, s: LightingRampSAL) -> None:
+        self.on_lighting_group_ramp(
+            s.group_address, s.duration, s.level, s.application)
+
+    def _handle_lighting_on(
+            self, p: PointToMultipointPacket, s: LightingOnSAL) -> None:
+        self.on_lighting_group_on(s.group_address, s.application)
+
+    def _handle_lighting_off(
+            self, p: PointToMultipointPacket, s: LightingOffSAL) -> None:
+        self.on_lighting_group_off(s.group_address, s.application)
+
+    def _handle_lighting_terminate_ramp(
+            self, p: PointToMultipointPacket,
+            s: LightingTerminateRampSAL) -> None:
+        self.on_lighting_group_terminate_ramp(
+            s.group_address, s.application)
+
+    def _handle_clock_update(
+            self, p: PointToMultipointPacket, s: ClockUpdateSAL) -> None:
+        self.on_clock_update(s.val)
+
+    def _handle_clock_request(
+            self, p: PointToMultipointPacket, s: ClockRequestSAL) -> None:
+        self.on_clock_request()
+
+    def _handle_status_request(
+            self, p: PointToMultipointPacket, s: StatusRequestSAL) -> bool:
+        if (s.child_application == Application.MASTER_APPLICATION
+                and not s.level_request):
+            # s4.2.9.2 note: find presence of units
+            self.on_master_application_status(s.group_address)
+            return True
+
+        logger.debug('dce: unhandled status request SAL: %r', s)
+        return False
+
     # event handlers
 
     def on_reset(self):
@@ -233,7 +247,8 @@ class PCIServerProtocol(CBusProtocol):
         self.idmon = self.connect = self.checksum = self.monitor = False
         self.application_addr1 = self.application_addr2 = 0xFF
 
-    def on_lighting_group_ramp(self, group_addr, duration, level):
+    def on_lighting_group_ramp(self, group_addr, duration, level,
+                               application=Application.LIGHTING):
         """
         Event called when a lighting application ramp (fade) request is
         recieved.
@@ -246,36 +261,51 @@ class PCIServerProtocol(CBusProtocol):
 
         :param level: Target brightness of the ramp (0.0 - 1.0).
         :type level: float
+
+        :param application: Lighting application of the group address.
+        :type application: int
         """
         logger.debug(
             "recv: lighting ramp: %d, duration %d seconds to level %.2f%%" %
             (group_addr, duration, level * 100))
 
-    def on_lighting_group_on(self, group_addr):
+    def on_lighting_group_on(self, group_addr,
+                             application=Application.LIGHTING):
         """
         Event called when a lighting application "on" request is recieved.
 
         :param group_addr: Group address being turned on.
         :type group_addr: int
+
+        :param application: Lighting application of the group address.
+        :type application: int
         """
         logger.debug("recv: lighting on: %d" % group_addr)
 
-    def on_lighting_group_off(self, group_addr):
+    def on_lighting_group_off(self, group_addr,
+                              application=Application.LIGHTING):
         """
         Event called when a lighting application "off" request is recieved.
 
         :param group_addr: Group address being turned off.
         :type group_addr: int
+
+        :param application: Lighting application of the group address.
+        :type application: int
         """
         logger.debug("recv: lighting off: %d" % group_addr)
 
-    def on_lighting_group_terminate_ramp(self, group_addr):
+    def on_lighting_group_terminate_ramp(self, group_addr,
+                                         application=Application.LIGHTING):
         """
         Event called when a lighting application "terminate ramp" request is
         recieved.
 
         :param group_addr: Group address ramp being terminated.
         :type group_addr: int
+
+        :param application: Lighting application of the group address.
+        :type application: int
         """
         logger.debug("recv: lighting terminate ramp: %d" % group_addr)
 
@@ -381,7 +411,8 @@ class PCIServerProtocol(CBusProtocol):
 
         self._send(ConfirmationPacket(code, ok))
 
-    def lighting_group_on(self, source_addr, group_addr):
+    def lighting_group_on(self, source_addr, group_addr,
+                          application=Application.LIGHTING):
         """
         Turns on the lights for the given group_addr.
 
@@ -391,6 +422,9 @@ class PCIServerProtocol(CBusProtocol):
         :param group_addr: Group address to turn the lights on for.
         :type group_addr: int
 
+        :param application: Lighting application of the group address.
+        :type application: int
+
         :returns: Single-byte string with code for the confirmation event.
         :rtype: string
 
@@ -398,11 +432,12 @@ class PCIServerProtocol(CBusProtocol):
 
         p = PointToMultipointPacket(
             checksum=self.checksum,
-            sals=LightingOnSAL(group_addr))
+            sals=LightingOnSAL(group_addr, application))
         p.source_address = source_addr
         return self._send(p)
 
-    def lighting_group_off(self, source_addr, group_addr):
+    def lighting_group_off(self, source_addr, group_addr,
+                           application=Application.LIGHTING):
         """
         Turns off the lights for the given group_addr.
 
@@ -412,18 +447,22 @@ class PCIServerProtocol(CBusProtocol):
         :param group_addr: Group address to turn the lights on for.
         :type group_addr: int
 
+        :param application: Lighting application of the group address.
+        :type application: int
+
         :returns: Single-byte string with code for the confirmation event.
         :rtype: string
 
         """
         p = PointToMultipointPacket(
             checksum=self.checksum,
-            sals=LightingOffSAL(group_addr))
+            sals=LightingOffSAL(group_addr, application))
         p.source_address = source_addr
         return self._send(p)
 
     def lighting_group_ramp(
-            self, source_addr, group_addr, duration, level=1.0):
+            self, source_addr, group_addr, duration, level=1.0,
+            application=Application.LIGHTING):
         """
         Ramps (fades) a group address to a specified lighting level.
 
@@ -446,17 +485,21 @@ class PCIServerProtocol(CBusProtocol):
                       to set.
         :type level: float
 
+        :param application: Lighting application of the group address.
+        :type application: int
+
         :returns: Single-byte string with code for the confirmation event.
         :rtype: string
 
         """
         p = PointToMultipointPacket(
             checksum=self.checksum,
-            sals=LightingRampSAL(group_addr, duration, level))
+            sals=LightingRampSAL(group_addr, duration, level, application))
         p.source_address = source_addr
         return self._send(p)
 
-    def lighting_group_terminate_ramp(self, source_addr, group_addr):
+    def lighting_group_terminate_ramp(self, source_addr, group_addr,
+                                      application=Application.LIGHTING):
         """
         Stops ramping a group address at the current point.
 
@@ -466,12 +509,15 @@ class PCIServerProtocol(CBusProtocol):
         :param group_addr: Group address to stop ramping of.
         :type group_addr: int
 
+        :param application: Lighting application of the group address.
+        :type application: int
+
         :returns: Single-byte string with code for the confirmation event.
         :rtype: string
         """
         p = PointToMultipointPacket(
             checksum=self.checksum,
-            sals=LightingTerminateRampSAL(group_addr))
+            sals=LightingTerminateRampSAL(group_addr, application))
         p.source_address = source_addr
         return self._send(p)
 
@@ -24,6 +24,7 @@ from cbus.common import (
 from cbus.protocol.application import get_application
 from cbus.protocol.application.sal import SAL
 from cbus.protocol.base_packet import BasePacket
+from cbus.protocol.freezable import FrozenInstanceError
 
 
 class PointToMultipointPacket(BasePacket, Sequence[SAL]):
@@ -32,6 +33,7 @@ class PointToMultipointPacket(BasePacket, Sequence[SAL]):
 
     Ref: Serial Interface User Guide, s4.2.9.2
     """
+    __slots__ = ('application', '_sals')
 
     def __init__(
             self, checksum: bool = True,
@@ -61,6 +63,9 @@ class PointToMultipointPacket(BasePacket, Sequence[SAL]):
                     self._sals))
 
     def append_sal(self, sal: SAL) -> None:
+        if self.frozen:
+            raise FrozenInstanceError('cannot add SALs to a frozen packet')
+
         sal_application = int(sal.application)
         if self.application is None:
             self.application = sal_application
@@ -71,6 +76,12 @@ class PointToMultipointPacket(BasePacket, Sequence[SAL]):
 
         self._sals.append(sal)
 
+    def freeze(self) -> None:
+        self._sals = tuple(self._sals)
+        for sal in self._sals:
+            sal.freeze()
+        super().freeze()
+
     def clear_sal(self) -> None:
         """Removes all SALs from this packet."""
         self._sals = []
@@ -107,7 +118,7 @@ class PointToMultipointPacket(BasePacket, Sequence[SAL]):
         # find an application handler
         handler = get_application(application)
         data = data[2:]
-        sals = handler.decode_sals(data)
+        sals = handler.decode_sals(data, application)
 
         return cls(
             checksum=checksum, priority_class=priority_class,
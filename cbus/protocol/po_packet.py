@@ -22,6 +22,7 @@ __all__ = ['PowerOnPacket']
 
 
 class PowerOnPacket(SpecialServerPacket):
+    __slots__ = ()
 
     def __init__(self):
         super(PowerOnPacket, self).__init__()
@@ -32,6 +32,7 @@ from cbus.protocol.cal.reply import ReplyCAL
 
 
 class PointToPointPacket(BasePacket, Sequence[AnyCAL]):
+    __slots__ = ('hops', 'pm_bridged', 'unit_address', '_cals')
 
     def __init__(
             self, checksum: bool = True,
@@ -60,6 +61,13 @@ class PointToPointPacket(BasePacket, Sequence[AnyCAL]):
         self.unit_address = unit_address
         self._cals = list(cals) or []
 
+    def freeze(self) -> None:
+        self.hops = tuple(self.hops)
+        self._cals = tuple(self._cals)
+        for cal in self._cals:
+            cal.freeze()
+        super().freeze()
+
     def __len__(self) -> int:
         """Returns the number of CALs associated with this packet."""
         return len(self._cals)
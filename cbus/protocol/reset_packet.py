@@ -20,6 +20,7 @@ from cbus.protocol.base_packet import SpecialClientPacket
 
 
 class ResetPacket(SpecialClientPacket):
+    __slots__ = ()
 
     def __init__(self):
         super(ResetPacket, self).__init__()
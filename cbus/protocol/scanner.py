@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# cbus/protocol/scanner.py - Network scanner using IDENTIFY
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+from __future__ import annotations
+
+from asyncio import (
+    Semaphore, TimeoutError, as_completed, get_event_loop, sleep)
+from dataclasses import dataclass, field
+import logging
+from time import monotonic
+from typing import (
+    AsyncIterator, Dict, Iterable, Optional, Sequence, Text, Tuple, Union)
+
+from cbus.common import IdentifyAttribute
+from cbus.protocol.pciprotocol import PCIProtocol
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_ATTRIBUTES',
+    'NetworkScanner',
+    'UnitInventory',
+]
+
+
+DEFAULT_ATTRIBUTES = (
+    IdentifyAttribute.TYPE,
+    IdentifyAttribute.FIRMWARE_VER,
+    IdentifyAttribute.GAV_CURRENT,
+)
+
+
+def _text(data: Optional[bytes]) -> Optional[Text]:
+    if data is None:
+        return None
+    return data.decode('ascii', 'replace').strip()
+
+
+@dataclass
+class UnitInventory:
+    """
+    Information about a unit found by ``NetworkScanner``.
+
+    ``attributes`` holds the raw reply to each ``IdentifyAttribute`` the unit
+    answered.
+    """
+    unit_address: int
+    attributes: Dict[IdentifyAttribute, bytes] = field(default_factory=dict)
+
+    @property
+    def manufacturer(self) -> Optional[Text]:
+        return _text(self.attributes.get(IdentifyAttribute.MANUFACTURER))
+
+    @property
+    def unit_type(self) -> Optional[Text]:
+        """Unit type, eg: ``RELDN12``."""
+        return _text(self.attributes.get(IdentifyAttribute.TYPE))
+
+    @property
+    def firmware_version(self) -> Optional[Text]:
+        return _text(self.attributes.get(IdentifyAttribute.FIRMWARE_VER))
+
+    @property
+    def group_addresses(self) -> Optional[Tuple[int, ...]]:
+        """Current group address variables of the unit."""
+        gav = self.attributes.get(IdentifyAttribute.GAV_CURRENT)
+        return None if gav is None else tuple(gav)
+
+
+class NetworkScanner:
+    """
+    Finds units on a C-Bus network, by sending IDENTIFY requests to each unit
+    address.
+
+    Requests to different units are pipelined, with a bounded number of
+    requests waiting for a reply at once. The first attribute is used as a
+    probe: if a unit doesn't reply to it, no other attributes are requested.
+
+    Example::
+
+        scanner = NetworkScanner(protocol)
+        async for unit in scanner.scan():
+            print(unit.unit_address, unit.unit_type, unit.firmware_version)
+    """
+
+    def __init__(
+            self, protocol: PCIProtocol,
+            attributes: Sequence[Union[int, IdentifyAttribute]] = (
+                DEFAULT_ATTRIBUTES),
+            max_outstanding: int = 4,
+            timeout: float = 2.0,
+            rate: float = 0.):
+        """
+        :param protocol: Connected protocol to send requests with.
+        :param attributes: Attributes to request from each unit.
+        :param max_outstanding: Maximum number of requests waiting for a
+                                reply at once.
+        :param timeout: Seconds to wait for a unit to reply.
+        :param rate: Maximum number of requests to send per second, or 0 for
+                     no limit.
+        """
+        if not attributes:
+            raise ValueError('at least one attribute is required')
+        if max_outstanding < 1:
+            raise ValueError('max_outstanding must be at least 1')
+        if rate < 0:
+            raise ValueError('rate must not be negative')
+
+        self._protocol = protocol
+        self.attributes = tuple(IdentifyAttribute(a) for a in attributes)
+        self.max_outstanding = max_outstanding
+        self.timeout = timeout
+        self._interval = 1. / rate if rate else 0.
+        self._next_send = 0.
+        self._semaphore = None  # type: Optional[Semaphore]
+
+    async def _request(
+            self, unit_address: int,
+            attribute: IdentifyAttribute) -> Optional[bytes]:
+        async with self._semaphore:
+            if self._interval:
+                now = monotonic()
+                delay = self._next_send - now
+                self._next_send = max(now, self._next_send) + self._interval
+                if delay > 0:
+                    await sleep(delay)
+
+            try:
+                return await self._protocol.identify_reply(
+                    unit_address, attribute, self.timeout)
+            except TimeoutError:
+                return None
+            except IOError as e:
+                if not self._protocol.connected:
+                    # Nothing else will get through either, so stop the scan.
+                    raise
+                # The PCI rejected this request: treat it like no reply, so
+                # the rest of the scan goes on.
+                logger.warning(f'Could not request {attribute.name} from '
+                               f'unit {unit_address}: {e}')
+                return None
+
+    async def scan_unit(self, unit_address: int) -> Optional[UnitInventory]:
+        """
+        Requests all attributes from a single unit.
+
+        :returns: Inventory of the unit, or None if it did not reply.
+        """
+        if self._semaphore is None:
+            self._semaphore = Semaphore(self.max_outstanding)
+
+        probe = self.attributes[0]
+        data = await self._request(unit_address, probe)
+        if data is None:
+            return None
+
+        unit = UnitInventory(unit_address, {probe: data})
+        for attribute in self.attributes[1:]:
+            data = await self._request(unit_address, attribute)
+            if data is None:
+                logger.warning(f'Unit {unit_address} did not reply to '
+                               f'{attribute.name}')
+            else:
+                unit.attributes[attribute] = data
+        return unit
+
+    async def scan(
+            self, unit_addresses: Iterable[int] = range(0x100)
+    ) -> AsyncIterator[UnitInventory]:
+        """
+        Scans the network, yielding each unit as soon as all of its
+        attributes have been requested.
+
+        Units are not necessarily yielded in address order.
+
+        :param unit_addresses: Unit addresses to scan.
+        """
+        if self._semaphore is None:
+            self._semaphore = Semaphore(self.max_outstanding)
+
+        loop = get_event_loop()
+        tasks = [loop.create_task(self.scan_unit(a)) for a in unit_addresses]
+        try:
+            for task in as_completed(tasks):
+                unit = await task
+                if unit is not None:
+                    yield unit
+        finally:
+            for task in tasks:
+                task.cancel()
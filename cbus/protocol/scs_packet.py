@@ -22,6 +22,7 @@ __all__ = ['SmartConnectShortcutPacket']
 
 
 class SmartConnectShortcutPacket(SpecialClientPacket):
+    __slots__ = ()
 
     def __init__(self):
         super(SmartConnectShortcutPacket, self).__init__()
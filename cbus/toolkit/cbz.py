@@ -22,7 +22,9 @@ from __future__ import absolute_import
 
 import dataclasses
 from datetime import datetime
-from typing import Any, BinaryIO, Sequence, Text, Type, TypeVar
+from typing import (
+    Any, BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional,
+    Sequence, Text, Tuple, Type, TypeVar)
 from uuid import UUID
 from xml.etree import ElementTree
 from zipfile import BadZipFile, ZipFile
@@ -33,15 +35,107 @@ C_co = TypeVar('C_co', covariant=True)  # pytype: disable=not-supported-yet
 T = TypeVar('T')
 
 
-def _new(typ: type) -> Any:
-    if typ == type(None):
-        return None
+def _is_sequence(typ: type) -> bool:
     # TODO: implement better
-    if repr(typ).startswith('typing.Sequence'):
-        return list()
+    return repr(typ).startswith('typing.Sequence')
+
+
+class _Field(NamedTuple):
+    name: Text
+    # Type of the value, or of each item for a Sequence.
+    item_type: type
+    is_sequence: bool
+    # Converts XML text to item_type.
+    convert: Callable[[Text], Any]
+
+
+def _fields(cls: type) -> Tuple[Tuple[_Field, ...], Dict[Text, _Field]]:
+    """
+    Returns the fields of an _Element, and a map of normalised XML names to
+    fields. These are computed once per class.
+    """
+    fields = _FIELDS.get(cls)
+    if fields is not None:
+        return fields
+
+    all_fields = []
+    by_name = {}
+    for field in dataclasses.fields(cls):
+        is_sequence = _is_sequence(field.type)
+        # HACK: get subscripted type from Sequence[]
+        item_type = field.type.__args__[0] if is_sequence else field.type
+        convert = (datetime.fromisoformat if item_type == datetime
+                   else item_type)
+        f = _Field(field.name, item_type, is_sequence, convert)
+        all_fields.append(f)
+        # The first field with a name wins.
+        by_name.setdefault(cls._normalise_name(field.name), f)
+
+    fields = _FIELDS[cls] = (tuple(all_fields), by_name)
+    return fields
+
+
+_FIELDS = {}  # type: Dict[type, Tuple[Tuple[_Field, ...], Dict[Text, _Field]]]
+
+
+# Subtrees of elements to read, as a trie of normalised field names. None
+# reads everything below.
+_Include = Optional[Dict[Text, Any]]
+
+
+def _compile_paths(paths: Optional[Iterable[Text]]) -> _Include:
+    """
+    Compiles paths of fields to read, like
+    ``project/networks/*/applications/*/groups``.
+
+    ``*`` segments (for each item of a sequence) are optional, and ignored.
+    """
+    if paths is None:
+        return None
 
-    # default to None
-    return None
+    trie = {}  # type: Dict[Text, Any]
+    for path in paths:
+        node = trie
+        for name in path.split('/'):
+            if name in ('', '*'):
+                continue
+            node = node.setdefault(_Element._normalise_name(name), {})
+        # Mark the end of a path, which reads everything below.
+        node[''] = True
+
+    def complete(node: Dict[Text, Any]) -> _Include:
+        if '' in node:
+            return None
+        return {k: complete(v) for k, v in node.items()}
+
+    return complete(trie)
+
+
+def _child_include(include: _Include, field: _Field,
+                   cls: type) -> Tuple[bool, _Include]:
+    """
+    Returns whether an element field is included by the filter, and the
+    filter for its children.
+    """
+    if include is None:
+        return True, None
+    name = cls._normalise_name(field.name)
+    if name not in include:
+        return False, None
+    return True, include[name]
+
+
+class _Frame(NamedTuple):
+    """An element on the current path of a streaming parse."""
+    element: ElementTree.Element
+    # Field in the parent which this element is read into, or None if it is
+    # not read.
+    field: Optional[_Field]
+    # Class and parameters of an _Element, or None for elements holding a
+    # text value.
+    cls: Optional[type] = None
+    params: Optional[Dict[Text, Any]] = None
+    include: _Include = None
 
 
 @dataclasses.dataclass
@@ -51,66 +145,144 @@ class _Element:
         return name.lower().replace('_', '').rstrip('s')
 
     @classmethod
-    def from_element(cls: Type[BaseCBZElementType],
-                     element: ElementTree.Element) -> BaseCBZElementType:
-        params = {}
-
-        fields = dataclasses.fields(cls)
-        field_names = [cls._normalise_name(n.name) for n in fields]
+    def _new_params(cls, element: ElementTree.Element) -> Dict[Text, Any]:
+        """Initialises parameters, and reads all attributes on the element."""
+        fields, by_name = _fields(cls)
 
         # Initialise Optional and Lists
-        for field in fields:
-            params[field.name] = _new(field.type)  # pytype: disable=invalid-typevar
+        params = {f.name: [] if f.is_sequence else None for f in fields}
 
-        # Read all attributes on the class
         for key, value in element.items():
-            key = cls._normalise_name(key)
+            field = by_name.get(cls._normalise_name(key))
+            if field is not None:
+                params[field.name] = field.convert(value)
 
-            try:
-                findex = field_names.index(key)
-            except ValueError:
-                # no match
-                continue
+        return params
+
+    @staticmethod
+    def _set_param(params: Dict[Text, Any], field: _Field, value: Any):
+        if field.is_sequence:
+            params[field.name].append(value)
+        else:
+            params[field.name] = value
 
-            field = fields[findex]
-            params[field.name] = field.type(value)
+    @classmethod
+    def from_element(
+            cls: Type[BaseCBZElementType], element: ElementTree.Element,
+            include: Optional[Iterable[Text]] = None) -> BaseCBZElementType:
+        """
+        Reads an element.
 
-        # Read all children
-        for i in range(len(element)):
-            # Use __getitem__ because we want to only go one level,
-            # and exclude self.
-            child = element[i]
-            key = cls._normalise_name(child.tag)
+        :param include: Paths of element fields to read, relative to this
+            element, eg: ``project/networks/*/applications/*/groups``.
+            Element fields which are not on a path are left empty (None or
+            an empty list). Text fields are always read. If None (default),
+            everything is read.
+        """
+        return cls._from_element(element, _compile_paths(include))
 
-            try:
-                findex = field_names.index(key)
-            except ValueError:
+    @classmethod
+    def _from_element(cls: Type[BaseCBZElementType],
+                      element: ElementTree.Element,
+                      include: _Include) -> BaseCBZElementType:
+        params = cls._new_params(element)
+        _, by_name = _fields(cls)
+
+        # Read all children. Iterating only goes one level, and excludes
+        # self.
+        for child in element:
+            field = by_name.get(cls._normalise_name(child.tag))
+            if field is None:
                 # no match
                 continue
 
-            field = fields[findex]
-            # HACK: get subscripted type from Sequence[]
-            if isinstance(params[field.name], list):
-                child_type = field.type.__args__[0]
-            else:
-                child_type = field.type
-
-            if issubclass(child_type, _Element):
+            if issubclass(field.item_type, _Element):
+                included, child_include = _child_include(include, field, cls)
+                if not included:
+                    continue
                 # Delegate parsing for child
-                value = child_type.from_element(child)
-            elif child_type == datetime:
-                value = datetime.fromisoformat(child.text)
+                value = field.item_type._from_element(child, child_include)
             else:
-                value = child_type(child.text)
+                value = field.convert(child.text)
 
-            if isinstance(params[field.name], list):
-                params[field.name].append(value)
-            else:
-                params[field.name] = value
+            cls._set_param(params, field, value)
 
         # We have all we need...
         return cls(**params)
 
+    @classmethod
+    def from_xml(
+            cls: Type[BaseCBZElementType], source: BinaryIO,
+            include: Optional[Iterable[Text]] = None) -> BaseCBZElementType:
+        """
+        Reads an element from an XML file.
+
+        This is equivalent to ``from_element`` on the root of the document,
+        but parses incrementally, dropping each XML element once it has been
+        read. This keeps only the current path through the document in
+        memory, rather than the whole tree.
+
+        :param include: Paths of element fields to read, as for
+            ``from_element``. Subtrees which are not included are parsed,
+            but no objects are created for them.
+        """
+        stack = []  # type: List[_Frame]
+        result = None
+        include = _compile_paths(include)
+
+        for event, element in ElementTree.iterparse(
+                source, events=('start', 'end')):
+            if event == 'start':
+                if not stack:
+                    stack.append(_Frame(
+                        element, None, cls, cls._new_params(element),
+                        include))
+                    continue
+
+                parent = stack[-1]
+                field = None
+                if parent.cls is not None:
+                    _, by_name = _fields(parent.cls)
+                    field = by_name.get(
+                        parent.cls._normalise_name(element.tag))
+
+                if field is not None and issubclass(
+                        field.item_type, _Element):
+                    included, child_include = _child_include(
+                        parent.include, field, parent.cls)
+                    if included:
+                        stack.append(_Frame(
+                            element, field, field.item_type,
+                            field.item_type._new_params(element),
+                            child_include))
+                    else:
+                        stack.append(_Frame(element, None))
+                else:
+                    stack.append(_Frame(element, field))
+                continue
+
+            # end
+            frame = stack.pop()
+            value = None
+            if frame.cls is not None:
+                value = frame.cls(**frame.params)
+            elif frame.field is not None:
+                value = frame.field.convert(element.text)
+
+            element.clear()
+            if not stack:
+                result = value
+                break
+
+            parent = stack[-1]
+            # Children are dropped as soon as they are read, so this is the
+            # parent's only child.
+            parent.element.remove(element)
+            if frame.field is not None and parent.params is not None:
+                cls._set_param(parent.params, frame.field, value)
+
+        return result
+
 
 @dataclasses.dataclass
 class PP(_Element):
@@ -202,15 +374,98 @@ class Installation(BaseCBZElement):
     project: Project
 
 
+def unit_group_addresses(unit: Unit) -> List[int]:
+    """
+    Returns the group address of each channel of a unit, from its
+    ``GroupAddress`` parameter. Unused channels are 0xff.
+    """
+    channels = []
+    for parameter in unit.pp:
+        if parameter.name == 'GroupAddress':
+            channels += [int(c[2:], 16) for c in parameter.value.split(' ')]
+    return channels
+
+
+def unit_applications(unit: Unit) -> List[int]:
+    """
+    Returns the applications of a unit, from its ``Application`` parameter.
+    Unused entries (0xff) are skipped, and each application is only returned
+    once.
+    """
+    applications = []
+    for parameter in unit.pp:
+        if parameter.name == 'Application':
+            applications += [
+                int(a[2:], 16) for a in parameter.value.split(' ')]
+    return list(dict.fromkeys(a for a in applications if a != 0xff))
+
+
+class ProjectIndex:
+    """
+    Indexes of the networks, applications, groups and units in a project.
+
+    Networks are keyed by address, and everything else by (network address,
+    application address, group address) or (network address, unit address).
+    """
+
+    def __init__(self, installation: Installation):
+        self.networks = {}  # type: Dict[int, Network]
+        self.applications = {}  # type: Dict[Tuple[int, int], Application]
+        self.groups = {}  # type: Dict[Tuple[int, int, int], Group]
+        self.units = {}  # type: Dict[Tuple[int, int], Unit]
+        # (network, application, group address) -> units with a channel on
+        # that group.
+        self.units_by_group = {
+        }  # type: Dict[Tuple[int, int, int], List[Unit]]
+
+        project = installation.project
+        for network in (project.network if project else ()):
+            n = network.address
+            self.networks[n] = network
+
+            for application in network.applications:
+                a = application.address
+                self.applications[n, a] = application
+                for group in application.groups:
+                    self.groups[n, a, group.address] = group
+
+            for unit in network.units:
+                self.units[n, unit.address] = unit
+                # A unit may use the same group on several channels.
+                groups = [ga for ga in dict.fromkeys(
+                    unit_group_addresses(unit)) if ga != 0xff]
+                for a in unit_applications(unit):
+                    for ga in groups:
+                        self.units_by_group.setdefault(
+                            (n, a, ga), []).append(unit)
+
+    def group_name(self, network: int, application: int,
+                   group: int) -> Optional[Text]:
+        """Returns the tag name of a group, or None if it is unknown."""
+        g = self.groups.get((network, application, group))
+        return None if g is None else g.tag_name
+
+    def unit_name(self, network: int, unit: int) -> Optional[Text]:
+        """Returns the tag name of a unit, or None if it is unknown."""
+        u = self.units.get((network, unit))
+        return None if u is None else u.tag_name
+
+
 class CBZException(Exception):
     pass
 
 
 class CBZ:
 
-    def __init__(self, fh: BinaryIO):
+    def __init__(self, fh: BinaryIO,
+                 include: Optional[Iterable[Text]] = None):
         """
         Opens the file as a CBZ.
+
+        :param include: Paths of elements to read from the ``Installation``,
+            eg: ``project/networks/*/applications/*/groups``. Other elements
+            are skipped, which saves memory and time for large projects. If
+            None (default), everything is read.
         """
         xml_fh = None
         zip_h = None
@@ -219,6 +474,7 @@ class CBZ:
             zip_h = ZipFile(fh, 'r')
         except BadZipFile:
             # Try to load as XML instead.
+            fh.seek(0)
             xml_fh = fh
 
         if zip_h:
@@ -238,6 +494,13 @@ class CBZ:
             xml_fh = zip_h.open(xml_filename, 'r')
 
         # now open the inner file and objectify.
-        self._tree = ElementTree.parse(xml_fh).getroot()
-        self.installation = Installation.from_element(
-            self._tree)  # type: Installation
+        self.installation = Installation.from_xml(
+            xml_fh, include)  # type: Installation
+        self._index = None  # type: Optional[ProjectIndex]
+
+    @property
+    def index(self) -> ProjectIndex:
+        """Indexes of the project, built on first use."""
+        if self._index is None:
+            self._index = ProjectIndex(self.installation)
+        return self._index
@@ -22,47 +22,28 @@ along with this library.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
 import json
+import os
+import os.path
 import sys
+from typing import Any, Dict, Iterable, List, Text, Tuple
 
-from cbus.toolkit.cbz import CBZ
+from cbus.toolkit.cbz import CBZ, unit_group_addresses
 
+# Parts of the project which are dumped.
+DUMP_PATHS = (
+    'project/networks/*/applications/*/groups',
+    'project/networks/*/units',
+)
 
-def main():
-    parser = ArgumentParser()
-    parser.add_argument(
-        '-o', '--output', metavar='FILE',
-        help='write output to FILE')
-    parser.add_argument(
-        'input', nargs=1, metavar='FILE',
-        help='read Toolkit backup from FILE')
-    parser.add_argument(
-        '-p', '--pretty',
-        type=int, required=False, metavar='SPACES',
-        help='pretty-prints the output with the specified number of spaces '
-             'between indent levels'
-    )
-    options = parser.parse_args()
-
-    pretty = None
-    if options.pretty:
-        try:
-            pretty = int(options.pretty)
-        except ValueError:
-            parser.error('Pretty-printing spaces value is not a number.')
-            return
-
-        if pretty < 0:
-            parser.error('Pretty-printing spaces value must not be negative.')
-            return
 
-    cbz = CBZ(options.input[0])
-    if options.output is None:
-        of = sys.stdout
-    else:
-        of = open(options.output, 'w')
-
-    # read in the labels we need into a structure.
+def dump_labels(cbz: CBZ) -> Dict[int, Dict[Text, Any]]:
+    """
+    Reads the labels of each network in a project into a structure which
+    can be serialised as JSON.
+    """
     o = {}
 
     # iterate through networks
@@ -89,16 +70,6 @@ def main():
             no['applications'][application.address] = ao
 
         for unit in network.units:
-            # find the channel configuration
-            channels = []
-            for parameter in unit.pp:
-                if parameter.name == 'GroupAddress':
-                    channels += [int(c[2:], 16) for c in
-                                 parameter.value.split(' ')]
-
-                    # print channels
-                    # print(parameter.attrib['Name'], '=',
-                    #       parameter.attrib['Value'])
             no['units'][unit.address] = {
                 'name': unit.tag_name,
                 'address': unit.address,
@@ -106,15 +77,144 @@ def main():
                 'unitname': unit.unit_name,
                 'serial': unit.serial_number,
                 'catalog': unit.catalog_number,
-                'groups': channels,
+                'groups': unit_group_addresses(unit),
             }
 
         o[network.address] = no
 
-    # dump structure as json.
-    json.dump(o, of, indent=pretty)
-    of.flush()
-    of.close()
+    return o
+
+
+def dump_file(path: Text) -> Dict[Text, Any]:
+    """
+    Dumps the labels in a project file, for newline-delimited JSON output.
+
+    :returns: Dict with the ``file`` name, and either the ``networks`` in
+              it, or an ``error`` message.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            networks = dump_labels(CBZ(fh, include=DUMP_PATHS))
+    except Exception as e:
+        return {'file': path, 'error': f'{type(e).__name__}: {e}'}
+    return {'file': path, 'networks': networks}
+
+
+def find_inputs(inputs: Iterable[Text]) -> Tuple[List[Text], bool]:
+    """
+    Expands directories (searched recursively for ``*.cbz``) and glob
+    patterns to a list of files.
+
+    :returns: The files, and whether any input named more than one file.
+    """
+    files = []
+    expanded = False
+    for i in inputs:
+        if os.path.isdir(i):
+            found = sorted(glob.glob(
+                os.path.join(glob.escape(i), '**', '*.cbz'), recursive=True))
+        elif glob.has_magic(i):
+            found = sorted(glob.glob(i, recursive=True))
+        else:
+            files.append(i)
+            continue
+
+        expanded = True
+        files.extend(found)
+    return files, expanded
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument(
+        '-o', '--output', metavar='FILE',
+        help='write output to FILE')
+    parser.add_argument(
+        'input', nargs='+', metavar='FILE',
+        help='read Toolkit backup from FILE. If more than one file is given, '
+             'or FILE is a directory or glob pattern, each project is written '
+             'as a line of JSON.')
+    parser.add_argument(
+        '-p', '--pretty',
+        type=int, required=False, metavar='SPACES',
+        help='pretty-prints the output with the specified number of spaces '
+             'between indent levels'
+    )
+    parser.add_argument(
+        '-n', '--ndjson',
+        action='store_true',
+        help='write newline-delimited JSON, even for a single file')
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int, default=os.cpu_count() or 1, metavar='N',
+        help='number of projects to read in parallel [default: %(default)s]')
+    options = parser.parse_args()
+
+    pretty = None
+    if options.pretty:
+        try:
+            pretty = int(options.pretty)
+        except ValueError:
+            parser.error('Pretty-printing spaces value is not a number.')
+            return
+
+        if pretty < 0:
+            parser.error('Pretty-printing spaces value must not be negative.')
+            return
+
+    if options.jobs < 1:
+        parser.error('Number of jobs must be at least 1.')
+        return
+
+    files, expanded = find_inputs(options.input)
+    if not files:
+        parser.error('No input files found in: ' + ', '.join(options.input))
+        return
+
+    ndjson = options.ndjson or expanded or len(files) != 1
+    if ndjson and pretty is not None:
+        parser.error('Pretty-printing is not available for multiple inputs.')
+        return
+
+    if options.output is None:
+        of = sys.stdout
+    else:
+        of = open(options.output, 'w')
+
+    if not ndjson:
+        with open(files[0], 'rb') as fh:
+            o = dump_labels(CBZ(fh, include=DUMP_PATHS))
+
+        # dump structure as json.
+        json.dump(o, of, indent=pretty)
+        of.flush()
+        of.close()
+        return
+
+    errors = 0
+
+    def write(result: Dict[Text, Any]) -> None:
+        nonlocal errors
+        if 'error' in result:
+            errors += 1
+            print(f'{result["file"]}: {result["error"]}', file=sys.stderr)
+        # Write each project as soon as it has been read.
+        of.write(json.dumps(result) + '\n')
+        of.flush()
+
+    if options.jobs == 1:
+        for path in files:
+            write(dump_file(path))
+    else:
+        with ProcessPoolExecutor(options.jobs) as executor:
+            futures = [executor.submit(dump_file, path) for path in files]
+            for future in as_completed(futures):
+                write(future.result())
+
+    if of is not sys.stdout:
+        of.close()
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# cbus/toolkit/label_cache.py - Cache of labels read from project files
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Reads group and unit labels from Toolkit project files, and caches them in a
+JSON file alongside the project.
+
+Reading a large project file takes seconds, and it rarely changes. The cache
+is used while the project file's size and modification time match. If only
+the modification time has changed, the cache is still used if the
+SHA-256 of the project file matches.
+"""
+
+from __future__ import absolute_import
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+import logging
+import os
+import os.path
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, List, Optional, Text
+
+from cbus.common import Application
+from cbus.toolkit.cbz import CBZ, Network, unit_group_addresses
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'CACHE_VERSION',
+    'LABEL_PATHS',
+    'NetworkLabels',
+    'UNIT_PATHS',
+    'default_cache_path',
+    'direct_networks',
+    'load_project_labels',
+    'read_network_labels',
+    'read_network_units',
+    'read_project_labels',
+]
+
+# Increase this whenever the cache format or its contents change.
+CACHE_VERSION = 1
+
+# Parts of a project needed for read_network_labels, for CBZ(include=...).
+LABEL_PATHS = (
+    'project/networks/*/interface',
+    'project/networks/*/applications/*/groups',
+)
+
+# Parts of a project needed for read_network_units.
+UNIT_PATHS = (
+    'project/networks/*/interface',
+    'project/networks/*/units',
+)
+
+
+@dataclass
+class NetworkLabels:
+    """Labels read from a network in a project file."""
+    # Lighting application -> group address -> name.
+    labels: Dict[int, Dict[int, Text]] = field(default_factory=dict)
+    # Unit address -> unit details, in the same format as cbz_dump_labels.
+    units: Dict[int, Dict[Text, Any]] = field(default_factory=dict)
+
+
+def direct_networks(cbz: CBZ) -> List[Network]:
+    """Returns all networks in the project which are not bridged."""
+    return [n for n in cbz.installation.project.network
+            if n.interface.interface_type != 'bridge']
+
+
+def read_network_labels(network: Network) -> Dict[int, Dict[int, Text]]:
+    """
+    Reads group address names for each lighting application in a CBZ
+    Network.
+    """
+    labels = {}  # type: Dict[int, Dict[int, Text]]
+    for application in network.applications:
+        if not (Application.LIGHTING_FIRST <= application.address <=
+                Application.LIGHTING_LAST):
+            continue
+
+        app_labels = labels[application.address] = {}
+        for group in application.groups:
+            name = group.tag_name.strip()
+
+            # Ignore default names
+            if not name or name in ('<Unused>', f'Group {group.address}'):
+                continue
+
+            app_labels[group.address] = name
+
+    if not labels:
+        logger.warning('Could not find any lighting applications in network '
+                       '%d of project file. Labels will be unavailable.',
+                       network.address)
+    return labels
+
+
+def read_network_units(network: Network) -> Dict[int, Dict[Text, Any]]:
+    """Reads the details of each unit in a CBZ Network."""
+    units = {}
+    for unit in network.units:
+        units[unit.address] = {
+            'name': unit.tag_name,
+            'address': unit.address,
+            'unittype': unit.unit_type,
+            'unitname': unit.unit_name,
+            'serial': unit.serial_number,
+            'catalog': unit.catalog_number,
+            'groups': unit_group_addresses(unit),
+        }
+    return units
+
+
+def read_project_labels(cbz: CBZ) -> Dict[int, NetworkLabels]:
+    """
+    Reads labels for each non-bridge network in a project.
+
+    :returns: Dict of network number to labels.
+    """
+    return {n.address: NetworkLabels(read_network_labels(n),
+                                     read_network_units(n))
+            for n in direct_networks(cbz)}
+
+
+def default_cache_path(project_path: Text) -> Text:
+    return project_path + '.labels.json'
+
+
+def _sha256(path: Text) -> Text:
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _int_keys(d: Dict[Text, Any]) -> Dict[int, Any]:
+    return {int(k): v for k, v in d.items()}
+
+
+def _decode_networks(networks: Dict[Text, Any]) -> Dict[int, NetworkLabels]:
+    return {
+        int(network): NetworkLabels(
+            labels={int(app): _int_keys(groups)
+                    for app, groups in n['labels'].items()},
+            units=_int_keys(n['units']))
+        for network, n in networks.items()}
+
+
+def _read_cache(cache_path: Text) -> Optional[Dict[Text, Any]]:
+    try:
+        with open(cache_path, 'r') as fh:
+            cache = json.load(fh)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning('Ignoring unreadable label cache %s: %s',
+                       cache_path, e)
+        return None
+
+    if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+        return None
+    return cache
+
+
+def _write_cache(cache_path: Text, size: int, mtime_ns: int,
+                 sha256: Text, networks: Dict[int, NetworkLabels]) -> None:
+    cache = {
+        'version': CACHE_VERSION,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'sha256': sha256,
+        'networks': {
+            network: {'labels': n.labels, 'units': n.units}
+            for network, n in networks.items()},
+    }
+
+    # Write to a temporary file first, so that other readers never see a
+    # partial cache.
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    try:
+        with NamedTemporaryFile(
+                'w', dir=directory, suffix='.tmp', delete=False) as fh:
+            try:
+                json.dump(cache, fh, separators=(',', ':'))
+            except BaseException:
+                os.unlink(fh.name)
+                raise
+        os.replace(fh.name, cache_path)
+    except OSError as e:
+        logger.warning('Could not write label cache %s: %s', cache_path, e)
+
+
+def load_project_labels(
+        project_path: Text,
+        cache_path: Optional[Text] = None,
+        use_cache: bool = True) -> Dict[int, NetworkLabels]:
+    """
+    Reads labels for each non-bridge network in a project file, using a
+    cache if it is up to date.
+
+    :param project_path: Path to a Toolkit project backup file (CBZ or XML).
+    :param cache_path: Path to the cache file. Defaults to the project path
+                       with ``.labels.json`` appended.
+    :param use_cache: If False, always read the project file, and don't
+                      write a cache.
+    :returns: Dict of network number to labels.
+    :raises OSError: If the project file could not be read.
+    """
+    if not use_cache:
+        with open(project_path, 'rb') as fh:
+            return read_project_labels(
+                CBZ(fh, include=LABEL_PATHS + UNIT_PATHS))
+
+    if cache_path is None:
+        cache_path = default_cache_path(project_path)
+
+    st = os.stat(project_path)
+    cache = _read_cache(cache_path)
+    sha256 = None
+    if cache is not None and cache.get('size') == st.st_size:
+        try:
+            if cache.get('mtime_ns') == st.st_mtime_ns:
+                return _decode_networks(cache['networks'])
+
+            # The file was touched, but may not have changed.
+            sha256 = _sha256(project_path)
+            if cache.get('sha256') == sha256:
+                networks = _decode_networks(cache['networks'])
+                _write_cache(cache_path, st.st_size, st.st_mtime_ns, sha256,
+                             networks)
+                return networks
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning('Ignoring malformed label cache %s: %r',
+                           cache_path, e)
+
+    logger.info('Reading labels from %s', project_path)
+    with open(project_path, 'rb') as fh:
+        networks = read_project_labels(
+            CBZ(fh, include=LABEL_PATHS + UNIT_PATHS))
+
+    if sha256 is None:
+        sha256 = _sha256(project_path)
+    _write_cache(cache_path, st.st_size, st.st_mtime_ns, sha256, networks)
+    return networks
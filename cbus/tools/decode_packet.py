@@ -21,8 +21,9 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 
-from argparse import ArgumentParser
-from cbus.protocol.packet import decode_packet
+from argparse import ArgumentParser, FileType
+from cbus.common import END_COMMAND, END_RESPONSE
+from cbus.protocol.packet import decode_all
 
 
 def pretty_packet(
@@ -30,19 +31,29 @@ def pretty_packet(
         checksum: bool = True,
         strict: bool = True,
         server_packet: bool = True):
-    packet, remainder = decode_packet(packet, checksum, strict, server_packet)
+    packets, remainder = decode_all(packet, checksum, strict, server_packet)
 
-    print(packet)
+    for p in packets:
+        print(p)
+
+    if remainder < len(packet):
+        print(f'Incomplete data: {packet[remainder:]!r}')
 
 
 def main():
     parser = ArgumentParser()
 
-    parser.add_argument('packet',
-                        metavar='PACKET',
-                        nargs=1,
-                        type=bytes,
-                        help='Packet to decode')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('packet',
+                       metavar='PACKET',
+                       nargs='?',
+                       type=lambda s: s.encode('ascii'),
+                       help='Packet(s) to decode')
+
+    group.add_argument('-f',
+                       '--file',
+                       type=FileType('rb'),
+                       help='Decode all packets in a captured log FILE')
 
     parser.add_argument('-C',
                         '--no-checksum',
@@ -65,8 +76,17 @@ def main():
 
     options = parser.parse_args()
 
-    pretty_packet(options.packet[0], options.checksum, options.strict,
-                  options.server)
+    if options.file:
+        data = options.file.read()
+    else:
+        # Terminate the packet if needed, as it is awkward to pass on the
+        # command line.
+        end = END_RESPONSE if options.server else END_COMMAND
+        data = options.packet
+        if not data.endswith(end):
+            data += end
+
+    pretty_packet(data, options.checksum, options.strict, options.server)
 
 
 if __name__ == '__main__':
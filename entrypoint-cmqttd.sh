@@ -19,6 +19,9 @@ CMQTTD_CLIENT_KEY_PATH="/etc/cmqttd/client.key"
 # C-Bus Toolkit project backup file
 CMQTTD_PROJECT_FILE="/etc/cmqttd/project.cbz"
 
+# Labels read from the project file, kept outside of /etc/cmqttd in case it is read-only
+CMQTTD_LABEL_CACHE="/var/cache/cmqttd/project.labels.json"
+
 # Arguments that are always required.
 CMQTTD_ARGS="--broker-address ${MQTT_SERVER:?unset} --timesync ${CBUS_TIMESYNC:-300}"
 
@@ -77,7 +80,7 @@ fi
 
 if [ -e "${CMQTTD_PROJECT_FILE}" ]; then
     echo "Using C-Bus Toolkit project backup file ${CMQTTD_PROJECT_FILE}"
-    CMQTTD_ARGS="${CMQTTD_ARGS} --project-file ${CMQTTD_PROJECT_FILE}"
+    CMQTTD_ARGS="${CMQTTD_ARGS} --project-file ${CMQTTD_PROJECT_FILE} --label-cache ${CMQTTD_LABEL_CACHE}"
 else
     echo "${CMQTTD_PROJECT_FILE} not found; using generated labels."
 fi
@@ -30,7 +30,7 @@ class InvalidLowAppIDApplication(BaseApplication):
         return frozenset([-1])
 
     @staticmethod
-    def decode_sals(data):
+    def decode_sals(data, application):
         return []
 
 
@@ -40,7 +40,7 @@ class InvalidHighAppIDApplication(BaseApplication):
         return frozenset([0x100])
 
     @staticmethod
-    def decode_sals(data):
+    def decode_sals(data, application):
         return []
 
 
@@ -50,7 +50,7 @@ class InvalidFakeLightingApplication(BaseApplication):
         return frozenset([Application.LIGHTING])
 
     @staticmethod
-    def decode_sals(data):
+    def decode_sals(data, application):
         return []
 
 
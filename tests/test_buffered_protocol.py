@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# test_buffered_protocol.py - Tests for the buffered protocol receiver
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import unittest
+
+from cbus.protocol.buffered_protocol import BufferedProtocol
+
+
+class LineProtocol(BufferedProtocol):
+    """Splits the buffer into newline-terminated frames."""
+
+    def __init__(self, size_limit=16):
+        super().__init__(size_limit=size_limit)
+        self.frames = []
+
+    def handle_data(self, buf: bytes, offset: int) -> int:
+        end = buf.find(b'\n', offset)
+        if end == -1:
+            return 0
+        self.frames.append(bytes(buf[offset:end]))
+        return end - offset + 1
+
+
+class BufferedProtocolTest(unittest.TestCase):
+
+    def test_multiple_frames(self):
+        p = LineProtocol()
+        p.data_received(b'a\nbb\nccc\n')
+        self.assertEqual([b'a', b'bb', b'ccc'], p.frames)
+
+        # Everything consumed, the buffer should be empty again.
+        self.assertEqual(0, len(p._buf))
+        self.assertEqual(0, p._buf_pos)
+
+    def test_partial_frames(self):
+        p = LineProtocol()
+        p.data_received(b'a\nb')
+        self.assertEqual([b'a'], p.frames)
+
+        p.data_received(b'b\ncc')
+        self.assertEqual([b'a', b'bb'], p.frames)
+
+        p.data_received(b'c\n')
+        self.assertEqual([b'a', b'bb', b'ccc'], p.frames)
+
+    def test_wrap(self):
+        p = LineProtocol(size_limit=8)
+        p.data_received(b'aaaa\nbb')
+        self.assertEqual([b'aaaa'], p.frames)
+
+        # This only fits if the consumed data is dropped first.
+        p.data_received(b'bbbb\n')
+        self.assertEqual([b'aaaa', b'bbbbbb'], p.frames)
+
+    def test_size_limit(self):
+        p = LineProtocol(size_limit=8)
+        with self.assertRaises(ValueError):
+            p.data_received(b'123456789')
+
+        p.data_received(b'123456')
+        with self.assertRaises(ValueError):
+            p.data_received(b'789')
+
+        # Buffer should have been dropped
+        p.data_received(b'a\n')
+        self.assertEqual([b'a'], p.frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,8 +22,8 @@ import unittest
 from cbus.common import Application, GroupState
 from cbus.protocol.cal.extended import ExtendedCAL
 from cbus.protocol.cal.report import (
-    BinaryStatusReport, LevelStatusReport, manchester_decode,
-    manchester_encode)
+    BinaryStatusReport, LevelStatusReport, MISSING_LEVEL, manchester_decode,
+    manchester_decode_levels, manchester_encode)
 
 from .utils import CBusTestCase
 
@@ -154,6 +154,42 @@ class InternalStatusTest(CBusTestCase):
             manchester_encode(0x42, b, 10)
         self.assertEqual(b, b'\x55\x55\xaa\xaa')
 
+    def test_manchester_round_trip(self):
+        encoded = set()
+        for level in range(256):
+            b = manchester_encode(level)
+            self.assertEqual(level, manchester_decode(b))
+            encoded.add(bytes(b))
+
+        # Everything else is invalid.
+        for i in range(0x10000):
+            b = i.to_bytes(2, 'little')
+            if b not in encoded:
+                self.assertIsNone(manchester_decode(b), b)
+
+    def test_manchester_decode_levels(self):
+        levels = manchester_decode_levels(b'\x55\x55\0\0\x95\x99\xaa\x12')
+        self.assertEqual('h', levels.typecode)
+        self.assertEqual([0xff, MISSING_LEVEL, 0x57, MISSING_LEVEL],
+                         levels.tolist())
+        self.assertEqual([], manchester_decode_levels(b'').tolist())
+
+        with self.assertRaises(ValueError):
+            manchester_decode_levels(b'\x55\x55\x55')
+
+    def test_level_report_codec(self):
+        levels = [0, None, 0x57, 0xff]
+        report = LevelStatusReport(levels)
+        data = report.encode()
+        self.assertEqual(b'\xaa\xaa\0\0\x95\x99\x55\x55', data)
+        self.assertEqual(report, LevelStatusReport.decode(data))
+
+    def test_binary_report_codec(self):
+        report = BinaryStatusReport.decode(b'\x1b')
+        self.assertEqual([GroupState.ERROR, GroupState.OFF,
+                          GroupState.ON, GroupState.MISSING], list(report))
+        self.assertEqual(b'\x1b', report.encode())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# test_cbz.py - Tests for the Toolkit CBZ reader
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import dataclasses
+from io import BytesIO
+import os.path
+import unittest
+from uuid import UUID
+from xml.etree import ElementTree
+from zipfile import ZipFile
+
+from cbus.toolkit.cbz import (
+    CBZ, CBZException, Group, Installation, PP, ProjectIndex, Unit, _fields,
+    unit_applications, unit_group_addresses)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def data_path(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def read_xml(name):
+    with ZipFile(data_path(name)) as z:
+        return z.read(z.namelist()[0])
+
+
+class CBZTest(unittest.TestCase):
+
+    def load(self, name) -> Installation:
+        with open(data_path(name), 'rb') as fh:
+            return CBZ(fh).installation
+
+    def test_example(self):
+        installation = self.load('example-demo.cbz')
+        networks = installation.project.network
+        self.assertEqual('EXAMPLE', installation.project.tag_name)
+        self.assertEqual([254, 253, 42], [n.network_number for n in networks])
+        self.assertEqual([9, 7, 5], [len(n.units) for n in networks])
+
+        unit = networks[0].units[0]
+        self.assertIsInstance(unit, Unit)
+        self.assertEqual(UUID('75f2e340-fe17-1026-a743-eb1d096ee5cc'),
+                         unit.oid)
+        self.assertEqual(1, unit.address)
+        self.assertEqual('PCLOCAL4', unit.unit_type)
+        self.assertEqual('4.2.00', unit.firmware_version)
+        # Read from attributes
+        self.assertEqual(PP('UnitAddress', '0x1'), unit.pp[0])
+
+    def test_home(self):
+        installation = self.load('home-demo.cbz')
+        self.assertEqual(28, installation.modified.day)
+        network = installation.project.network[0]
+        self.assertEqual('COM1', network.interface.interface_address)
+
+        lighting = [a for a in network.applications if a.address == 56][0]
+        self.assertEqual(48, len(lighting.groups))
+        self.assertEqual(Group(
+            oid=UUID('a63f1e38-8c67-429d-ac20-488a1bfcdcba'),
+            tag_name='Basement Light 1', address=208, description=None,
+            levels=[]), lighting.groups[0])
+
+    def test_xml(self):
+        # Uncompressed XML is also accepted.
+        xml = read_xml('home-demo.cbz')
+        self.assertEqual(self.load('home-demo.cbz'),
+                         CBZ(BytesIO(xml)).installation)
+
+    def test_from_element(self):
+        for name in ('example-demo.cbz', 'home-demo.cbz'):
+            xml = read_xml(name)
+            root = ElementTree.fromstring(xml)
+            self.assertEqual(Installation.from_element(root),
+                             Installation.from_xml(BytesIO(xml)), name)
+
+    def test_unknown_elements(self):
+        xml = (b'<Installation Version="1.0"><OID>'
+               b'cfa094ff-ca08-4760-bd19-08f828ab4167</OID>'
+               b'<Widget><DBVersion>9</DBVersion></Widget>'
+               b'<DBVersion>2.2</DBVersion></Installation>')
+        installation = Installation.from_xml(BytesIO(xml))
+        self.assertEqual('1.0', installation.version)
+        self.assertEqual('2.2', installation.db_version)
+        self.assertIsNone(installation.project)
+        self.assertEqual(installation, Installation.from_element(
+            ElementTree.fromstring(xml)))
+
+    def test_field_map(self):
+        fields, by_name = _fields(Unit)
+        self.assertIs(fields, _fields(Unit)[0])
+        self.assertEqual('pp', by_name['pp'].name)
+        self.assertTrue(by_name['pp'].is_sequence)
+        self.assertIs(PP, by_name['pp'].item_type)
+        self.assertEqual('unit_type', by_name['unittype'].name)
+
+    def test_include(self):
+        paths = ['project/networks/*/applications/*/groups',
+                 'Project/Network/Interface']
+        xml = read_xml('example-demo.cbz')
+        installation = Installation.from_xml(BytesIO(xml), paths)
+        self.assertEqual(installation, Installation.from_element(
+            ElementTree.fromstring(xml), paths))
+
+        full = self.load('example-demo.cbz')
+        self.assertEqual(full.modified, installation.modified)
+        self.assertIsNone(installation.installation_detail)
+
+        network = installation.project.network[0]
+        full_network = full.project.network[0]
+        self.assertEqual([], network.units)
+        self.assertEqual(full_network.interface, network.interface)
+        self.assertEqual(full_network.applications, network.applications)
+
+    def test_include_nothing(self):
+        with open(data_path('home-demo.cbz'), 'rb') as fh:
+            installation = CBZ(fh, include=[]).installation
+        self.assertEqual('2.2', installation.db_version)
+        self.assertIsNone(installation.project)
+
+    def test_index(self):
+        with open(data_path('example-demo.cbz'), 'rb') as fh:
+            cbz = CBZ(fh)
+        index = cbz.index
+        self.assertIs(index, cbz.index)
+
+        self.assertEqual([254, 253, 42], list(index.networks))
+        self.assertEqual(18, len(index.applications))
+        self.assertEqual(56, index.applications[254, 56].address)
+        self.assertEqual('Barbeque area', index.group_name(254, 56, 0x30))
+        self.assertIsNone(index.group_name(254, 56, 0x99))
+        self.assertEqual('LEFTPCI', index.unit_name(254, 1))
+        self.assertIsNone(index.unit_name(254, 99))
+
+        units = index.units_by_group[254, 56, 0x30]
+        self.assertEqual(['Barbeque area PIR', 'Pavillion key unit'],
+                         [u.tag_name for u in units])
+        for unit in units:
+            self.assertIn(0x30, unit_group_addresses(unit))
+        self.assertNotIn((254, 56, 0xff), index.units_by_group)
+
+    def test_index_applications(self):
+        installation = self.load('example-demo.cbz')
+        network = installation.project.network[0]
+        unit = dataclasses.replace(
+            network.units[1], address=99, tag_name='Other application',
+            pp=[PP('Application', '0x39 0xff'),
+                PP('GroupAddress', '0x30 0xff')])
+        network.units.append(unit)
+        index = ProjectIndex(installation)
+
+        # Units using the same group address in different applications are
+        # kept apart.
+        self.assertEqual(
+            ['Barbeque area PIR', 'Pavillion key unit'],
+            [u.tag_name for u in index.units_by_group[254, 56, 0x30]])
+        self.assertEqual([unit], index.units_by_group[254, 0x39, 0x30])
+
+        # Units with several applications are indexed under each of them.
+        unit.pp[0] = PP('Application', '0x39 0x3a')
+        index = ProjectIndex(installation)
+        self.assertEqual([unit], index.units_by_group[254, 0x39, 0x30])
+        self.assertEqual([unit], index.units_by_group[254, 0x3a, 0x30])
+
+    def test_index_empty(self):
+        index = ProjectIndex(Installation.from_xml(BytesIO(
+            b'<Installation><DBVersion>2.2</DBVersion></Installation>')))
+        self.assertEqual({}, index.networks)
+        self.assertEqual({}, index.units_by_group)
+
+    def test_unit_group_addresses(self):
+        unit = Unit(None, 'Relay', 2, None, 'RELDN4', 'RELAY', None, '4.2.00',
+                    None, [PP('GroupAddress', '0x30 0xff 0x2a 0xff'),
+                           PP('Application', '0x38 0xff')])
+        self.assertEqual([0x30, 0xff, 0x2a, 0xff],
+                         unit_group_addresses(unit))
+        self.assertEqual([0x38], unit_applications(unit))
+
+        unit.pp[1] = PP('Application', '0xff 0xff')
+        self.assertEqual([], unit_applications(unit))
+
+        # Every application is returned, once.
+        unit.pp[1] = PP('Application', '0x38 0x39 0x38')
+        self.assertEqual([0x38, 0x39], unit_applications(unit))
+
+    def test_multiple_files(self):
+        with self.assertRaises(CBZException):
+            self.load('all.cbz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,14 +17,24 @@
 
 from __future__ import absolute_import
 
+import asyncio
 from dataclasses import dataclass
 from parameterized import parameterized
 import io
+import json
 from typing import Optional, Text, cast
 import unittest
+from unittest import mock
+
+import paho.mqtt.client as mqtt
 
 from cbus.common import check_ga
 from cbus.daemon import cmqttd
+from cbus.protocol.application.lighting import (
+    LightingOffSAL, LightingOnSAL, LightingRampSAL, LightingTerminateRampSAL)
+from cbus.protocol.pm_packet import PointToMultipointPacket
+
+from .utils import async_test
 
 
 @dataclass
@@ -92,6 +102,16 @@ class CmqttdUtilityTest(unittest.TestCase):
         # Uniqueness check
         self.assertNotEqual(bin_state_topic, bin_conf_topic)
 
+    def test_topic_tables(self):
+        for ga in cmqttd.ga_range():
+            self.assertEqual(
+                f'homeassistant/light/cbus_{ga}/set', cmqttd.set_topic(ga))
+            self.assertEqual(
+                f'homeassistant/binary_sensor/cbus_{ga}/state',
+                cmqttd.bin_sensor_state_topic(ga))
+        self.assertRaises(ValueError, cmqttd.set_topic, 256)
+        self.assertRaises(ValueError, cmqttd.state_topic, -1)
+
     @parameterized.expand([
         'homeassistant/light/cbus_not-a-number',
         'homeassistant/light/cbus_9000',  # out of range
@@ -113,3 +133,371 @@ class CmqttdUtilityTest(unittest.TestCase):
         cmqttd.read_auth(cast('mqtt.Client', client), f)
         self.assertEqual('my_username', client.username)
         self.assertEqual('my_password', client.password)
+
+    @parameterized.expand([
+        ('/dev/ttyUSB0', ('/dev/ttyUSB0', None)),
+        ('/dev/ttyUSB0@254', ('/dev/ttyUSB0', 254)),
+        ('192.0.2.1:10001@0', ('192.0.2.1:10001', 0)),
+    ])
+    def test_parse_connection(self, value, expected):
+        self.assertEqual(expected, cmqttd.parse_connection(value))
+
+    @parameterized.expand([
+        '/dev/ttyUSB0@', '/dev/ttyUSB0@256', '/dev/ttyUSB0@x',
+    ])
+    def test_parse_connection_invalid(self, value):
+        self.assertRaises(ValueError, cmqttd.parse_connection, value)
+
+    def test_network_topics(self):
+        self.assertEqual('homeassistant/light/cbus_254_5/set',
+                         cmqttd.set_topic(5, 254))
+        self.assertEqual('homeassistant/binary_sensor/cbus_254_5/state',
+                         cmqttd.bin_sensor_state_topic(5, 254))
+        self.assertEqual('homeassistant/light/cbus_app39_5/set',
+                         cmqttd.set_topic(5, application=0x39))
+        self.assertEqual('homeassistant/light/cbus_254_app39_5/state',
+                         cmqttd.state_topic(5, 254, 0x39))
+        # Topics for the main lighting application on the default network are
+        # unchanged.
+        self.assertEqual('homeassistant/light/cbus_5/state',
+                         cmqttd.state_topic(5))
+
+
+class MqttClientPublishTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(mqtt.Client, 'publish')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self):
+        o = []
+        for args, _ in self.publish.call_args_list:
+            topic, payload = args[:2]
+            if topic.endswith('/state') and payload.startswith('{'):
+                payload = json.loads(payload)
+                del payload['cbus_source_addr']
+                del payload['cbus_source_name']
+            o.append((topic, payload))
+        self.publish.reset_mock()
+        return o
+
+    def test_publish(self):
+        client = cmqttd.MqttClient()
+        client.lighting_group_ramp(1, 5, 4, 128)
+        self.assertEqual([
+            (cmqttd.state_topic(5),
+             {'state': 'ON', 'brightness': 128, 'transition': 4}),
+            (cmqttd.bin_sensor_state_topic(5), 'ON'),
+        ], self.published())
+
+    def test_unchanged(self):
+        client = cmqttd.MqttClient()
+        client.lighting_group_on(None, 5)
+        self.assertEqual(2, len(self.published()))
+
+        # Echo of the same state from the PCI, with a source address.
+        client.lighting_group_on(1, 5)
+        client.lighting_group_ramp(2, 5, 0, 255)
+        self.assertEqual([], self.published())
+
+        # Other groups are separate.
+        client.lighting_group_on(None, 6)
+        self.assertEqual(2, len(self.published()))
+
+        client.lighting_group_off(1, 5)
+        self.assertEqual([
+            (cmqttd.state_topic(5),
+             {'state': 'OFF', 'brightness': 0, 'transition': 0}),
+            (cmqttd.bin_sensor_state_topic(5), 'OFF'),
+        ], self.published())
+
+    def test_source_name(self):
+        client = cmqttd.MqttClient(unit_names={
+            None: {1: 'Kitchen key unit'}, 2: {1: 'Garage key unit'}})
+        client.lighting_group_on(1, 5)
+        client.lighting_group_on(1, 5, network=2)
+        client.lighting_group_on(1, 6, network=3)
+        client.lighting_group_on(3, 7)
+        client.lighting_group_on(None, 8)
+
+        names = []
+        for args, _ in self.publish.call_args_list:
+            topic, payload = args[:2]
+            if topic.endswith('/state') and payload.startswith('{'):
+                payload = json.loads(payload)
+                names.append((payload['cbus_source_addr'],
+                              payload['cbus_source_name']))
+        self.assertEqual([
+            (1, 'Kitchen key unit'),
+            (1, 'Garage key unit'),
+            (1, None),
+            (3, None),
+            (None, None),
+        ], names)
+
+    def test_unchanged_error(self):
+        info = mqtt.MQTTMessageInfo(1)
+        info.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+        self.publish.return_value = info
+        client = cmqttd.MqttClient()
+        client.lighting_group_on(None, 5)
+        self.assertEqual(2, len(self.published()))
+
+        # The last attempt failed, so the same state is published again.
+        client.lighting_group_on(None, 5)
+        self.assertEqual(2, len(self.published()))
+
+    @async_test
+    async def test_unchanged_dropped(self):
+        client = cmqttd.MqttClient(publish_queue=2)
+        client.lighting_group_on(None, 5)
+        client.lighting_group_on(None, 6)
+        await asyncio.sleep(0)
+        self.assertEqual(2, client._publisher.dropped)
+
+        # Group 5's state was dropped, so it is queued again.
+        client.lighting_group_on(None, 5)
+        self.assertEqual(
+            [cmqttd.state_topic(5), cmqttd.bin_sensor_state_topic(5)],
+            list(client._publisher._droppable))
+        client._publisher.close()
+
+    @async_test
+    async def test_publish_window(self):
+        client = cmqttd.MqttClient(publish_window=0.01)
+        for level in range(0, 256, 16):
+            client.lighting_group_ramp(1, 5, 0, level)
+        client.lighting_group_off(1, 6)
+        client.lighting_group_ramp(1, 5, 0, 200)
+        self.assertEqual([], self.published())
+
+        await asyncio.sleep(0.02)
+        self.assertEqual([
+            (cmqttd.state_topic(6),
+             {'state': 'OFF', 'brightness': 0, 'transition': 0}),
+            (cmqttd.bin_sensor_state_topic(6), 'OFF'),
+            (cmqttd.state_topic(5),
+             {'state': 'ON', 'brightness': 200, 'transition': 0}),
+            (cmqttd.bin_sensor_state_topic(5), 'ON'),
+        ], self.published())
+
+    @async_test
+    async def test_publish_queue(self):
+        client = cmqttd.MqttClient(publish_queue=10)
+        client.lighting_group_on(None, 5)
+        client.lighting_group_off(None, 5)
+        await asyncio.sleep(0)
+        # Waits for the broker connection.
+        self.assertEqual([], self.published())
+
+        client._publisher.on_connect()
+        await asyncio.sleep(0.01)
+        self.assertEqual([
+            (cmqttd.state_topic(5),
+             {'state': 'OFF', 'brightness': 0, 'transition': 0}),
+            (cmqttd.bin_sensor_state_topic(5), 'OFF'),
+        ], self.published())
+        client._publisher.close()
+
+    @async_test
+    async def test_publish_queue_discovery(self):
+        client = cmqttd.MqttClient(publish_queue=100)
+        self.addCleanup(client._publisher.close)
+        handlers = [
+            mock.Mock(spec=cmqttd.CBusHandler, network=network,
+                      labels={0x38: {}, 0x39: {}},
+                      refresh_all_levels=mock.AsyncMock())
+            for network in (253, 254)]
+        with mock.patch.object(client, 'subscribe'):
+            client.on_connect(client, handlers, {}, 0)
+        for ga in range(100):
+            client.lighting_group_on(None, ga, network=254)
+
+        # Old states are dropped, but configuration topics never are.
+        queued = dict(client._publisher._reliable)
+        self.assertEqual(1 + 2 * 2 * 2 * 256, len(queued))
+        self.assertIn(cmqttd._META_TOPIC + cmqttd._TOPIC_CONF_SUFFIX, queued)
+        self.assertIn(cmqttd.conf_topic(5, 253, 0x39), queued)
+        self.assertEqual(100, len(client._publisher._droppable))
+        self.assertEqual(100, client._publisher.dropped)
+
+    def test_discovery_cache(self):
+        client = cmqttd.MqttClient()
+        labels = {5: 'Kitchen'}
+        client.publish_all_lights(labels)
+        first = self.published()
+        # A light and binary sensor per group.
+        self.assertEqual(2 * 256, len(first))
+        conf = dict(first)
+        self.assertEqual(
+            'Kitchen', json.loads(conf[cmqttd.conf_topic(5)])['name'])
+        self.assertEqual(
+            cmqttd.set_topic(5),
+            json.loads(conf[cmqttd.conf_topic(5)])['cmd_t'])
+
+        # Reconnecting with the same labels reuses the serialised payloads.
+        cache = client._discovery_cache[None, 0x38]
+        client.publish_all_lights(dict(labels))
+        self.assertEqual(first, self.published())
+        self.assertIs(cache, client._discovery_cache[None, 0x38])
+
+        # Changing labels rebuilds them.
+        labels[5] = 'Dining'
+        client.publish_all_lights(labels)
+        conf = dict(self.published())
+        self.assertEqual(
+            'Dining', json.loads(conf[cmqttd.conf_topic(5)])['name'])
+
+
+class MqttClientMessageTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(mqtt.Client, 'publish')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = cmqttd.MqttClient()
+        self.handler = mock.Mock(
+            spec=cmqttd.CBusHandler, network=None, applications=[0x38, 0x39])
+
+    def message(self, topic: Text, payload: bytes):
+        msg = mqtt.MQTTMessage(topic=topic.encode())
+        msg.payload = payload
+        self.client.on_message(self.client, self.handler, msg)
+
+    def test_route(self):
+        self.message(cmqttd.set_topic(5), b'{"state": "ON"}')
+        self.handler.lighting_group_on.assert_called_once_with(5, 0x38)
+
+        self.message(cmqttd.set_topic(255), b'{"state": "OFF"}')
+        self.handler.lighting_group_off.assert_called_once_with(255, 0x38)
+
+        self.message(cmqttd.set_topic(5, application=0x39),
+                     b'{"state": "ON", "brightness": 128}')
+        self.handler.lighting_group_ramp.assert_called_once_with(
+            5, 0, 128, 0x39)
+
+    def test_ignored(self):
+        for topic in ('homeassistant/light/kitchen/set',
+                      'homeassistant/light/cbus_9000/set',
+                      cmqttd.state_topic(5)):
+            self.message(topic, b'{"state": "ON"}')
+        self.assertEqual([], self.handler.method_calls)
+
+
+class MqttClientNetworkTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(mqtt.Client, 'publish')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = cmqttd.MqttClient()
+        self.handlers = [
+            mock.Mock(spec=cmqttd.CBusHandler, network=network,
+                      applications=[0x38])
+            for network in (253, 254)]
+
+    def test_route(self):
+        msg = mqtt.MQTTMessage(topic=cmqttd.set_topic(5, 254).encode())
+        msg.payload = b'{"state": "ON"}'
+        self.client.on_message(self.client, self.handlers, msg)
+        self.handlers[1].lighting_group_on.assert_called_once_with(5, 0x38)
+        self.assertEqual([], self.handlers[0].method_calls)
+
+        # Default network topics are not routed.
+        msg = mqtt.MQTTMessage(topic=cmqttd.set_topic(5).encode())
+        msg.payload = b'{"state": "ON"}'
+        self.client.on_message(self.client, self.handlers, msg)
+        self.assertEqual(1, len(self.handlers[1].method_calls))
+
+    def test_states(self):
+        # States are tracked separately for each network.
+        self.client.lighting_group_on(None, 5, network=253)
+        self.client.lighting_group_on(None, 5, network=254)
+        topics = [args[0] for args, _ in self.publish.call_args_list]
+        self.assertEqual([
+            cmqttd.state_topic(5, 253), cmqttd.bin_sensor_state_topic(5, 253),
+            cmqttd.state_topic(5, 254), cmqttd.bin_sensor_state_topic(5, 254),
+        ], topics)
+
+    def test_discovery(self):
+        self.client.publish_all_lights({5: 'Kitchen'}, network=254)
+        conf = {args[0]: json.loads(args[1])
+                for args, _ in self.publish.call_args_list}
+        light = conf[cmqttd.conf_topic(5, 254)]
+        self.assertEqual('Kitchen', light['name'])
+        self.assertEqual('cbus_light_254_5', light['unique_id'])
+        self.assertEqual(cmqttd.set_topic(5, 254), light['cmd_t'])
+        self.assertEqual('C-Bus Light 254/006',
+                         conf[cmqttd.conf_topic(6, 254)]['name'])
+
+
+def receive(handler: cmqttd.CBusHandler, sal):
+    """Passes a SAL from unit 5 to the handler, as if it came from the PCI."""
+    p = PointToMultipointPacket(sals=[sal])
+    p.source_address = 5
+    handler.data_received(p.encode_packet() + b'\r\n')
+
+
+class CBusHandlerTest(unittest.TestCase):
+
+    def test_applications(self):
+        handler = cmqttd.CBusHandler(
+            labels={0x39: {}}, timesync_frequency=0,
+            handle_clock_requests=False)
+        handler.mqtt_api = mock.Mock(spec=cmqttd.MqttClient)
+        for app in (0x38, 0x39):
+            receive(handler, LightingOnSAL(8, app))
+
+        # Only exposed applications are published.
+        handler.mqtt_api.lighting_group_on.assert_called_once_with(
+            5, 8, network=None, application=0x39)
+        self.assertEqual([0x39], list(handler.applications))
+
+    @mock.patch('cbus.protocol.pciprotocol.monotonic')
+    def test_terminate_ramp(self, monotonic):
+        monotonic.return_value = 100.
+        handler = cmqttd.CBusHandler(
+            labels=None, timesync_frequency=0, handle_clock_requests=False)
+        handler.mqtt_api = mock.Mock(spec=cmqttd.MqttClient)
+        receive(handler, LightingOffSAL(8))
+        receive(handler, LightingRampSAL(8, 4, 200))
+
+        monotonic.return_value = 102.
+        receive(handler, LightingTerminateRampSAL(8))
+        handler.mqtt_api.lighting_group_ramp.assert_called_with(
+            5, 8, 0, 100, network=None, application=0x38)
+
+    @mock.patch('cbus.protocol.pciprotocol.monotonic')
+    def test_terminate_ramp_unknown_origin(self, monotonic):
+        monotonic.return_value = 100.
+        handler = cmqttd.CBusHandler(
+            labels=None, timesync_frequency=0, handle_clock_requests=False)
+        handler.mqtt_api = mock.Mock(spec=cmqttd.MqttClient)
+        receive(handler, LightingRampSAL(8, 4, 200))
+        handler.mqtt_api.reset_mock()
+
+        # The level it stopped at is unknown, so it is requested instead of
+        # published.
+        monotonic.return_value = 102.
+        with mock.patch.object(handler, 'request_group_levels') as request:
+            receive(handler, LightingTerminateRampSAL(8))
+        request.assert_called_once_with(8, 0x38)
+        self.assertEqual([], handler.mqtt_api.method_calls)
+
+    def test_default_application(self):
+        handler = cmqttd.CBusHandler(
+            labels=None, timesync_frequency=0, handle_clock_requests=False)
+        self.assertEqual([0x38], list(handler.applications))
+
+    def test_discovery(self):
+        with mock.patch.object(mqtt.Client, 'publish') as publish:
+            cmqttd.MqttClient().publish_all_lights(
+                {}, network=254, application=0x39)
+        conf = {args[0]: json.loads(args[1])
+                for args, _ in publish.call_args_list}
+        light = conf[cmqttd.conf_topic(5, 254, 0x39)]
+        self.assertEqual('C-Bus Light 254/app39/005', light['name'])
+        self.assertEqual('cbus_light_254_app39_5', light['unique_id'])
+        self.assertEqual(cmqttd.set_topic(5, 254, 0x39), light['cmd_t'])
+
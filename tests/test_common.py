@@ -19,7 +19,7 @@ from __future__ import absolute_import
 
 import unittest
 
-from cbus.common import add_cbus_checksum
+from cbus.common import add_cbus_checksum, validate_cbus_checksum
 
 
 class CommonTest(unittest.TestCase):
@@ -34,6 +34,16 @@ class CommonTest(unittest.TestCase):
     def test_empty_checksum(self):
         self.assertEqual(b'\0', add_cbus_checksum(b''))
 
+    def test_validate_checksum(self):
+        """Test checksum validation against every possible checksum byte."""
+        msg = b'\x05\x38\x00\x79\x08'
+        expected = add_cbus_checksum(msg)
+        for x in range(256):
+            b = msg + bytes([x])
+            self.assertEqual(b == expected, validate_cbus_checksum(b))
+
+        self.assertFalse(validate_cbus_checksum(b''))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# test_dump_labels.py - Tests for the dump_labels tool
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from contextlib import redirect_stderr
+import io
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from cbus.toolkit import dump_labels
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class DumpLabelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        os.mkdir(os.path.join(self.tmp, 'projects'))
+        for name in ('home-demo.cbz', 'example-demo.cbz'):
+            shutil.copy(os.path.join(DATA_DIR, name),
+                        os.path.join(self.tmp, 'projects', name))
+        self.output = os.path.join(self.tmp, 'out.json')
+
+    def run_main(self, *args):
+        argv = ['dump_labels', '-o', self.output] + list(args)
+        with mock.patch.object(sys, 'argv', argv):
+            dump_labels.main()
+        with open(self.output) as fh:
+            return fh.read()
+
+    def test_find_inputs(self):
+        home = os.path.join(DATA_DIR, 'home-demo.cbz')
+        self.assertEqual(([home], False), dump_labels.find_inputs([home]))
+
+        files, expanded = dump_labels.find_inputs(
+            [self.tmp, os.path.join(DATA_DIR, 'h*.cbz')])
+        self.assertTrue(expanded)
+        self.assertEqual(
+            ['example-demo.cbz', 'home-demo.cbz', 'home-demo.cbz'],
+            [os.path.basename(f) for f in files])
+
+    def test_dump_file(self):
+        result = dump_labels.dump_file(
+            os.path.join(DATA_DIR, 'home-demo.cbz'))
+        network = result['networks'][254]
+        self.assertEqual('Basement Light 1',
+                         network['applications'][56]['groups'][208])
+        self.assertEqual('PCINT4', network['units'][250]['unittype'])
+
+        result = dump_labels.dump_file(os.path.join(DATA_DIR, 'all.cbz'))
+        self.assertIn('CBZException', result['error'])
+
+    def test_single(self):
+        path = os.path.join(DATA_DIR, 'home-demo.cbz')
+        o = json.loads(self.run_main(path))
+        self.assertEqual(['254'], list(o))
+        self.assertEqual(
+            json.loads(json.dumps(dump_labels.dump_file(path)['networks'])),
+            o)
+
+    def test_ndjson(self):
+        lines = self.run_main(
+            '-j', '1', os.path.join(self.tmp, 'projects')).splitlines()
+        results = [json.loads(line) for line in lines]
+        self.assertEqual(
+            ['example-demo.cbz', 'home-demo.cbz'],
+            sorted(os.path.basename(r['file']) for r in results))
+        for r in results:
+            self.assertIn('254', r['networks'])
+
+        # A single file can also be written as NDJSON.
+        lines = self.run_main(
+            '-n', os.path.join(DATA_DIR, 'home-demo.cbz')).splitlines()
+        self.assertEqual(1, len(lines))
+
+    def test_ndjson_error(self):
+        with self.assertRaises(SystemExit) as cm:
+            self.run_main('-j', '1', os.path.join(DATA_DIR, 'all.cbz'),
+                          os.path.join(DATA_DIR, 'home-demo.cbz'))
+        self.assertEqual(1, cm.exception.code)
+
+    def test_no_inputs(self):
+        os.mkdir(os.path.join(self.tmp, 'empty'))
+        for path in (os.path.join(self.tmp, 'empty'),
+                     os.path.join(self.tmp, '*.cbz')):
+            with self.subTest(path=path):
+                stderr = io.StringIO()
+                with redirect_stderr(stderr), \
+                        self.assertRaises(SystemExit) as cm:
+                    self.run_main(path)
+                self.assertNotEqual(0, cm.exception.code)
+                self.assertIn('No input files', stderr.getvalue())
+                self.assertFalse(os.path.exists(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
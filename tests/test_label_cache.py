@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# test_label_cache.py - Tests for the project file label cache
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cbus.toolkit import label_cache
+from cbus.toolkit.label_cache import (
+    CACHE_VERSION, default_cache_path, load_project_labels)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class LabelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.project = os.path.join(self.tmp, 'project.cbz')
+        shutil.copy(os.path.join(DATA_DIR, 'home-demo.cbz'), self.project)
+        self.cache = default_cache_path(self.project)
+
+    def no_parse(self):
+        """Fails the test if the project file is parsed."""
+        return mock.patch.object(
+            label_cache, 'CBZ', side_effect=AssertionError('parsed'))
+
+    def test_cache(self):
+        networks = load_project_labels(self.project)
+        self.assertEqual([254], list(networks))
+        labels = networks[254].labels
+        self.assertEqual('Basement Light 1', labels[56][208])
+        self.assertEqual('PCINT4', networks[254].units[250]['unittype'])
+
+        with open(self.cache) as fh:
+            cache = json.load(fh)
+        self.assertEqual(CACHE_VERSION, cache['version'])
+        self.assertEqual(os.path.getsize(self.project), cache['size'])
+
+        with self.no_parse():
+            self.assertEqual(networks, load_project_labels(self.project))
+
+    def test_touched(self):
+        networks = load_project_labels(self.project)
+        st = os.stat(self.project)
+        os.utime(self.project, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        # Same content, so the hash matches and the cache is updated.
+        with self.no_parse():
+            self.assertEqual(networks, load_project_labels(self.project))
+        with open(self.cache) as fh:
+            self.assertEqual(st.st_mtime_ns + 10**9, json.load(fh)['mtime_ns'])
+
+    def test_changed(self):
+        load_project_labels(self.project)
+        shutil.copy(os.path.join(DATA_DIR, 'example-demo.cbz'), self.project)
+
+        networks = load_project_labels(self.project)
+        self.assertEqual(9, len(networks[254].units))
+        with self.no_parse():
+            self.assertEqual(networks, load_project_labels(self.project))
+
+    def test_bad_cache(self):
+        for data in ('', '{"version": 0}', '[]'):
+            with open(self.cache, 'w') as fh:
+                fh.write(data)
+            self.assertEqual([254], list(load_project_labels(self.project)))
+
+    def test_malformed_cache(self):
+        load_project_labels(self.project)
+        with open(self.cache) as fh:
+            good = json.load(fh)
+
+        for networks in (None, [], {'x': {}}, {'254': {'labels': []}},
+                         {'254': {'labels': {}, 'units': {'a': {}}}}):
+            with self.subTest(networks=networks):
+                with open(self.cache, 'w') as fh:
+                    json.dump(dict(good, networks=networks), fh)
+                with self.assertLogs(label_cache.logger, 'WARNING'):
+                    networks = load_project_labels(self.project)
+                self.assertEqual('PCINT4',
+                                 networks[254].units[250]['unittype'])
+
+                # The cache was replaced.
+                with open(self.cache) as fh:
+                    self.assertEqual(good, json.load(fh))
+
+    def test_no_cache(self):
+        load_project_labels(self.project, use_cache=False)
+        self.assertFalse(os.path.exists(self.cache))
+
+        cache = os.path.join(self.tmp, 'missing', 'cache.json')
+        with self.assertLogs(label_cache.logger, 'WARNING'):
+            networks = load_project_labels(self.project, cache)
+        self.assertEqual([254], list(networks))
+        self.assertEqual(['project.cbz'], os.listdir(self.tmp))
+
+    def test_missing_project(self):
+        with self.assertRaises(OSError):
+            load_project_labels(os.path.join(self.tmp, 'missing.cbz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
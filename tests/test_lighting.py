@@ -174,6 +174,33 @@ class InternalLightingTest(CBusTestCase):
             LightingRampSAL(1, 10, 256).encode()
 
 
+class LightingApplicationTest(CBusTestCase):
+    def test_decode_other_application(self):
+        p = self.decode_pm(b'\\0539000108B9g\r', from_pci=False)
+        self.assertEqual(p.application, 0x39)
+        self.assertIsInstance(p[0], LightingOffSAL)
+        self.assertEqual(p[0].application, 0x39)
+        self.assertEqual(p.encode_packet(), b'0539000108B9')
+
+    def test_encode_other_application(self):
+        p = PointToMultipointPacket(sals=[
+            LightingOnSAL(1, 0x5f), LightingRampSAL(2, 0, 128, 0x5f)])
+        self.assertEqual(p.application, 0x5f)
+
+        # Default is the main lighting application.
+        self.assertEqual(LightingOnSAL(1).application, 0x38)
+
+    def test_mixed_applications(self):
+        p = PointToMultipointPacket(sals=[LightingOnSAL(1, 0x39)])
+        with self.assertRaises(ValueError):
+            p.append_sal(LightingOnSAL(1))
+
+    def test_invalid_application(self):
+        for app in (0x2f, 0x60, 0xff):
+            with self.assertRaises(ValueError):
+                LightingOnSAL(1, app)
+
+
 class LightingRegressionTest(CBusTestCase):
     def test_issue2(self):
         """Handle the null lighting packet described in Issue #2."""
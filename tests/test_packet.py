@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# test_packet.py - Tests for the packet decoder entry points
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import unittest
+
+from cbus.protocol.application.lighting import LightingOffSAL, LightingOnSAL
+from cbus.protocol.base_packet import BasePacket, InvalidPacket
+from cbus.protocol.cbus_protocol import CBusProtocol
+from cbus.protocol.confirm_packet import ConfirmationPacket
+from cbus.protocol.freezable import FrozenInstanceError
+from cbus.protocol.packet import (
+    PacketCache, decode_all, decode_packet, decode_packets)
+from cbus.protocol.pm_packet import PointToMultipointPacket
+
+
+class DecodePacketsTest(unittest.TestCase):
+
+    def test_offset(self):
+        data = bytearray(b'junk\\0538000108BAg\r')
+        p, consumed = decode_packet(data, from_pci=False, offset=4)
+        self.assertIsInstance(p, PointToMultipointPacket)
+        self.assertEqual(len(data) - 4, consumed)
+        self.assertEqual(b'g', p.confirmation)
+
+    def test_decode_packets(self):
+        data = (b'\\0538000108BAg\r'
+                b'null'
+                b'\\053800790842h\r'
+                b'\\05380001')
+        decoder = decode_packets(data, from_pci=False)
+        packets = list(decoder)
+
+        self.assertEqual(2, len(packets))
+        self.assertIsInstance(packets[0][0], LightingOffSAL)
+        self.assertIsInstance(packets[1][0], LightingOnSAL)
+
+    def test_decode_all(self):
+        data = b'g.05013800790841\r\nh#0538'
+        packets, remainder = decode_all(data)
+
+        self.assertEqual(3, len(packets))
+        self.assertIsInstance(packets[0], ConfirmationPacket)
+        self.assertTrue(packets[0].success)
+        self.assertIsInstance(packets[1], PointToMultipointPacket)
+        self.assertIsInstance(packets[1][0], LightingOnSAL)
+        self.assertIsInstance(packets[2], ConfirmationPacket)
+        self.assertFalse(packets[2].success)
+
+        self.assertEqual(b'0538', data[remainder:])
+
+    def test_decode_all_empty(self):
+        self.assertEqual(([], 0), decode_all(b''))
+        self.assertEqual(([], 3), decode_all(b'abc', offset=3))
+
+
+class DecodeBase16Test(unittest.TestCase):
+
+    def test_non_base16(self):
+        for data in (b'\\05380079084Xg\r',
+                     b'\\05380079084 g\r',
+                     # Lower case is not allowed either.
+                     b'\\05380079084ag\r'):
+            p, consumed = decode_packet(data, from_pci=False)
+            self.assertIsInstance(p, InvalidPacket)
+            self.assertIsInstance(p.exception, ValueError)
+            self.assertIn('Non-base16', str(p.exception))
+            self.assertEqual(len(data), consumed)
+
+    def test_bad_checksum(self):
+        p, _ = decode_packet(b'\\053800790843g\r', from_pci=False)
+        self.assertIsInstance(p, InvalidPacket)
+        self.assertIn('expected 0x42', str(p.exception))
+
+        with self.assertWarnsRegex(UserWarning, 'expected 0x42'):
+            p, _ = decode_packet(b'\\053800790843g\r', from_pci=False,
+                                 strict=False)
+        self.assertIsInstance(p, PointToMultipointPacket)
+
+
+class PacketCacheTest(unittest.TestCase):
+
+    def test_hit(self):
+        cache = PacketCache()
+        data = b'05013800790841\r\n'
+        p1, consumed1 = decode_packet(data, cache=cache)
+        p2, consumed2 = decode_packet(data, cache=cache)
+
+        self.assertEqual(len(data), consumed1)
+        self.assertEqual(len(data), consumed2)
+        self.assertIs(p1, p2)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(1, len(cache))
+
+        # Different decoding options are cached separately.
+        p3, _ = decode_packet(data, strict=False, cache=cache)
+        self.assertIsNot(p1, p3)
+        self.assertEqual(2, cache.misses)
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def test_frozen(self):
+        cache = PacketCache()
+        p, _ = decode_packet(b'05013800790841\r\n', cache=cache)
+        self.assertTrue(p.frozen)
+        self.assertTrue(p[0].frozen)
+
+        with self.assertRaises(FrozenInstanceError):
+            p.source_address = 2
+        with self.assertRaises(FrozenInstanceError):
+            p[0].group_address = 9
+        with self.assertRaises(FrozenInstanceError):
+            p.append_sal(LightingOffSAL(1))
+        with self.assertRaises(FrozenInstanceError):
+            p.clear_sal()
+
+        self.assertEqual('LightingOnSAL', type(p[0]).__name__)
+        self.assertIsInstance(p[0], LightingOnSAL)
+
+        # Packets which are not cached remain mutable.
+        p, _ = decode_packet(b'05013800790841\r\n')
+        self.assertFalse(p.frozen)
+        p.source_address = 2
+
+    def test_frozen_equality(self):
+        data = (b'86999900F9003800A8AA02000000000000000000000000000000000000'
+                b'00C3\r\n')
+        cached, _ = decode_packet(data, cache=PacketCache())
+        uncached, _ = decode_packet(data)
+        self.assertTrue(cached[0].frozen)
+        self.assertTrue(cached[0].report.frozen)
+        self.assertFalse(uncached[0].frozen)
+
+        self.assertEqual(cached[0], uncached[0])
+        self.assertEqual(uncached[0], cached[0])
+        self.assertEqual(list(cached[0].report), list(uncached[0].report))
+
+    def test_eviction(self):
+        cache = PacketCache(maxsize=2)
+        a = b'\\053800790842g\r'
+        b = b'\\0538000108BAg\r'
+        c = b'\\053800790743g\r'
+        for data in (a, b, a, c):
+            decode_packet(data, from_pci=False, cache=cache)
+
+        # b was least recently used, and should have been evicted.
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.hits)
+        decode_packet(a, from_pci=False, cache=cache)
+        self.assertEqual(2, cache.hits)
+        decode_packet(b, from_pci=False, cache=cache)
+        self.assertEqual(4, cache.misses)
+
+    def test_uncached_special_packets(self):
+        cache = PacketCache()
+        packets, _ = decode_all(b'g.g.', cache=cache)
+        self.assertEqual(2, len(packets))
+        self.assertEqual(0, len(cache))
+
+
+class SlotsTest(unittest.TestCase):
+
+    def test_no_instance_dict(self):
+        data = (b'05013800790841\r\n'
+                b'0501380002087F39\r\n'
+                b'86999900F9003800A8AA02000000000000000000000000000000000000'
+                b'00C3\r\n'
+                b'g.')
+        packets, _ = decode_all(data)
+        self.assertEqual(4, len(packets))
+
+        objs = []
+        for p in packets:
+            objs.append(p)
+            for x in getattr(p, '_sals', ()) or getattr(p, '_cals', ()):
+                objs.append(x)
+                if hasattr(x, 'report'):
+                    objs.append(x.report)
+
+        self.assertEqual(8, len(objs))
+        for o in objs:
+            with self.subTest(type(o).__name__):
+                self.assertFalse(hasattr(o, '__dict__'))
+
+                # Frozen versions should not add a __dict__ either.
+                o.freeze()
+                self.assertFalse(hasattr(o, '__dict__'))
+
+
+class FailingProtocol(CBusProtocol):
+    """Records each packet, and raises an exception for the first one."""
+
+    def __init__(self):
+        super().__init__(emulate_pci=False)
+        self.packets = []
+
+    def handle_cbus_packet(self, p: BasePacket) -> None:
+        self.packets.append(p)
+        if len(self.packets) == 1:
+            raise ValueError('handler failed')
+
+
+class HandleDataTest(unittest.TestCase):
+
+    def test_handler_exception(self):
+        protocol = FailingProtocol()
+        with self.assertRaises(ValueError):
+            protocol.data_received(b'05013800790841\r\ng.')
+        self.assertEqual(1, len(protocol.packets))
+
+        # The frame which was already handled must not be handled again.
+        protocol.data_received(b'h.')
+        self.assertEqual(3, len(protocol.packets))
+        self.assertIsInstance(protocol.packets[0], PointToMultipointPacket)
+        self.assertEqual(
+            [b'g', b'h'], [p.code for p in protocol.packets[1:]])
+        self.assertEqual(0, len(protocol._buf))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# test_paho_asyncio.py - Tests for the asyncio MQTT publisher
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import absolute_import
+
+import asyncio
+import unittest
+
+import paho.mqtt.client as mqtt
+
+from cbus.paho_asyncio import AsyncioPublisher
+
+from .utils import async_test
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload, qos, retain):
+        self.published.append((topic, payload))
+        info = mqtt.MQTTMessageInfo(len(self.published))
+        info.rc = self.rc
+        return info
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class AsyncioPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+
+    @async_test
+    async def test_wait_for_connect(self):
+        p = AsyncioPublisher(self.client.publish)
+        f = p.publish('a', '1')
+        await settle()
+        self.assertEqual([], self.client.published)
+
+        p.on_connect()
+        await settle()
+        self.assertEqual([('a', '1')], self.client.published)
+
+        # Resolved once acknowledged.
+        self.assertFalse(f.done())
+        p.on_publish(1)
+        await asyncio.wait_for(f, 1)
+        p.close()
+
+    @async_test
+    async def test_merge(self):
+        p = AsyncioPublisher(self.client.publish)
+        f1 = p.publish('a', '1')
+        p.publish('b', '1')
+        f2 = p.publish('a', '2')
+        self.assertIs(f1, f2)
+        self.assertEqual(2, len(p))
+
+        p.on_connect()
+        await settle()
+        self.assertEqual([('a', '2'), ('b', '1')], self.client.published)
+        p.close()
+
+    @async_test
+    async def test_overflow(self):
+        p = AsyncioPublisher(self.client.publish, maxsize=2)
+        f1 = p.publish('a', '1')
+        p.publish('b', '1')
+        p.publish('c', '1')
+        self.assertTrue(f1.cancelled())
+        self.assertEqual(1, p.dropped)
+
+        p.on_connect()
+        await settle()
+        self.assertEqual([('b', '1'), ('c', '1')], self.client.published)
+        p.close()
+
+    @async_test
+    async def test_not_droppable(self):
+        p = AsyncioPublisher(self.client.publish, maxsize=1)
+        f1 = p.publish('a', '1', droppable=False)
+        p.publish('b', '1', droppable=False)
+        p.publish('c', '1')
+        p.publish('d', '1')
+        self.assertFalse(f1.done())
+        self.assertEqual(1, p.dropped)
+
+        # A queued message can't be made droppable again.
+        p.publish('a', '2')
+        self.assertEqual(3, len(p))
+
+        # Messages which can't be dropped are sent first.
+        p.on_connect()
+        await settle()
+        self.assertEqual([('a', '2'), ('b', '1'), ('d', '1')],
+                         self.client.published)
+        p.close()
+
+    @async_test
+    async def test_max_in_flight(self):
+        p = AsyncioPublisher(self.client.publish, max_in_flight=2)
+        p.on_connect()
+        for topic in 'abc':
+            p.publish(topic, '1')
+        await settle()
+        self.assertEqual(2, len(self.client.published))
+
+        p.on_publish(1)
+        await settle()
+        self.assertEqual(3, len(self.client.published))
+        p.close()
+
+    @async_test
+    async def test_error(self):
+        self.client.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+        p = AsyncioPublisher(self.client.publish)
+        p.on_connect()
+        with self.assertRaises(IOError):
+            await asyncio.wait_for(p.publish('a', '1'), 1)
+
+        # QoS 0 messages resolve once sent.
+        self.client.rc = mqtt.MQTT_ERR_SUCCESS
+        await asyncio.wait_for(p.publish('a', '1', qos=0), 1)
+        p.close()
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, AsyncioPublisher, self.client, 0)
+        self.assertRaises(ValueError, AsyncioPublisher, self.client, 1, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,620 @@
+#!/usr/bin/env python
+# test_pciprotocol.py - Tests for the PCI protocol handler
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import asyncio
+import unittest
+from unittest import mock
+
+from cbus.common import Application, GroupState
+from cbus.protocol.application.enable import EnableSetNetworkVariableSAL
+from cbus.protocol.application.lighting import (
+    LightingOffSAL, LightingOnSAL, LightingRampSAL, LightingSAL,
+    LightingTerminateRampSAL)
+from cbus.protocol.application.status_request import StatusRequestSAL
+from cbus.protocol.application.temperature import TemperatureBroadcastSAL
+from cbus.protocol.cal.extended import ExtendedCAL
+from cbus.protocol.cal.report import BinaryStatusReport, LevelStatusReport
+from cbus.protocol.packet import PacketCache, decode_packet
+from cbus.protocol.pciprotocol import PCIProtocol
+from cbus.protocol.pm_packet import PointToMultipointPacket
+
+from .utils import FakeTransport, async_test
+
+
+def encode_from_pci(*sals) -> bytes:
+    p = PointToMultipointPacket(sals=list(sals))
+    p.source_address = 5
+    return p.encode_packet() + b'\r\n'
+
+
+class RecordingPCIProtocol(PCIProtocol):
+    """PCIProtocol which records the events it receives."""
+
+    def __init__(self, **kwargs):
+        super().__init__(timesync_frequency=0, handle_clock_requests=False,
+                         **kwargs)
+        self.events = []
+
+    def on_confirmation(self, code, success):
+        self.events.append(('confirmation', code, success))
+
+    def on_lighting_group_on(self, source_addr, group_addr, application):
+        self.events.append(('on', source_addr, group_addr, application))
+
+    def on_lighting_group_off(self, source_addr, group_addr, application):
+        self.events.append(('off', source_addr, group_addr, application))
+
+    def on_lighting_group_terminate_ramp(
+            self, source_addr, group_addr, application):
+        self.events.append(
+            ('terminate', source_addr, group_addr, application))
+
+    def on_temperature_broadcast(self, source_addr, group_addr, temperature):
+        self.events.append(('temperature', source_addr, group_addr,
+                            temperature))
+
+    def on_enable_set_network_variable(self, source_addr, variable, value):
+        self.events.append(('enable', source_addr, variable, value))
+
+    def on_lighting_group_level_report(self, application, group_addr, level):
+        self.events.append(('level', application, group_addr, level))
+
+    def on_pci_power_up(self):
+        self.events.append(('power_up',))
+
+    def on_pci_cannot_accept_data(self):
+        self.events.append(('error',))
+
+
+class PCIProtocolDispatchTest(unittest.TestCase):
+
+    def test_lighting(self):
+        p = RecordingPCIProtocol()
+        p.data_received(b'05013800790841\r\n')
+        self.assertEqual([('on', 1, 8, 0x38)], p.events)
+
+    def test_special_packets(self):
+        p = RecordingPCIProtocol()
+        p.data_received(b'g.h#+!')
+        self.assertEqual([
+            ('confirmation', b'g', True),
+            ('confirmation', b'h', False),
+            ('power_up',),
+            ('error',),
+        ], p.events)
+
+    def test_temperature_and_enable(self):
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(TemperatureBroadcastSAL(10, 25)))
+        p.data_received(encode_from_pci(EnableSetNetworkVariableSAL(3, 9)))
+        self.assertEqual([
+            ('temperature', 5, 10, 25),
+            ('enable', 5, 3, 9),
+        ], p.events)
+
+    def test_frozen_packets(self):
+        # Frozen packets are a subclass of the decoded type.
+        p = RecordingPCIProtocol(packet_cache=PacketCache())
+        for _ in range(2):
+            p.data_received(b'05013800790841\r\n')
+        self.assertEqual([('on', 1, 8, 0x38)] * 2, p.events)
+
+    def test_register_sal_handler(self):
+        p = RecordingPCIProtocol()
+        lighting_on = []
+        p.register_sal_handler(
+            LightingOnSAL, lambda pkt, sal: lighting_on.append(sal))
+        p.data_received(b'05013800790841\r\n')
+
+        self.assertEqual([], p.events)
+        self.assertEqual(1, len(lighting_on))
+        self.assertEqual(8, lighting_on[0].group_address)
+
+    def test_register_application_sal_handler(self):
+        p = RecordingPCIProtocol()
+        other = []
+        p.register_sal_handler(
+            LightingOnSAL, lambda pkt, sal: other.append(sal),
+            application=0x39)
+        p.data_received(b'05013800790841\r\n')
+
+        # Handler is for a different application, so shouldn't be used.
+        self.assertEqual([('on', 1, 8, 0x38)], p.events)
+        self.assertEqual([], other)
+
+        lighting = []
+        p.register_sal_handler(
+            LightingOnSAL, lambda pkt, sal: lighting.append(sal),
+            application=Application.LIGHTING)
+        p.data_received(b'05013800790841\r\n')
+        self.assertEqual([('on', 1, 8, 0x38)], p.events)
+        self.assertEqual(1, len(lighting))
+
+    def test_application_handler_precedence(self):
+        p = RecordingPCIProtocol()
+        generic = []
+        lighting = []
+        p.register_sal_handler(
+            LightingOnSAL, lambda pkt, sal: generic.append(sal))
+        p.register_sal_handler(
+            LightingSAL, lambda pkt, sal: lighting.append(sal),
+            application=Application.LIGHTING)
+        p.data_received(b'05013800790841\r\n')
+
+        # The application-specific handler for the base class wins over the
+        # generic handler for the subclass.
+        self.assertEqual([], generic)
+        self.assertEqual(1, len(lighting))
+
+
+class ConnectedTestCase(unittest.TestCase):
+
+    def connect(self, **kwargs) -> RecordingPCIProtocol:
+        p = RecordingPCIProtocol(**kwargs)
+        self.transport = FakeTransport()
+        p.connection_made(self.transport)
+        self.transport.clear()
+        p.events.clear()
+        return p
+
+
+class PCIProtocolConfirmationTest(ConnectedTestCase):
+
+    @async_test
+    async def test_confirmation(self):
+        p = self.connect()
+        f = p.lighting_group_on(1)
+        self.assertEqual([b'\\053800790149h\r'], self.transport.written)
+        self.assertFalse(f.done())
+
+        p.data_received(b'h.')
+        self.assertTrue(await f)
+        self.assertEqual([('confirmation', b'h', True)], p.events)
+
+        f = p.lighting_group_off(1)
+        p.data_received(b'i#')
+        self.assertFalse(await f)
+
+    @async_test
+    async def test_window(self):
+        p = self.connect(max_in_flight=2)
+        futures = [p.lighting_group_on(ga) for ga in range(4)]
+        self.assertEqual(2, len(self.transport.written))
+
+        # Confirmations can arrive out of order.
+        p.data_received(b'i.')
+        self.assertTrue(await futures[1])
+        self.assertFalse(futures[0].done())
+        self.assertEqual(3, len(self.transport.written))
+
+        p.data_received(b'h.j.')
+        self.assertEqual(4, len(self.transport.written))
+        p.data_received(b'k.')
+        self.assertEqual([True] * 4, await asyncio.gather(*futures))
+
+        codes = [w[-2:-1] for w in self.transport.written]
+        self.assertEqual([b'h', b'i', b'j', b'k'], codes)
+
+    @async_test
+    async def test_codes_not_reused(self):
+        p = self.connect(max_in_flight=20)
+        futures = [p.lighting_group_on(ga) for ga in range(40)]
+        self.assertEqual(20, len(self.transport.written))
+
+        # Confirm everything except the first command.
+        codes = [w[-2:-1] for w in self.transport.written]
+        for code in codes[1:]:
+            p.data_received(code + b'.')
+
+        # The first command's code must not be used again.
+        self.assertEqual(39, len(self.transport.written))
+        outstanding = [w[-2:-1] for w in self.transport.written[20:]]
+        self.assertNotIn(codes[0], outstanding)
+        self.assertEqual(19, len(set(outstanding)))
+
+        p.data_received(codes[0] + b'.')
+        self.assertEqual(40, len(self.transport.written))
+        self.assertTrue(await futures[0])
+
+    @async_test
+    async def test_pci_error(self):
+        p = self.connect(max_retries=0)
+        f1 = p.lighting_group_on(1)
+        f2 = p.lighting_group_on(2)
+        p.data_received(b'!')
+
+        with self.assertRaises(IOError):
+            await f1
+        self.assertFalse(f2.done())
+        self.assertEqual([('error',)], p.events)
+
+    @async_test
+    async def test_timeout(self):
+        p = self.connect(confirmation_timeout=0.01, max_retries=0)
+        f = p.lighting_group_on(1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await f
+
+    @async_test
+    async def test_connection_lost(self):
+        p = self.connect(max_in_flight=1)
+        f1 = p.lighting_group_on(1)
+        f2 = p.lighting_group_on(2)
+        p.connection_lost(None)
+
+        for f in (f1, f2):
+            with self.assertRaises(IOError):
+                await f
+
+        with self.assertRaises(IOError):
+            p.lighting_group_on(3)
+
+    @async_test
+    async def test_shared_connection_lost_future(self):
+        future = asyncio.get_running_loop().create_future()
+        protocols = [self.connect(connection_lost_future=future)
+                     for _ in range(2)]
+        protocols[0].connection_lost(None)
+        self.assertTrue(await future)
+
+        # A second protocol losing its connection is not an error.
+        protocols[1].connection_lost(None)
+
+    @async_test
+    async def test_retransmit_on_error(self):
+        p = self.connect()
+        f1 = p.lighting_group_on(1)
+        f2 = p.lighting_group_on(2)
+        p.data_received(b'!')
+        self.assertFalse(f1.done())
+        self.assertEqual([('error',)], p.events)
+
+        # The window should have been reduced, and the rejected command
+        # should be sent again after a delay.
+        self.assertEqual(2, int(p._window))
+        self.assertEqual(2, len(self.transport.written))
+        await asyncio.sleep(0.05)
+        self.assertEqual(3, len(self.transport.written))
+
+        first, _, retry = self.transport.written
+        self.assertEqual(first[:-2], retry[:-2])
+        self.assertNotEqual(first[-2:-1], retry[-2:-1])
+
+        p.data_received(b'i.' + retry[-2:-1] + b'.')
+        self.assertTrue(await f1)
+        self.assertTrue(await f2)
+
+    @async_test
+    async def test_reset_without_confirmations(self):
+        # A PCI in basic mode may never confirm the reset commands.
+        p = RecordingPCIProtocol(max_in_flight=1)
+        self.transport = FakeTransport()
+        p.connection_made(self.transport)
+        self.assertEqual(6, len(self.transport.written))
+        self.transport.clear()
+
+        # Lighting commands are sent straight away.
+        f = p.lighting_group_on(1)
+        self.assertEqual([b'\\053800790149h\r'], self.transport.written)
+        p.data_received(b'h.')
+        self.assertTrue(await f)
+
+    @async_test
+    async def test_retransmit_on_timeout(self):
+        p = self.connect(confirmation_timeout=0.01, max_retries=2)
+        f = p.lighting_group_on(1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await f
+        self.assertEqual(3, len(self.transport.written))
+        self.assertEqual(1, len(set(w[:-2] for w in self.transport.written)))
+
+    @async_test
+    async def test_recovery(self):
+        p = self.connect()
+        p.data_received(b'!')
+        self.assertEqual(2, int(p._window))
+        self.assertGreater(p._send_interval(), 0)
+
+        # Sending is paced after an error.
+        futures = [p.lighting_group_on(ga) for ga in range(2)]
+        self.assertEqual(1, len(self.transport.written))
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            for w in self.transport.written:
+                p.data_received(w[-2:-1] + b'.')
+            self.transport.clear()
+            if all(f.done() for f in futures):
+                break
+
+        # Successful commands open the window and reduce the extra delay.
+        self.assertEqual([True, True], await asyncio.gather(*futures))
+        self.assertGreater(p._window, 2.5)
+        self.assertLess(p._backoff, 0.02)
+
+    def test_invalid_window(self):
+        for n in (0, 21):
+            with self.assertRaises(ValueError):
+                PCIProtocol(max_in_flight=n)
+
+
+class PCIProtocolCoalesceTest(ConnectedTestCase):
+
+    def decode_written(self):
+        packets = []
+        for w in self.transport.written:
+            p, _ = decode_packet(w, from_pci=False)
+            self.assertIsInstance(p, PointToMultipointPacket)
+            packets.append(p)
+        return packets
+
+    @async_test
+    async def test_coalesce(self):
+        p = self.connect(coalesce_window=0.01)
+        f1 = p.lighting_group_on(1)
+        f2 = p.lighting_group_off([2, 3])
+        f3 = p.lighting_group_ramp(4, 4, 128)
+        self.assertEqual([], self.transport.written)
+
+        await asyncio.sleep(0.02)
+        packets = self.decode_written()
+        self.assertEqual(1, len(packets))
+        sals = list(packets[0])
+        self.assertEqual(4, len(sals))
+        self.assertIsInstance(sals[0], LightingOnSAL)
+        self.assertIsInstance(sals[1], LightingOffSAL)
+        self.assertIsInstance(sals[2], LightingOffSAL)
+        self.assertIsInstance(sals[3], LightingRampSAL)
+        self.assertEqual([1, 2, 3, 4], [s.group_address for s in sals])
+
+        p.data_received(packets[0].confirmation + b'.')
+        self.assertEqual([True] * 3, await asyncio.gather(f1, f2, f3))
+
+    @async_test
+    async def test_coalesce_split(self):
+        p = self.connect(coalesce_window=0.01)
+        f1 = p.lighting_group_on(range(8))
+        f2 = p.lighting_group_off([8, 9])
+        await asyncio.sleep(0.02)
+
+        packets = self.decode_written()
+        self.assertEqual([9, 1], [len(x) for x in packets])
+
+        # f2 needs both packets to be confirmed.
+        p.data_received(packets[0].confirmation + b'.')
+        self.assertTrue(await f1)
+        self.assertFalse(f2.done())
+
+        p.data_received(packets[1].confirmation + b'#')
+        self.assertFalse(await f2)
+
+    @async_test
+    async def test_coalesce_applications(self):
+        # SALs for different applications are sent in separate packets.
+        p = self.connect(coalesce_window=0.01)
+        p.lighting_group_on(1)
+        p.lighting_group_on(2, application=0x39)
+        p.lighting_group_ramp(3, 0, 100, application=0x39)
+        await asyncio.sleep(0.02)
+
+        packets = self.decode_written()
+        self.assertEqual([0x38, 0x39], [x.application for x in packets])
+        self.assertEqual([1], [s.group_address for s in packets[0]])
+        self.assertEqual([2, 3], [s.group_address for s in packets[1]])
+        self.assertTrue(all(s.application == 0x39 for s in packets[1]))
+
+    @async_test
+    async def test_coalesce_connection_lost(self):
+        p = self.connect(coalesce_window=0.01)
+        f = p.lighting_group_on(1)
+        p.connection_lost(None)
+        with self.assertRaises(IOError):
+            await f
+        await asyncio.sleep(0.02)
+        self.assertEqual([], self.transport.written)
+
+
+class PCIProtocolGroupLevelTest(ConnectedTestCase):
+
+    def test_lighting_events(self):
+        p = RecordingPCIProtocol()
+        self.assertIsNone(p.get_group_level(8))
+        p.data_received(b'05013800790841\r\n')
+        self.assertEqual(255, p.get_group_level(8))
+        self.assertIsNone(p.get_group_level(8, application=0x39))
+
+        p.data_received(encode_from_pci(LightingRampSAL(8, 0, 100)))
+        self.assertEqual(100, p.get_group_level(8))
+        p.data_received(encode_from_pci(LightingOffSAL(8)))
+        self.assertEqual(0, p.get_group_level(8))
+
+    @mock.patch('cbus.protocol.pciprotocol.monotonic')
+    def test_ramp(self, monotonic):
+        monotonic.return_value = 100.
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(LightingOffSAL(8)))
+        p.data_received(encode_from_pci(LightingRampSAL(8, 8, 200)))
+        self.assertEqual(0, p.get_group_level(8))
+
+        monotonic.return_value = 102.
+        self.assertEqual(50, p.get_group_level(8))
+        monotonic.return_value = 106.
+        self.assertEqual(150, p.get_group_level(8))
+        monotonic.return_value = 108.
+        self.assertEqual(200, p.get_group_level(8))
+        self.assertEqual({}, p._ramps)
+
+    @mock.patch('cbus.protocol.pciprotocol.monotonic')
+    def test_terminate_ramp(self, monotonic):
+        monotonic.return_value = 100.
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(LightingRampSAL(8, 0, 200)))
+        p.data_received(encode_from_pci(LightingRampSAL(8, 4, 0)))
+
+        monotonic.return_value = 101.
+        p.data_received(encode_from_pci(LightingTerminateRampSAL(8)))
+        self.assertEqual(('terminate', 5, 8, 0x38), p.events[-1])
+
+        # Stays at the level it stopped at.
+        monotonic.return_value = 110.
+        self.assertEqual(150, p.get_group_level(8))
+
+    @mock.patch('cbus.protocol.pciprotocol.monotonic')
+    def test_ramp_unknown_origin(self, monotonic):
+        monotonic.return_value = 100.
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(LightingRampSAL(8, 4, 200)))
+
+        # The level is unknown until the ramp finishes.
+        self.assertIsNone(p.get_group_level(8))
+        monotonic.return_value = 103.
+        self.assertIsNone(p.get_group_level(8))
+        monotonic.return_value = 104.
+        self.assertEqual(200, p.get_group_level(8))
+
+        # A status report replaces the estimate.
+        p.data_received(encode_from_pci(LightingOffSAL(9)))
+        p.data_received(encode_from_pci(LightingRampSAL(9, 4, 200)))
+        p.handle_cbus_packet(ExtendedCAL(
+            False, Application.LIGHTING, 8,
+            LevelStatusReport([None, 20])))
+        self.assertEqual(20, p.get_group_level(9))
+
+    @mock.patch('cbus.protocol.pciprotocol.monotonic')
+    def test_terminate_ramp_unknown_origin(self, monotonic):
+        monotonic.return_value = 100.
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(LightingRampSAL(8, 4, 200)))
+
+        monotonic.return_value = 101.
+        p.data_received(encode_from_pci(LightingTerminateRampSAL(8)))
+
+        # The group stopped somewhere between its unknown origin and 200.
+        self.assertIsNone(p.get_group_level(8))
+        monotonic.return_value = 110.
+        self.assertIsNone(p.get_group_level(8))
+
+    @async_test
+    async def test_request_group_levels(self):
+        p = self.connect()
+        f = p.request_group_levels(0x45, 0x39)
+        packet, _ = decode_packet(self.transport.written[0], from_pci=False)
+        self.assertIsInstance(packet[0], StatusRequestSAL)
+        self.assertEqual(0x40, packet[0].group_address)
+        self.assertEqual(0x39, packet[0].child_application)
+        p.data_received(b'h.')
+        self.assertTrue(await f)
+
+    def test_other_lighting_application(self):
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(LightingOnSAL(8, 0x39)))
+        self.assertEqual([('on', 5, 8, 0x39)], p.events)
+        self.assertEqual(255, p.get_group_level(8, application=0x39))
+        self.assertIsNone(p.get_group_level(8))
+
+    def test_binary_report(self):
+        p = RecordingPCIProtocol()
+        p.data_received(encode_from_pci(LightingRampSAL(3, 0, 100)))
+        p.events.clear()
+
+        p.data_received(
+            b'86999900F9003800A8AA0200000000000000000000000000000000000000'
+            b'C3\r\n')
+        self.assertIsNone(p.get_group_level(0))
+        for ga in range(1, 9):
+            self.assertEqual(0, p.get_group_level(ga))
+        self.assertIsNone(p.get_group_level(9))
+        self.assertEqual(
+            [('level', 0x38, ga, 0) for ga in range(1, 9)], p.events)
+
+        p.events.clear()
+        p.handle_cbus_packet(ExtendedCAL(
+            False, Application.LIGHTING, 0,
+            BinaryStatusReport([GroupState.ON] * 4)))
+
+        # Binary reports don't have a level, so keep a known level if on.
+        self.assertEqual(255, p.get_group_level(0))
+        self.assertEqual(255, p.get_group_level(3))
+        self.assertEqual(
+            [('level', 0x38, ga, 255) for ga in range(4)], p.events)
+
+        p.data_received(encode_from_pci(LightingRampSAL(3, 0, 100)))
+        p.handle_cbus_packet(ExtendedCAL(
+            False, Application.LIGHTING, 0,
+            BinaryStatusReport([GroupState.ON] * 4)))
+        self.assertEqual(100, p.get_group_level(3))
+
+    def test_level_report(self):
+        p = RecordingPCIProtocol()
+        p.handle_cbus_packet(ExtendedCAL(
+            False, Application.LIGHTING, 0xfe,
+            LevelStatusReport([128, None, 255, 0])))
+
+        self.assertEqual(128, p.get_group_level(0xfe))
+        self.assertIsNone(p.get_group_level(0xff))
+        self.assertEqual([('level', 0x38, 0xfe, 128)], p.events)
+
+    @async_test
+    async def test_refresh_levels(self):
+        p = self.connect()
+        task = asyncio.create_task(p.refresh_levels(interval=0))
+        requests = []
+        while not task.done():
+            await asyncio.sleep(0)
+            for w in self.transport.written:
+                packet, _ = decode_packet(w, from_pci=False)
+                requests.extend(packet)
+                p.data_received(packet.confirmation + b'.')
+            self.transport.clear()
+
+        await task
+        self.assertEqual(8, len(requests))
+        for block_start, sal in zip(range(0, 0x100, 0x20), requests):
+            self.assertIsInstance(sal, StatusRequestSAL)
+            self.assertTrue(sal.level_request)
+            self.assertEqual(Application.LIGHTING, sal.child_application)
+            self.assertEqual(block_start, sal.group_address)
+
+    @async_test
+    async def test_refresh_levels_failures(self):
+        p = self.connect(max_retries=0)
+        task = asyncio.create_task(p.refresh_levels(interval=0))
+        blocks = []
+        with self.assertLogs('cbus.protocol.pciprotocol', 'WARNING') as logs:
+            while not task.done():
+                await asyncio.sleep(0)
+                for w in self.transport.written:
+                    packet, _ = decode_packet(w, from_pci=False)
+                    block = packet[0].group_address
+                    blocks.append(block)
+                    # Reject the first block, and fail the second.
+                    if block == 0x20:
+                        p.data_received(b'!')
+                    else:
+                        p.data_received(packet.confirmation +
+                                        (b'#' if block == 0 else b'.'))
+                self.transport.clear()
+            await task
+
+        # Every block is requested, even after a failure.
+        self.assertEqual(list(range(0, 0x100, 0x20)), blocks)
+        self.assertEqual(2, len(logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
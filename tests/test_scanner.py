@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# test_scanner.py - Tests for the IDENTIFY network scanner
+# Copyright 2020 Michael Farrell <micolous+git@gmail.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import asyncio
+import unittest
+
+from cbus.common import IdentifyAttribute
+from cbus.protocol.cal.reply import ReplyCAL
+from cbus.protocol.pciprotocol import PCIProtocol
+from cbus.protocol.pp_packet import PointToPointPacket
+from cbus.protocol.scanner import NetworkScanner
+
+from .utils import async_test
+
+
+class FakeNetwork:
+    """
+    Transport which confirms every command, and replies to IDENTIFY requests
+    for the units in ``units``.
+
+    IDENTIFY requests for units in ``failing`` are rejected by the PCI.
+    """
+
+    def __init__(self, units, failing=()):
+        self.units = units
+        self.failing = failing
+        self.protocol = None
+        self.requests = []
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.closing = False
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def write(self, data: bytes) -> None:
+        data = data.rstrip(b'\r')
+        if not data.startswith(b'\\'):
+            # Reset and device management commands aren't confirmed.
+            return
+
+        loop = asyncio.get_event_loop()
+        unit_address = attribute = None
+        if data.startswith(b'\\06'):
+            # \06 UU 00 21 AA CC c
+            unit_address = int(data[3:5], 16)
+            attribute = int(data[9:11], 16)
+
+        if unit_address in self.failing:
+            loop.call_soon(self.protocol.data_received, data[-1:] + b'#')
+            return
+        loop.call_soon(self.protocol.data_received, data[-1:] + b'.')
+        if unit_address is None:
+            return
+
+        self.requests.append((unit_address, attribute))
+        self.outstanding += 1
+        self.max_outstanding = max(self.max_outstanding, self.outstanding)
+        loop.call_later(0.01, self._reply, unit_address, attribute)
+
+    def _reply(self, unit_address: int, attribute: int) -> None:
+        self.outstanding -= 1
+        reply = self.units.get(unit_address, {}).get(attribute)
+        if reply is None:
+            return
+        p = PointToPointPacket(cals=[ReplyCAL(attribute, reply)])
+        p.source_address = unit_address
+        self.protocol.data_received(p.encode_packet() + b'\r\n')
+
+
+UNITS = {
+    0x02: {
+        IdentifyAttribute.TYPE: b'RELDN12 ',
+        IdentifyAttribute.FIRMWARE_VER: b'4.2.00  ',
+        IdentifyAttribute.GAV_CURRENT: b'\x01\x02\xff',
+    },
+    0x10: {
+        IdentifyAttribute.TYPE: b'DIMDN8  ',
+        IdentifyAttribute.FIRMWARE_VER: b'1.0.00  ',
+    },
+}
+
+
+class NetworkScannerTest(unittest.TestCase):
+
+    def connect(self, units=UNITS, failing=()) -> PCIProtocol:
+        p = PCIProtocol(timesync_frequency=0, handle_clock_requests=False,
+                        max_retries=0)
+        self.network = FakeNetwork(units, failing)
+        self.network.protocol = p
+        p.connection_made(self.network)
+        return p
+
+    @async_test
+    async def test_identify_reply(self):
+        p = self.connect()
+        self.assertEqual(b'RELDN12 ', await p.identify_reply(
+            2, IdentifyAttribute.TYPE))
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await p.identify_reply(3, IdentifyAttribute.TYPE, timeout=0.1)
+        self.assertEqual({}, p._reply_waiters)
+
+    @async_test
+    async def test_identify_reply_rejected(self):
+        p = self.connect(failing={2})
+        # Every caller waiting for the same reply gets the error.
+        results = await asyncio.gather(*(
+            p.identify_reply(2, IdentifyAttribute.TYPE) for _ in range(2)),
+            return_exceptions=True)
+        for result in results:
+            self.assertIsInstance(result, IOError)
+            self.assertNotIsInstance(result, asyncio.TimeoutError)
+        self.assertEqual({}, p._reply_waiters)
+
+    @async_test
+    async def test_scan(self):
+        p = self.connect()
+        scanner = NetworkScanner(p, max_outstanding=8, timeout=0.1)
+        units = [u async for u in scanner.scan(range(0x20))]
+        units.sort(key=lambda u: u.unit_address)
+
+        self.assertEqual([2, 0x10], [u.unit_address for u in units])
+        self.assertEqual('RELDN12', units[0].unit_type)
+        self.assertEqual('4.2.00', units[0].firmware_version)
+        self.assertEqual((1, 2, 0xff), units[0].group_addresses)
+        self.assertEqual('DIMDN8', units[1].unit_type)
+        self.assertIsNone(units[1].group_addresses)
+
+        # Units which don't reply to the probe are only asked once.
+        self.assertEqual(0x20 + 4, len(self.network.requests))
+        self.assertLessEqual(self.network.max_outstanding, 8)
+        self.assertGreater(self.network.max_outstanding, 1)
+
+    @async_test
+    async def test_scan_rejected(self):
+        p = self.connect(failing={2})
+        scanner = NetworkScanner(p, timeout=0.1)
+        with self.assertLogs('cbus.protocol.scanner', 'WARNING'):
+            units = [u async for u in scanner.scan(range(0x20))]
+
+        # One unit failing doesn't stop the others being scanned.
+        self.assertEqual([0x10], [u.unit_address for u in units])
+
+    @async_test
+    async def test_scan_connection_lost(self):
+        p = self.connect()
+        scanner = NetworkScanner(p, timeout=0.1)
+        asyncio.get_event_loop().call_later(0.05, p.connection_lost, None)
+
+        units = []
+        with self.assertRaises(IOError) as cm:
+            async for unit in scanner.scan():
+                units.append(unit)
+
+        # The scan stops, rather than timing out on every other unit.
+        self.assertNotIsInstance(cm.exception, asyncio.TimeoutError)
+        self.assertLess(len(self.network.requests), 0x100)
+
+    @async_test
+    async def test_scan_bounded(self):
+        p = self.connect()
+        scanner = NetworkScanner(p, max_outstanding=1, timeout=0.1)
+        units = [u async for u in scanner.scan([1, 2])]
+        self.assertEqual([2], [u.unit_address for u in units])
+        self.assertEqual(1, self.network.max_outstanding)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            NetworkScanner(None, attributes=[])
+        with self.assertRaises(ValueError):
+            NetworkScanner(None, max_outstanding=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
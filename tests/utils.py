@@ -18,6 +18,8 @@
 
 from __future__ import absolute_import
 
+import asyncio
+from functools import wraps
 from typing import Optional
 import unittest
 
@@ -27,6 +29,31 @@ from cbus.protocol.pp_packet import PointToPointPacket
 from cbus.protocol.packet import decode_packet
 
 
+def async_test(f):
+    """Runs a coroutine test method in a new event loop."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return asyncio.run(f(*args, **kwargs))
+    return wrapper
+
+
+class FakeTransport:
+    """Transport which records everything written to it."""
+
+    def __init__(self):
+        self.written = []
+        self.closing = False
+
+    def write(self, data: bytes) -> None:
+        self.written.append(data)
+
+    def clear(self) -> None:
+        self.written.clear()
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+
 class CBusTestCase(unittest.TestCase):
 
     def decode_packet(